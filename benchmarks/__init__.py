@@ -0,0 +1,42 @@
+"""
+Benchmarks and load tests of the bot. They run offline, against the fake OpenAI clients of
+`benchmarks.fakes` and a local vector index, for example:
+
+    python -m benchmarks.load_test
+    python -m benchmarks.prompt_assembly --messages 5000
+
+Importing the package points the bot to a scratch directory before any bot module reads the config,
+so the benchmarks never write to the configured database, caches or archive. Set BENCHMARK_DATABASE_URL
+to run them against another database, like a local PostgreSQL.
+"""
+import logging
+import os
+import tempfile
+
+# The bot logs every request, which would bury the results
+logging.disable(logging.INFO)
+
+WORK_DIR = os.getenv("BENCHMARK_DIR") or tempfile.mkdtemp(prefix="bot-benchmarks-")
+
+# Settings the config module requires, whose values don't matter offline
+for _name, _value in (("TELEGRAM_BOT_TOKEN", "123456:benchmark"), ("OPENAI_API_KEY", "benchmark"),
+                      ("PINECONE_API_KEY", "benchmark"), ("INDEX_NAME", "benchmark"),
+                      ("AUTHORIZED_USERNAMES", "admin")):
+    os.environ.setdefault(_name, _value)
+
+import config  # noqa: E402
+
+# Set on the module rather than in the environment, since config loads the .env file over the environment
+config.DATABASE_URL = os.getenv("BENCHMARK_DATABASE_URL", f"sqlite:///{os.path.join(WORK_DIR, 'bot.db')}")
+config.ASYNC_DATABASE_URL = (config.DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://', 1)
+                             .replace('sqlite://', 'sqlite+aiosqlite://', 1))
+config.VECTOR_BACKEND = "local"
+config.LOCAL_INDEX_PATH = os.path.join(WORK_DIR, "local_index")
+config.LEXICAL_INDEX_PATH = os.path.join(WORK_DIR, "lexical_index.jsonl")
+config.EMBEDDING_DISK_CACHE_PATH = ""
+config.INGEST_MANIFEST_PATH = os.path.join(WORK_DIR, "ingestion_manifest.sqlite3")
+config.INGEST_JOBS_PATH = os.path.join(WORK_DIR, "ingestion_jobs.sqlite3")
+config.MESSAGE_LOG_DEAD_LETTER_PATH = os.path.join(WORK_DIR, "message_log_dead_letters.jsonl")
+config.CHAT_ARCHIVE_PATH = os.path.join(WORK_DIR, "archive")
+config.UPLOAD_FOLDER = os.path.join(WORK_DIR, "uploaded_files")
+config.SUMMARIZER = "fake"
@@ -0,0 +1,133 @@
+"""
+Benchmark of the document chunking: vectors per document and retrieval hit rate of the sections as the
+readers return them, one vector per .docx paragraph or .pdf page like before the chunking stage, against
+the chunks of `chunk_sections`.
+
+The documents are generated handbooks: headings, empty paragraphs and filler paragraphs, with one fact
+per topic like "The access code of the Kaloren tiv room is K-4821.". Every question asks for one fact, and
+is a hit when one of the RETRIEVAL_K retrieved texts contains the answer, with the vectors alone and with
+the hybrid retrieval of the bot, fused with the BM25 index. The embeddings are the word hashing
+`FakeEmbeddings`, so the hit rates compare the chunkings rather than measure a real model.
+
+    python -m benchmarks.chunking_quality --documents 20
+"""
+import argparse
+import os
+import random
+from typing import Dict, List, Tuple
+import numpy as np
+import benchmarks
+from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, RETRIEVAL_CANDIDATES, RETRIEVAL_K
+from model.utils import count_tokens
+from storage.chunking import Section, chunk_sections
+from storage.lexical import BM25Index, reciprocal_rank_fusion
+from .fakes import FakeEmbeddings
+
+FILLER_WORDS = ("employee", "policy", "manager", "request", "team", "office", "schedule", "process", "report",
+                "customer", "project", "approval", "document", "system", "meeting", "budget", "training",
+                "support", "quality", "safety", "contract", "invoice", "holiday", "payment", "review", "email",
+                "should", "must", "can", "always", "never", "usually", "before", "after", "during", "within",
+                "each", "every", "the", "a", "with", "for", "to", "from", "and", "or", "on", "in", "by", "of")
+SYLLABLES = ("ka", "lo", "mi", "ren", "sa", "tor", "vel", "zu", "bri", "dan", "fe", "gor", "hal", "ix", "jun",
+             "mar", "nop", "qua", "ros", "tiv")
+
+# A question and its expected answer
+Fact = Tuple[str, str]
+
+
+def invented_word(rng: random.Random, syllables: int = 3) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+def sentence(rng: random.Random, topic_words: List[str]) -> str:
+    # Sections are about their topic, like the paragraphs under a heading of a real handbook
+    words = [rng.choice(topic_words) if rng.random() < 0.3 else rng.choice(FILLER_WORDS)
+             for _ in range(rng.randint(8, 16))]
+    return " ".join(words).capitalize() + "."
+
+
+def generate_documents(documents: int, topics: int, seed: int) -> Tuple[List[List[str]], List[Fact]]:
+    """
+    Generates the paragraphs of handbook-like documents, and the questions about their facts.
+
+    Returns:
+        Tuple[List[List[str]], List[Fact]]: The paragraphs of every document, and the questions with their answers.
+    """
+    rng = random.Random(seed)
+    paragraphs_per_document, facts = [], []
+    for _ in range(documents):
+        paragraphs = []
+        for _ in range(topics):
+            name = invented_word(rng).capitalize()
+            topic_words = [invented_word(rng, 2) for _ in range(4)]
+            code = f"{rng.choice('ABCDEFGHJK')}-{rng.randint(1000, 9999)}"
+            facts.append((f"What is the access code of the {name} {topic_words[0]} room?", code))
+            paragraphs += [f"{name} {topic_words[0]}", ""]
+            body = [" ".join(sentence(rng, topic_words) for _ in range(rng.randint(2, 4)))
+                    for _ in range(rng.randint(3, 6))]
+            body[rng.randrange(len(body))] += f" The access code of the {name} {topic_words[0]} room is {code}."
+            paragraphs += body
+        paragraphs_per_document.append(paragraphs)
+    return paragraphs_per_document, facts
+
+
+def as_pages(paragraphs: List[str], words_per_page: int) -> List[Section]:
+    pages, page = [], []
+    for paragraph in paragraphs:
+        page.append(paragraph)
+        if sum(len(text.split()) for text in page) >= words_per_page:
+            pages.append(("\n".join(page), {"page": len(pages) + 1}))
+            page = []
+    if page:
+        pages.append(("\n".join(page), {"page": len(pages) + 1}))
+    return pages
+
+
+def evaluate(name: str, documents: List[List[Section]], facts: List[Fact], chunked: bool, max_tokens: int,
+             overlap: int) -> Dict[str, float]:
+    texts = []
+    for sections in documents:
+        if chunked:
+            texts += [chunk.text for chunk in chunk_sections(sections, max_tokens=max_tokens, overlap=overlap)]
+        else:
+            texts += [text for text, _ in sections]
+    embeddings = FakeEmbeddings()
+    matrix = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    queries = np.asarray(embeddings.embed_documents([question for question, _ in facts]), dtype=np.float32)
+    candidates = np.argsort(-(queries @ matrix.T), axis=1)[:, :RETRIEVAL_CANDIDATES]
+    lexical_index = BM25Index(os.path.join(benchmarks.WORK_DIR, f"{name}-{'chunks' if chunked else 'sections'}.jsonl"))
+    lexical_index.add_many((str(position), text, text) for position, text in enumerate(texts))
+
+    vector_hits = hybrid_hits = 0
+    for (question, answer), positions in zip(facts, candidates):
+        vector_results = [texts[position] for position in positions]
+        lexical_results = [content for _, _, content in lexical_index.search(question, RETRIEVAL_CANDIDATES)]
+        vector_hits += any(answer in text for text in vector_results[:RETRIEVAL_K])
+        hybrid_hits += any(answer in text for text in
+                           reciprocal_rank_fusion([vector_results, lexical_results])[:RETRIEVAL_K])
+    return {"vectors": len(texts), "vectors_per_document": round(len(texts) / len(documents), 1),
+            "embedded_tokens": sum(count_tokens(text) for text in texts if text),
+            "vector_hit_rate": round(vector_hits / len(facts), 3), "hybrid_hit_rate": round(hybrid_hits / len(facts), 3)}
+
+
+def main(args: argparse.Namespace) -> None:
+    paragraphs, facts = generate_documents(args.documents, args.topics, args.seed)
+    formats = {".docx paragraphs": [[(text, {}) for text in document] for document in paragraphs],
+               ".pdf pages": [as_pages(document, args.words_per_page) for document in paragraphs]}
+    print(f"{args.documents} documents, {len(facts)} questions, top {RETRIEVAL_K}, chunks of {args.max_tokens} "
+          f"tokens with {args.overlap} tokens overlap")
+    for name, documents in formats.items():
+        for label, chunked in (("before", False), ("after", True)):
+            print(f"{name:17} {label:6} {evaluate(name.split()[0][1:], documents, facts, chunked, args.max_tokens, args.overlap)}")
+    print(f"Data in {benchmarks.WORK_DIR}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--topics", type=int, default=10, help="Facts per document")
+    parser.add_argument("--words-per-page", type=int, default=500)
+    parser.add_argument("--max-tokens", type=int, default=CHUNK_MAX_TOKENS)
+    parser.add_argument("--overlap", type=int, default=CHUNK_OVERLAP_TOKENS)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,72 @@
+"""
+Regression benchmark of the memory and prompt size over a long conversation: a user asks `--messages`
+questions, and every `--every` messages the benchmark reports the memory allocated by Python and the
+size of the last prompt. Both should stay flat once the history fills the prompt and the summary
+takes over, instead of growing with every message.
+
+    python -m benchmarks.conversation_memory --messages 10000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import time
+import tracemalloc
+import benchmarks
+from model.cache import AnswerCache
+from model.chat_model import get_answer
+from model.embeddings import EmbeddingCache
+from model.summarizer import update_summary
+from storage.message_log import get_message_log
+from storage.models import create_tables
+from storage.registry import get_registry
+from storage.sqlalchemy_database import record_message
+from .fakes import FakeChatModel, install_fakes
+
+
+async def main(args: argparse.Namespace) -> None:
+    create_tables()
+    registry = get_registry()
+    chat = FakeChatModel(latency=0, words=args.answer_words)
+    install_fakes(registry, chat)
+    # The caches are bounded, but would take thousands of messages to fill at their default sizes
+    registry.answer_cache = AnswerCache(max_size=args.cache_size)
+    registry.embeddings.cache = EmbeddingCache(size=args.cache_size, disk_path="")
+    registry.warm_up()
+    user_id = 1
+
+    tracemalloc.start()
+    samples = []
+    started = time.monotonic()
+    for number in range(1, args.messages + 1):
+        # Distinct questions, so every answer is generated
+        question = f"question {number}: what does the handbook say about topic {number % 97}?"
+        await record_message(user_id, None, False, question, False)
+        answer = await get_answer(question, registry.chat, registry.vectorstore, registry.embeddings,
+                                  registry.answer_cache, registry.lexical_index, user_id, None)
+        await record_message(user_id, None, True, answer, False)
+        await update_summary(registry.summarizer, user_id, None)
+
+        if number % args.every == 0:
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            samples.append({"messages": number, "memory_mb": round(current / 2 ** 20, 2),
+                            "prompt_messages": chat.prompt_messages, "prompt_chars": chat.prompt_chars,
+                            "seconds": round(time.monotonic() - started, 1)})
+            print(json.dumps(samples[-1]), flush=True)
+    await asyncio.to_thread(get_message_log().flush)
+
+    # The first sample is taken once the caches and the history are warm
+    first, last = samples[min(1, len(samples) - 1)], samples[-1]
+    print(f"From {first['messages']} to {last['messages']} messages: memory {first['memory_mb']} -> "
+          f"{last['memory_mb']} MB, largest prompt {max(sample['prompt_chars'] for sample in samples)} "
+          f"characters, data in {benchmarks.WORK_DIR}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10000, help="Questions asked by the user")
+    parser.add_argument("--every", type=int, default=1000, help="Messages between two samples")
+    parser.add_argument("--cache-size", type=int, default=100, help="Entries of the answer and embedding caches")
+    parser.add_argument("--answer-words", type=int, default=200, help="Words of every answer")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,118 @@
+"""
+Offline stand-ins for the OpenAI clients, with a configurable latency, that count the requests they get.
+"""
+import asyncio
+import hashlib
+import re
+import time
+from typing import AsyncIterator, List, Optional, Sequence
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from config import INDEX_DIMENSION
+from model.embeddings import EmbeddingCache, EmbeddingService
+from storage.registry import ClientRegistry
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Embeddings of the character trigrams of the words of a text hashed into `dimension` buckets, so texts
+    sharing words are close like with a real model, and long rare words weigh more than short common ones.
+    """
+
+    def __init__(self, dimension: int = INDEX_DIMENSION, latency: float = 0.0):
+        """
+        Args:
+            dimension (int): The dimension of the embeddings.
+            latency (float): The number of seconds every request takes.
+        """
+        self.dimension = dimension
+        self.latency = latency
+        # Number of requests, and of texts embedded
+        self.calls = 0
+        self.texts = 0
+
+    def embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            word = f"<{word}>"
+            for start in range(len(word) - 2):
+                trigram = word[start:start + 3].encode("utf-8")
+                vector[int.from_bytes(hashlib.md5(trigram).digest()[:4], "little") % self.dimension] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency)
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        await asyncio.sleep(self.latency)
+        return [self.embed(text) for text in texts]
+
+
+class FakeChatModel:
+    """
+    Chat model answering after `latency` seconds, streaming the answer word by word, and recording the
+    size of every prompt it gets.
+    """
+
+    def __init__(self, latency: float = 0.5, words: int = 40, blocking: bool = False):
+        """
+        Args:
+            latency (float): The number of seconds an answer takes.
+            words (int): The number of words of an answer.
+            blocking (bool): Waits with `time.sleep`, blocking the event loop like a synchronous client.
+        """
+        self.latency = latency
+        self.words = words
+        self.blocking = blocking
+        self.calls = 0
+        # Number of messages and of characters of the last prompt
+        self.prompt_messages = 0
+        self.prompt_chars = 0
+
+    def _record(self, messages: Sequence[BaseMessage]) -> str:
+        self.calls += 1
+        self.prompt_messages = len(messages)
+        self.prompt_chars = sum(len(message.content) for message in messages)
+        return " ".join(f"word{number}" for number in range(self.words))
+
+    async def _wait(self, seconds: float) -> None:
+        if self.blocking:
+            time.sleep(seconds)
+        else:
+            await asyncio.sleep(seconds)
+
+    async def ainvoke(self, messages: Sequence[BaseMessage], **kwargs) -> AIMessage:
+        answer = self._record(messages)
+        await self._wait(self.latency)
+        return AIMessage(content=answer)
+
+    async def astream(self, messages: Sequence[BaseMessage], **kwargs) -> AsyncIterator[AIMessageChunk]:
+        words = self._record(messages).split()
+        for number, word in enumerate(words):
+            await self._wait(self.latency / len(words))
+            yield AIMessageChunk(content=word if number == 0 else f" {word}")
+
+
+def install_fakes(registry: ClientRegistry, chat: Optional[FakeChatModel] = None,
+                  embeddings: Optional[FakeEmbeddings] = None) -> None:
+    """
+    Replaces the OpenAI clients of a registry by fakes. The vector store is the local index, created on
+    first use with the fake embeddings.
+
+    Args:
+        registry (ClientRegistry): The registry used by the handlers.
+        chat (FakeChatModel): The chat model, a default one if not given.
+        embeddings (FakeEmbeddings): The embeddings model, a default one if not given.
+    """
+    registry._chat = chat or FakeChatModel()
+    registry._embeddings = EmbeddingService(embeddings or FakeEmbeddings(), EmbeddingCache(disk_path=""))
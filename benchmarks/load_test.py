@@ -0,0 +1,82 @@
+"""
+Load test of the answer pipeline: runs the bot in-process against the fake Bot API of
+`bot.fake_telegram` and fake OpenAI clients, with a growing number of users who each send a question,
+wait for the answer and send the next one. Throughput should grow with the users up to
+MAX_CONCURRENT_ANSWERS, while with --blocking, where the chat model blocks the event loop like the
+synchronous pipeline did, it stays flat.
+
+    python -m benchmarks.load_test --users 1 4 16 64 --messages 5 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import time
+from aiohttp import web
+from telegram import Update
+import benchmarks
+import config
+from bot.fake_telegram import FakeTelegram
+from .fakes import FakeChatModel, install_fakes
+
+
+async def run_users(application, telegram: FakeTelegram, users: int, messages: int, first_chat: int,
+                    timeout: float) -> float:
+    async def user(chat_id: int) -> None:
+        for number in range(messages):
+            update = telegram.update(chat_id, f"question {number} from user {chat_id}")
+            telegram.sent[chat_id].append(time.monotonic())
+            application.update_queue.put_nowait(Update.de_json(update, application.bot))
+            await telegram.wait_answered(chat_id, number + 1, timeout)
+
+    started = time.monotonic()
+    await asyncio.gather(*(user(first_chat + chat) for chat in range(users)))
+    return time.monotonic() - started
+
+
+async def main(args: argparse.Namespace) -> None:
+    telegram = FakeTelegram()
+    runner = web.AppRunner(telegram.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    # Read by the bot modules, which are only imported now
+    config.TELEGRAM_API_URL = f"http://127.0.0.1:{args.port}"
+    config.STREAM_ANSWERS = False
+    from bot.setup import setup_telegram_bot
+    from storage.registry import get_registry
+
+    application = setup_telegram_bot()
+    install_fakes(get_registry(), FakeChatModel(args.latency, blocking=args.blocking))
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    results = []
+    first_chat = 1000
+    try:
+        for users in args.users:
+            seconds = await run_users(application, telegram, users, args.messages, first_chat, args.timeout)
+            report = telegram.report(chats=range(first_chat, first_chat + users))
+            results.append({"users": users, "answered": report["answered"], "seconds": round(seconds, 2),
+                            "answers_per_second": round(report["answered"] / seconds, 2),
+                            "latency_ms": report["latency_ms"]})
+            print(json.dumps(results[-1]), flush=True)
+            first_chat += users
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+        await runner.cleanup()
+    print(f"Throughput with {args.users[-1]} users: "
+          f"{results[-1]['answers_per_second'] / results[0]['answers_per_second']:.1f}x "
+          f"that of {args.users[0]} user(s), data in {benchmarks.WORK_DIR}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--messages", type=int, default=5, help="Questions asked by every user")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds the chat model takes to answer")
+    parser.add_argument("--blocking", action="store_true", help="The chat model blocks the event loop")
+    parser.add_argument("--port", type=int, default=8091, help="Port of the fake Bot API")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for an answer")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,83 @@
+"""
+Benchmark of saving chat messages: `--handlers` concurrent handlers each save `--exchanges` question
+and answer pairs, with a commit per message like before the message log, and with the write-behind
+message log. Reports the messages saved per second, until the last one is committed, and the latency
+of saving an exchange as seen by the handler.
+
+The last run adds a message the database rejects every `--rejected-every` messages, which goes to the
+dead-letter file without holding back the messages around it.
+
+    python -m benchmarks.message_log --handlers 16 --exchanges 200
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import statistics
+import time
+from typing import Iterator, List
+import benchmarks
+import storage.sqlalchemy_database as sqlalchemy_database
+from storage.message_log import get_message_log
+from storage.models import Message, SessionLocal, create_tables
+from storage.sqlalchemy_database import record_message
+
+# Larger than a 64-bit integer, so the database rejects the message
+REJECTED_USER_ID = 2 ** 70
+
+
+async def handler(user_id: int, exchanges: int, rejected_every: int, counter: Iterator[int],
+                  latencies: List[float]) -> None:
+    for number in range(exchanges):
+        started = time.perf_counter()
+        await record_message(user_id, None, False, f"question {number} about the vacation policy", False)
+        await record_message(user_id, None, True, f"answer {number}: " + "the handbook says " * 20, False)
+        # Counted across the handlers, two messages per exchange
+        if rejected_every and next(counter) % (rejected_every // 2) == rejected_every // 2 - 1:
+            await record_message(REJECTED_USER_ID, None, False, f"rejected {number}", False)
+        latencies.append(time.perf_counter() - started)
+        # Lets the other handlers run, like the wait for the chat model would
+        await asyncio.sleep(0)
+
+
+def saved_messages(first_user_id: int, handlers: int) -> int:
+    with SessionLocal() as db:
+        return db.query(Message).filter(Message.user_id.between(first_user_id, first_user_id + handlers - 1)).count()
+
+
+async def run(name: str, write_behind: bool, first_user_id: int, args: argparse.Namespace, rejected_every: int = 0) -> None:
+    sqlalchemy_database.WRITE_BEHIND_MESSAGES = write_behind
+    latencies: List[float] = []
+    counter = itertools.count()
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(first_user_id + number, args.exchanges, rejected_every, counter, latencies)
+                           for number in range(args.handlers)))
+    if write_behind:
+        await asyncio.to_thread(get_message_log().flush)
+    seconds = time.perf_counter() - started
+    saved = saved_messages(first_user_id, args.handlers)
+    latencies.sort()
+    print(f"{name:32} {{'messages_per_second': {round(saved / seconds)}, "
+          f"'p50_ms': {statistics.median(latencies) * 1000:.2f}, "
+          f"'p99_ms': {latencies[int(len(latencies) * 0.99)] * 1000:.2f}, 'saved': {saved}}}", flush=True)
+
+
+async def main(args: argparse.Namespace) -> None:
+    create_tables()
+    await run("commit per message", False, 1, args)
+    await run("write-behind", True, 1 + args.handlers, args)
+    await run(f"write-behind, 1 rejected/{args.rejected_every}", True, 1 + 2 * args.handlers, args,
+              rejected_every=args.rejected_every)
+    dead_letters = get_message_log().dead_letter_path
+    if os.path.exists(dead_letters):
+        with open(dead_letters, encoding="utf-8") as file:
+            print(f"{sum(1 for _ in file)} rejected messages in {dead_letters}")
+    print(f"Data in {benchmarks.WORK_DIR}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, default=16, help="Concurrent handlers")
+    parser.add_argument("--exchanges", type=int, default=200, help="Question and answer pairs per handler")
+    parser.add_argument("--rejected-every", type=int, default=1000, help="Messages per rejected message")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""
+Micro-benchmark of the prompt assembly on a long conversation. Compares the trimming loop `get_answer`
+used to run, which loaded the whole history and tokenized the joined prompt again after dropping every
+exchange, with the current assembly, which reads the latest messages until their stored token counts
+fill the budget.
+
+    python -m benchmarks.prompt_assembly --messages 5000
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List
+from langchain.schema import BaseMessage
+import benchmarks
+from config import MAX_TOKENS
+from model.prompt import base_messages_tokens, build_messages, to_chat_messages
+from model.utils import count_tokens
+from storage.models import Message, SessionLocal, create_tables
+from storage.sqlalchemy_database import get_recent_chat_history
+
+AUGMENTED_PROMPT = "Using the context below, and the previous chat history, answer the query.\n\n" \
+                   "Context:\n" + "The handbook describes the vacation policy in detail. " * 20 + \
+                   "\n\nQuery: how many vacation days do I have?"
+
+
+def seed_history(user_id: int, messages: int, words: int) -> None:
+    started = datetime.utcnow() - timedelta(minutes=messages)
+    rows = []
+    for number in range(messages):
+        content = " ".join(f"word{number}-{word}" for word in range(words))
+        rows.append(Message(user_id=user_id, group_id=None, content=content, is_bot=number % 2 == 1,
+                            is_group=False, timestamp=started + timedelta(minutes=number),
+                            token_count=count_tokens(content)))
+    with SessionLocal() as db:
+        db.add_all(rows)
+        db.commit()
+
+
+def legacy_prompt(user_id: int) -> List[BaseMessage]:
+    """
+    The prompt assembly of `get_answer` before token counts were stored with the messages.
+    """
+    with SessionLocal() as db:
+        chat_history = db.query(Message).filter(Message.user_id == user_id).order_by(Message.timestamp).all()
+    messages = build_messages(to_chat_messages(chat_history), AUGMENTED_PROMPT)
+    while count_tokens("".join(message.content for message in messages)) > MAX_TOKENS:
+        # Remove the oldest human-AI message pair
+        if len(messages) > 4:
+            messages.pop(3)
+            messages.pop(3)
+        else:
+            return []
+    return messages
+
+
+def current_prompt(user_id: int) -> List[BaseMessage]:
+    """
+    The prompt assembly of `get_answer`, without the retrieval and the summary.
+    """
+    token_budget = MAX_TOKENS - base_messages_tokens() - count_tokens(AUGMENTED_PROMPT)
+    with SessionLocal() as db:
+        chat_history = get_recent_chat_history(db, user_id, token_budget=token_budget)
+    return build_messages(to_chat_messages(chat_history), AUGMENTED_PROMPT)
+
+
+def measure(assemble: Callable[[int], List[BaseMessage]], user_id: int, repeat: int) -> dict:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        messages = assemble(user_id)
+        durations.append(time.perf_counter() - started)
+    return {"median_ms": round(statistics.median(durations) * 1000, 1), "max_ms": round(max(durations) * 1000, 1),
+            "prompt_messages": len(messages),
+            "prompt_tokens": count_tokens("".join(message.content for message in messages))}
+
+
+def main(args: argparse.Namespace) -> None:
+    create_tables()
+    seed_history(user_id=1, messages=args.messages, words=args.words)
+    legacy = measure(legacy_prompt, 1, args.repeat)
+    current = measure(current_prompt, 1, args.repeat)
+    print(f"{args.messages} messages of {args.words} words, {MAX_TOKENS} tokens budget")
+    print(f"legacy:  {legacy}")
+    print(f"current: {current}")
+    print(f"Speedup: {legacy['median_ms'] / current['median_ms']:.0f}x, data in {benchmarks.WORK_DIR}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000, help="Messages in the conversation")
+    parser.add_argument("--words", type=int, default=10, help="Words per message")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each assembly")
+    main(parser.parse_args())
@@ -0,0 +1,120 @@
+"""
+Benchmark of the ingestion of large .csv and .xlsx files of questions and answers: time and peak memory
+allocated by Python to read, chunk, embed and record every row. The peak should grow far slower than
+the file, since the rows are read in batches of TABULAR_BATCH_ROWS.
+
+The vectors and the keyword index are discarded, so the benchmark measures the ingestion pipeline rather
+than the vector store, and the embeddings are the small `FakeEmbeddings`. Every tenth row has an empty
+answer and every hundredth an empty question, like real spreadsheets.
+
+    python -m benchmarks.tabular_ingestion --rows 10000 100000 1000000
+"""
+import argparse
+import csv
+import os
+import time
+import tracemalloc
+from typing import Iterable, Tuple
+from openpyxl import Workbook
+import benchmarks
+from model.embeddings import EmbeddingCache, EmbeddingService
+from storage.manifest import IngestionManifest
+from storage.registry import get_registry
+from storage.trainers import train_tabular_data
+from storage.utils import read_tabular_batches
+from .fakes import FakeEmbeddings
+
+
+class DiscardingIndex:
+    """
+    Vector index accepting and forgetting every vector.
+    """
+
+    def upsert(self, vectors, **kwargs) -> dict:
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, **kwargs) -> dict:
+        return {}
+
+
+class DiscardingLexicalIndex:
+    """
+    Keyword index accepting and forgetting every document.
+    """
+
+    def add_many(self, documents: Iterable[Tuple[str, str, str]]) -> None:
+        for _ in documents:
+            pass
+
+    def remove_many(self, ids: Iterable[str]) -> None:
+        pass
+
+
+def qa_rows(rows: int) -> Iterable[Tuple[str, str]]:
+    for number in range(rows):
+        question = "" if number % 100 == 0 else f"How do I request the benefit number {number}?"
+        answer = "" if number % 10 == 0 else f"Fill in the form {number} and send it to your manager. " * 3
+        yield question, answer
+
+
+def write_csv(path: str, rows: int) -> None:
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+        writer.writerow(["question", "answer"])
+        writer.writerows(qa_rows(rows))
+
+
+def write_xlsx(path: str, rows: int) -> None:
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(["question", "answer"])
+    for question, answer in qa_rows(rows):
+        # Empty cells are missing from the sheet, like in a spreadsheet saved by a user
+        sheet.append([question or None, answer or None])
+    workbook.save(path)
+
+
+def measure(path: str, embeddings: FakeEmbeddings, trace_memory: bool) -> dict:
+    registry = get_registry()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.monotonic()
+    train_tabular_data(read_tabular_batches(path), registry.index, source=os.path.basename(path))
+    seconds = time.monotonic() - started
+    result = {"seconds": round(seconds, 1), "rows_per_second": round(embeddings.texts / seconds),
+              "file_mb": round(os.path.getsize(path) / 2 ** 20, 1), "chunks": embeddings.texts}
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_mb"] = round(peak / 2 ** 20, 1)
+    return result
+
+
+def main(args: argparse.Namespace) -> None:
+    registry = get_registry()
+    registry._index = DiscardingIndex()
+    registry._lexical_index = DiscardingLexicalIndex()
+    for rows in args.rows:
+        for extension, write in ((".csv", write_csv), (".xlsx", write_xlsx)):
+            if extension == ".xlsx" and rows > args.max_xlsx_rows:
+                continue
+            path = os.path.join(benchmarks.WORK_DIR, f"faq-{rows}{extension}")
+            write(path, rows)
+            # A fresh manifest and cache per file, so every row is embedded
+            embeddings = FakeEmbeddings(dimension=args.dimension)
+            registry._embeddings = EmbeddingService(embeddings, EmbeddingCache(size=args.cache_size, disk_path=""))
+            registry._manifest = IngestionManifest(os.path.join(benchmarks.WORK_DIR, f"manifest-{rows}{extension}.sqlite3"))
+            print(f"{rows:>8} rows {extension:5} {measure(path, embeddings, not args.no_memory)}", flush=True)
+    print(f"Data in {benchmarks.WORK_DIR}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--max-xlsx-rows", type=int, default=100000,
+                        help="Largest .xlsx file, since writing one takes minutes past this size")
+    parser.add_argument("--dimension", type=int, default=8, help="Dimension of the fake embeddings")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skips tracing the allocations, which slows the ingestion about 5 times")
+    parser.add_argument("--cache-size", type=int, default=1000, help="Entries of the embedding cache")
+    main(parser.parse_args())
@@ -0,0 +1,164 @@
+"""
+Local stand-in for Telegram, to run the webhook mode without a bot token or network access.
+
+It serves the Bot API methods the bot calls and sends fake user messages to the webhook ingress,
+then reports whether every message was answered and how long the answers took. Start it, then
+start the bot with TELEGRAM_API_URL pointing to it:
+
+    python -m bot.fake_telegram --chats 50 --messages 5 --text /help
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook python main.py
+
+Messages are sent once the ingress is listening.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "TeamForcer", "username": "fake_bot"}
+
+
+class FakeTelegram:
+    """
+    Fake Bot API server recording the messages the bot sends, and source of fake updates.
+    """
+
+    def __init__(self):
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        # Times the updates of every chat were sent, and the times of the first replies to them
+        self.sent: Dict[int, List[float]] = defaultdict(list)
+        self.answered: Dict[int, List[float]] = defaultdict(list)
+        self.replies: Dict[int, List[str]] = defaultdict(list)
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def message(self, chat_id: int, text: str = None) -> Dict[str, Any]:
+        return {"message_id": next(self._message_ids), "date": int(time.time()), "from": BOT_USER,
+                "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        chat_id = int(params["chat_id"]) if "chat_id" in params else None
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "sendMessage":
+            self.answered[chat_id].append(time.monotonic())
+            self.replies[chat_id].append(params.get("text"))
+            result = self.message(chat_id, params.get("text"))
+        elif method == "sendDocument":
+            self.answered[chat_id].append(time.monotonic())
+            result = self.message(chat_id)
+        elif method == "editMessageText":
+            result = self.message(chat_id, params.get("text"))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def update(self, chat_id: int, text: str) -> Dict[str, Any]:
+        user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}", "username": f"user{chat_id}"}
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "from": user,
+                   "chat": {"id": chat_id, "type": "private"}, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    async def send_chat(self, session: aiohttp.ClientSession, webhook_url: str, secret_token: str, chat_id: int,
+                        messages: int, text: str) -> None:
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token} if secret_token else {}
+        # Like Telegram, the updates of a chat are sent one after the other
+        for number in range(messages):
+            update = self.update(chat_id, text.format(chat=chat_id, n=number))
+            while True:
+                sent = time.monotonic()
+                try:
+                    async with session.post(webhook_url, data=json.dumps(update), headers=headers) as response:
+                        response.raise_for_status()
+                        break
+                except aiohttp.ClientConnectionError:
+                    # The ingress is not listening yet
+                    await asyncio.sleep(0.5)
+            self.sent[chat_id].append(sent)
+
+    async def wait_answered(self, chat_id: int, count: int, timeout: float) -> bool:
+        """
+        Waits until `count` messages of a chat were answered, or for `timeout` seconds.
+
+        Returns:
+            bool: True if the messages were answered in time.
+        """
+        deadline = time.monotonic() + timeout
+        while len(self.answered[chat_id]) < count:
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    def report(self, chats: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+        chats = list(self.sent) if chats is None else list(chats)
+        latencies = sorted(answered - sent for chat_id in chats
+                           for sent, answered in zip(self.sent[chat_id], self.answered[chat_id]))
+        sent = sum(len(self.sent[chat_id]) for chat_id in chats)
+
+        def percentile(share: float) -> float:
+            return round(latencies[min(int(len(latencies) * share), len(latencies) - 1)] * 1000, 1)
+
+        return {"updates": sent, "answered": len(latencies), "unanswered": sent - len(latencies),
+                "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1)}
+                if latencies else None}
+
+
+async def main(args: argparse.Namespace) -> None:
+    telegram = FakeTelegram()
+    runner = web.AppRunner(telegram.app())
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"Fake Bot API listening on http://{args.host}:{args.port}")
+
+    started = time.monotonic()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(telegram.send_chat(session, args.webhook_url, args.secret_token, args.first_chat + chat,
+                                                  args.messages, args.text) for chat in range(args.chats)))
+    expected = args.chats * args.messages
+    while (sum(len(times) for times in telegram.answered.values()) < expected
+           and time.monotonic() - started < args.timeout):
+        await asyncio.sleep(0.1)
+
+    report = telegram.report()
+    report["seconds"] = round(time.monotonic() - started, 2)
+    report["api_calls"] = dict(telegram.calls)
+    if args.show_replies:
+        report["replies"] = telegram.replies
+    print(json.dumps(report, indent=2, ensure_ascii=False), flush=True)
+    # Keeps answering the Bot API calls, for example of workers restarted after the test
+    await asyncio.sleep(args.linger)
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081, help="Port of the fake Bot API")
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8080/telegram")
+    parser.add_argument("--secret-token", default=None)
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--first-chat", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=3, help="Messages sent by every chat")
+    parser.add_argument("--text", default="/help", help="Message text, {chat} and {n} are replaced by the chat "
+                                                         "ID and the message number")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the answers")
+    parser.add_argument("--show-replies", action="store_true")
+    parser.add_argument("--linger", type=float, default=0, help="Seconds to keep serving the Bot API after the report")
+    asyncio.run(main(parser.parse_args()))
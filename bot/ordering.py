@@ -0,0 +1,48 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, Awaitable, Dict
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates concurrently across chats, but one at a time and in arrival order within a chat,
+    so the answers of a conversation are generated in the order its messages were sent.
+
+    Updates wait for their chat before taking one of the `max_concurrent_updates` slots, so a busy
+    chat doesn't hold up the others.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # Number of updates of every chat being processed or waiting, to forget the idle chats
+        self._waiting: Dict[int, int] = defaultdict(int)
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # Updates are handed over in arrival order and the lock wakes its waiters in order
+        lock = self._locks.setdefault(chat.id, asyncio.Lock())
+        self._waiting[chat.id] += 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._waiting[chat.id] -= 1
+            if self._waiting[chat.id] == 0:
+                del self._waiting[chat.id]
+                del self._locks[chat.id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -1,39 +1,160 @@
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 from telegram import Bot
 from telegram import BotCommand
-from handlers.message_handlers import echo, update_command, update_with_file, get_history
-from handlers.command_handlers import start, help_command, stats_command, button
-from config import TELEGRAM_BOT_TOKEN
+from handlers.message_handlers import echo, update_command, update_with_file, get_history, report_ingestion_job
+from handlers.command_handlers import start, help_command, stats_command, metrics_command, sources_command, button
+from storage.archive import maintain_chat_history
+from storage.jobs import init_ingestion_queue, get_ingestion_queue
+from storage.message_log import close_message_log
+from storage.models import async_engine, create_tables, engine
+from storage.parsing import shutdown_parser_pool
+from storage.registry import init_registry, get_registry
+from config import (TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL, MAX_CONCURRENT_UPDATES, CHAT_HISTORY_MAINTENANCE_INTERVAL,
+                    INGEST_JOB_WORKERS)
+from typing import Optional
+from .ordering import ChatOrderedUpdateProcessor
 import asyncio
+import logging
 
+logger = logging.getLogger(__name__)
 
-def setup_telegram_bot() -> Bot:
+
+def setup_telegram_bot(worker_index: Optional[int] = None) -> Bot:
     """
     Setup and initialize the Telegram bot with the specified token and handlers.
 
+    Args:
+        worker_index (int): The index of the worker process in webhook mode. Workers receive their
+            updates from the webhook ingress, and only the first one runs the background maintenance.
+            None in polling mode.
+
     Returns:
         bot: The initialized Telegram bot application.
     """
+    # Create the shared clients registry used by all handlers. In webhook mode the ingress creates
+    # the database tables once, before starting the workers.
+    if worker_index is None:
+        create_tables()
+    init_registry()
+
     # Create a new application instance for the bot
-    bot: Bot = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    builder = (ApplicationBuilder()
+               .token(TELEGRAM_BOT_TOKEN)
+               .base_url(f"{TELEGRAM_API_URL}/bot")
+               .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+               .post_init(post_init)
+               .post_shutdown(post_shutdown))
+    if worker_index is not None:
+        # Updates are fed by the webhook ingress, which sends every update of a chat to the same worker
+        builder = builder.updater(None)
+    # Updates are processed concurrently so a slow answer doesn't hold up other chats, and in order
+    # within a chat so every answer is built on the previous exchanges
+    builder = builder.concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    bot: Bot = builder.build()
+    bot.bot_data['worker_index'] = worker_index
+
     # Register command handlers
     bot.add_handler(CommandHandler("start", start))
     bot.add_handler(CommandHandler("help", help_command))
     bot.add_handler(CommandHandler("upd", update_command))
     bot.add_handler(CommandHandler("stats", stats_command))
     bot.add_handler(CommandHandler("history", get_history))
+    bot.add_handler(CommandHandler("metrics", metrics_command))
+    bot.add_handler(CommandHandler("sources", sources_command))
     bot.add_handler(CallbackQueryHandler(button))
 
     # Register message handlers
     bot.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
     bot.add_handler(MessageHandler(filters.Document.ALL, update_with_file))
 
-    # Set the bot commands
-    asyncio.run(set_commands(bot.bot))
-
     return bot
 
 
+async def post_init(application: Application) -> None:
+    """
+    Sets the bot commands, connects the shared clients and starts the ingestion workers before the bot
+    starts polling, without blocking the event loop.
+
+    Args:
+        application: The Telegram bot application.
+    """
+    worker_index = application.bot_data.get('worker_index')
+    if worker_index in (None, 0):
+        await set_commands(application.bot)
+    await asyncio.to_thread(warm_up_registry)
+    # Uploaded files are ingested in the background, by a single process since the local indexes take a
+    # single writer. The other webhook workers only submit the jobs, and refresh their indexes when answering.
+    workers = INGEST_JOB_WORKERS if worker_index in (None, 0) else 0
+    await init_ingestion_queue(lambda job: report_ingestion_job(application.bot, job), workers).start(resume=False)
+    # Webhook workers start it once they take over from the worker they replace
+    if worker_index is None:
+        await start_background_work(application)
+
+
+async def start_background_work(application: Application) -> None:
+    """
+    Resumes the ingestion jobs interrupted by the last shutdown, and starts the chat history maintenance
+    and, in webhook mode, the watch for the jobs submitted to the other workers. Runs in a single process:
+    the bot in polling mode, or the first worker in webhook mode.
+
+    Args:
+        application: The Telegram bot application.
+    """
+    await get_ingestion_queue().resume()
+    if application.bot_data.get('worker_index') is not None:
+        # Runs the jobs submitted to the other workers
+        application.bot_data['ingestion_watch'] = asyncio.create_task(get_ingestion_queue().watch())
+    application.bot_data['chat_history_maintenance'] = asyncio.create_task(run_chat_history_maintenance())
+
+
+async def post_shutdown(application: Application) -> None:
+    """
+    Stops the background ingestion workers, the chat history maintenance and the document parser processes,
+    saves the buffered chat messages and closes the database connections. Unfinished ingestion jobs are
+    resumed on the next start.
+
+    Args:
+        application: The Telegram bot application.
+    """
+    await get_ingestion_queue().stop()
+    for name in ('ingestion_watch', 'chat_history_maintenance'):
+        task = application.bot_data.pop(name, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    shutdown_parser_pool()
+    # Saves the messages still buffered by the write-behind message log
+    await asyncio.to_thread(close_message_log)
+    await async_engine.dispose()
+
+
+async def run_chat_history_maintenance(interval: float = CHAT_HISTORY_MAINTENANCE_INTERVAL) -> None:
+    """
+    Creates the upcoming chat history partitions and archives the expired months, once at startup and
+    then every `interval` seconds, until cancelled.
+
+    Args:
+        interval (float): The number of seconds between two runs.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(maintain_chat_history, engine)
+        except Exception as e:
+            logger.error(f"Chat history maintenance failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def warm_up_registry() -> None:
+    """
+    Warms up the shared clients registry, logging instead of failing if a service is down.
+    """
+    registry = get_registry()
+    try:
+        registry.warm_up()
+    except Exception as e:
+        logger.warning(f"Error occurred while warming up the clients: {e}")
+
+
 async def set_commands(bot: Bot) -> None:
     """
     Sets the commands list of the bot and to show them when typing a slash "/"
@@ -45,7 +166,9 @@ async def set_commands(bot: Bot) -> None:
         BotCommand("start", "Запустить бота"),
         BotCommand("help", "Показать информацию о помощи"),
         BotCommand("upd", "Обновить базу знаний бота \"/upd <текст>\""),
-        BotCommand("stats", "Получить статистику пользователей за определённую дату \"/stats ГГГГ-ММ-ДД\""),
+        BotCommand("stats", "Получить статистику пользователей за дату или период \"/stats ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]\""),
         BotCommand("history", "получить историю разговора"),
+        BotCommand("metrics", "Показать метрики производительности бота"),
+        BotCommand("sources", "Показать документы базы знаний"),
     ]
     await bot.set_my_commands(commands)
\ No newline at end of file
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import threading
+from dataclasses import dataclass
+from multiprocessing.process import BaseProcess
+from multiprocessing.synchronize import Event
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.ext import Application
+from config import (TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT,
+                    WEBHOOK_SECRET_TOKEN, WEBHOOK_URL, WEBHOOK_WORKERS)
+from storage.models import create_tables
+from .setup import setup_telegram_bot, start_background_work
+
+logger = logging.getLogger(__name__)
+
+# Update fields holding a message or a chat event, whose chat the update belongs to
+CHAT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "business_message",
+               "edited_business_message", "my_chat_member", "chat_member", "chat_join_request", "message_reaction",
+               "message_reaction_count", "chat_boost", "removed_chat_boost")
+
+# Seconds between two checks of the worker processes
+WATCH_INTERVAL = 5
+# Seconds given to a worker to finish its updates when stopping
+STOP_TIMEOUT = 30
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """
+    Returns the ID of the chat of a raw update, the same chat `Update.effective_chat` returns.
+
+    Args:
+        data (dict): The update, as sent by Telegram.
+
+    Returns:
+        Optional[int]: The chat ID, or None for updates without a chat, like inline queries.
+    """
+    for field in CHAT_FIELDS:
+        if field in data and "chat" in data[field]:
+            return data[field]["chat"]["id"]
+    message = (data.get("callback_query") or {}).get("message")
+    if message:
+        return message["chat"]["id"]
+    return None
+
+
+def worker_for(data: Dict[str, Any], workers: int) -> int:
+    """
+    Picks the worker of an update. All the updates of a chat go to the same worker, so they are
+    processed in order.
+
+    Args:
+        data (dict): The update, as sent by Telegram.
+        workers (int): The number of workers.
+
+    Returns:
+        int: The index of the worker.
+    """
+    chat_id = update_chat_id(data)
+    # Updates without a chat have no order to keep
+    return (chat_id if chat_id is not None else data.get("update_id", 0)) % workers
+
+
+def run_worker(index: int, updates: multiprocessing.Queue, ready: Event, go: Event) -> None:
+    """
+    Entry point of a worker process. Runs the bot on the updates put in its queue by the ingress,
+    until it gets None.
+
+    Args:
+        index (int): The index of the worker.
+        updates (multiprocessing.Queue): The raw updates of the chats of the worker.
+        ready (Event): Set once the bot is initialized.
+        go (Event): Set when the worker can start taking updates, once the worker it replaces has stopped.
+    """
+    # Stopped by the ingress, not by the Ctrl+C sent to the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    application = setup_telegram_bot(worker_index=index)
+    asyncio.run(serve_updates(application, updates, ready, go))
+
+
+async def serve_updates(application: Application, updates: multiprocessing.Queue, ready: Event, go: Event) -> None:
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    ready.set()
+    await asyncio.to_thread(go.wait)
+    if application.bot_data['worker_index'] == 0:
+        # Only now that the worker it replaces has stopped
+        await start_background_work(application)
+
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+
+    def feed(data: Dict[str, Any]) -> None:
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+    def read_updates() -> None:
+        while (data := updates.get()) is not None:
+            loop.call_soon_threadsafe(feed, data)
+        loop.call_soon_threadsafe(stopped.set)
+
+    threading.Thread(target=read_updates, name="webhook-updates", daemon=True).start()
+    try:
+        await stopped.wait()
+    finally:
+        # Processes the updates already taken before stopping
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+@dataclass
+class Worker:
+    """
+    A worker process and the events it shares with the ingress. The ingress keeps the events until the
+    process stops, as they are gone once neither process references them.
+    """
+    process: BaseProcess
+    ready: Event
+    go: Event
+
+
+class WorkerPool:
+    """
+    Worker processes of the webhook mode. Every worker has its own queue, and the updates of a chat
+    always go to the same queue, so a chat is answered in order while the chats are spread across
+    the processes and their cores.
+
+    Workers that die are started again, and `restart` replaces them one by one, for example to load
+    new code, while the ingress keeps accepting updates.
+    """
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS):
+        # Spawned rather than forked, since the ingress process runs threads
+        self._context = multiprocessing.get_context("spawn")
+        self.queues: List[multiprocessing.Queue] = [self._context.Queue() for _ in range(workers)]
+        self.workers: List[Optional[Worker]] = [None] * workers
+        self._lock = asyncio.Lock()
+
+    def _spawn(self, index: int, go_now: bool = True) -> Worker:
+        ready, go = self._context.Event(), self._context.Event()
+        if go_now:
+            go.set()
+        process = self._context.Process(target=run_worker, args=(index, self.queues[index], ready, go),
+                                        name=f"bot-worker-{index}")
+        process.start()
+        return Worker(process, ready, go)
+
+    def start(self) -> None:
+        """
+        Starts the workers. Updates received before a worker is ready wait in its queue.
+        """
+        for index in range(len(self.queues)):
+            self.workers[index] = self._spawn(index)
+
+    def dispatch(self, data: Dict[str, Any]) -> int:
+        """
+        Queues an update for the worker of its chat.
+
+        Args:
+            data (dict): The update, as sent by Telegram.
+
+        Returns:
+            int: The index of the worker.
+        """
+        index = worker_for(data, len(self.queues))
+        self.queues[index].put(data)
+        return index
+
+    async def restart(self) -> None:
+        """
+        Replaces the workers one by one. The new worker is initialized while the old one still answers,
+        and takes over the queue once the old one has processed the updates it took.
+        """
+        async with self._lock:
+            for index, old in enumerate(self.workers):
+                worker = self._spawn(index, go_now=False)
+                if not await asyncio.to_thread(wait_ready, worker):
+                    logger.error(f"Worker {index} failed to start, keeping the running worker")
+                    continue
+                self.queues[index].put(None)
+                await asyncio.to_thread(old.process.join)
+                worker.go.set()
+                self.workers[index] = worker
+                logger.info(f"Restarted worker {index}")
+
+    async def watch(self, interval: float = WATCH_INTERVAL) -> None:
+        """
+        Starts the workers that died again, until cancelled. The updates a dead worker had taken but
+        not answered are lost.
+
+        Args:
+            interval (float): The number of seconds between two checks.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            async with self._lock:
+                for index, worker in enumerate(self.workers):
+                    if not worker.process.is_alive():
+                        logger.error(f"Worker {index} exited with code {worker.process.exitcode}, starting it again")
+                        self.workers[index] = self._spawn(index)
+
+    async def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        """
+        Stops the workers after they process the updates already queued.
+
+        Args:
+            timeout (float): The number of seconds to wait for a worker before killing it.
+        """
+        async with self._lock:
+            for queue in self.queues:
+                queue.put(None)
+            for worker in self.workers:
+                await asyncio.to_thread(worker.process.join, timeout)
+                if worker.process.is_alive():
+                    logger.warning(f"Worker {worker.process.name} didn't stop in time, terminating it")
+                    worker.process.terminate()
+
+
+def wait_ready(worker: Worker) -> bool:
+    while not worker.ready.wait(1):
+        if not worker.process.is_alive():
+            return False
+    return True
+
+
+def create_ingress(pool: WorkerPool, path: str = WEBHOOK_PATH,
+                   secret_token: Optional[str] = WEBHOOK_SECRET_TOKEN) -> web.Application:
+    """
+    Creates the HTTP app receiving the updates from Telegram and queuing them for the workers.
+    Updates are acknowledged as soon as they are queued, so Telegram never waits for an answer.
+
+    Args:
+        pool (WorkerPool): The workers.
+        path (str): The path of the webhook.
+        secret_token (str): The token Telegram sends with every update, if set.
+
+    Returns:
+        web.Application: The ingress app.
+    """
+
+    async def receive_update(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        pool.dispatch(data)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, receive_update)
+    return app
+
+
+async def register_webhook() -> None:
+    """
+    Points the Telegram webhook of the bot to WEBHOOK_URL.
+    """
+    async with Bot(TELEGRAM_BOT_TOKEN, base_url=f"{TELEGRAM_API_URL}/bot") as bot:
+        await bot.set_webhook(f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET_TOKEN,
+                              allowed_updates=Update.ALL_TYPES)
+    logger.info(f"Webhook set to {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+
+def run_webhook_ingress() -> None:
+    """
+    Runs the bot in webhook mode: an HTTP ingress receiving the updates, and WEBHOOK_WORKERS worker
+    processes answering them. Send SIGHUP to the ingress to restart the workers one by one.
+    """
+    # Created once, before the workers connect to the database
+    create_tables()
+    pool = WorkerPool()
+    app = create_ingress(pool)
+
+    async def on_startup(app: web.Application) -> None:
+        pool.start()
+        app["watch"] = asyncio.create_task(pool.watch())
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(pool.restart()))
+        if WEBHOOK_URL:
+            await register_webhook()
+
+    async def on_cleanup(app: web.Application) -> None:
+        app["watch"].cancel()
+        await pool.stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    # The webhook is kept when the ingress stops, so Telegram holds the updates until it is back
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
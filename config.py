@@ -11,6 +11,11 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # Pinecone configs
 INDEX_NAME = os.getenv("INDEX_NAME")
+INDEX_DIMENSION = 1536
+
+# Vector store backend: 'pinecone', or 'local' for an in-process index stored on disk
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "./cache/local_index/")
 
 UPLOAD_FOLDER = './uploaded_files/'
 
@@ -28,4 +33,120 @@ DATABASE_PORT = os.getenv('DATABASE_PORT')
 DATABASE_PASSWORD = os.getenv('DATABASE_PASSWORD')
 DATABASE_NAME = os.getenv('DATABASE_NAME')
 DATABASE_USERNAME = os.getenv('DATABASE_USERNAME')
-DATABASE_URL = f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_HOSTNAME}:{DATABASE_PORT}/{DATABASE_NAME}"
\ No newline at end of file
+DATABASE_URL = os.getenv('DATABASE_URL',
+                         f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_HOSTNAME}:{DATABASE_PORT}/{DATABASE_NAME}")
+# The same database through an async driver: asyncpg for PostgreSQL, aiosqlite for local SQLite databases
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://', 1)
+                               .replace('sqlite://', 'sqlite+aiosqlite://', 1))
+# Connection pool of the async engine used by the handlers. SQLite databases keep the default pool of their driver.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+# Connection pool of the sync engine used by the message log and the loaders of large results, run in threads
+DB_SYNC_POOL_SIZE = int(os.getenv('DB_SYNC_POOL_SIZE', '4'))
+DB_SYNC_MAX_OVERFLOW = int(os.getenv('DB_SYNC_MAX_OVERFLOW', '2'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+
+# Shared client registry configs
+INDEX_POOL_THREADS = int(os.getenv('INDEX_POOL_THREADS', '4'))
+
+# Telegram Bot API server, can point to a local server for testing
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Serving configs
+# 'polling' runs a single process, 'webhook' receives updates over HTTP and spreads them across worker processes
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', str(os.cpu_count() or 1)))
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Public URL of the webhook host, without the path. If set, the webhook is registered with Telegram on start.
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# Sent by Telegram with every update, so only Telegram can post updates to the webhook
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+
+# Concurrency configs
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+MAX_CONCURRENT_ANSWERS = int(os.getenv('MAX_CONCURRENT_ANSWERS', '16'))
+
+# Answer streaming configs
+# Edits the reply while the answer is generated, instead of replying once it is complete
+STREAM_ANSWERS = os.getenv('STREAM_ANSWERS', 'true').lower() == 'true'
+# Minimum seconds between two edits of a streamed reply. Telegram allows about one message per second
+# in a private chat and 20 per minute in a group.
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+STREAM_GROUP_EDIT_INTERVAL = float(os.getenv('STREAM_GROUP_EDIT_INTERVAL', '3.0'))
+
+# Chat history configs
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '50'))
+# Rows fetched at a time by the /history export
+HISTORY_EXPORT_BATCH_SIZE = int(os.getenv('HISTORY_EXPORT_BATCH_SIZE', '1000'))
+
+# Conversation summary configs
+SUMMARIZER = os.getenv('SUMMARIZER', 'chat')  # 'chat' uses the chat model, 'fake' works offline
+SUMMARY_KEEP_MESSAGES = int(os.getenv('SUMMARY_KEEP_MESSAGES', '6'))
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv('SUMMARY_TRIGGER_MESSAGES', '10'))
+SUMMARY_BATCH_MESSAGES = int(os.getenv('SUMMARY_BATCH_MESSAGES', '200'))
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '1000'))
+
+# Answer cache configs
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '3600'))  # seconds
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.97'))  # cosine similarity
+
+# Embedding service configs
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '10000'))
+EMBEDDING_DISK_CACHE_PATH = os.getenv('EMBEDDING_DISK_CACHE_PATH', './cache/embeddings.sqlite3')  # empty to disable
+EMBEDDING_DISK_CACHE_SIZE = int(os.getenv('EMBEDDING_DISK_CACHE_SIZE', '200000'))
+EMBEDDING_BATCH_WINDOW = float(os.getenv('EMBEDDING_BATCH_WINDOW', '0.01'))  # seconds
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '256'))
+
+# Retrieval configs
+RETRIEVAL_K = int(os.getenv('RETRIEVAL_K', '3'))
+RETRIEVAL_CANDIDATES = int(os.getenv('RETRIEVAL_CANDIDATES', '10'))  # per retriever, before fusion
+HYBRID_RETRIEVAL = os.getenv('HYBRID_RETRIEVAL', 'true').lower() == 'true'
+LEXICAL_INDEX_PATH = os.getenv('LEXICAL_INDEX_PATH', './cache/lexical_index.jsonl')
+# The lexical index log is rewritten to its live documents once it has this many entries per document
+LEXICAL_INDEX_COMPACT_RATIO = float(os.getenv('LEXICAL_INDEX_COMPACT_RATIO', '2'))
+
+# Ingestion configs
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '100'))  # chunks per embedding request
+INGEST_BATCH_TOKENS = int(os.getenv('INGEST_BATCH_TOKENS', '50000'))  # tokens per embedding request
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '4'))
+INGEST_RETRIES = int(os.getenv('INGEST_RETRIES', '5'))
+
+# Chunking configs
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '400'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '50'))
+# Document parsing configs, a single process parses in the calling thread
+PARSER_PROCESSES = int(os.getenv('PARSER_PROCESSES', str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '8'))
+# Rows of a .csv or .xlsx file read at a time
+TABULAR_BATCH_ROWS = int(os.getenv('TABULAR_BATCH_ROWS', '5000'))
+INGEST_MANIFEST_PATH = os.getenv('INGEST_MANIFEST_PATH', './cache/ingestion_manifest.sqlite3')
+
+# Message log configs: messages are saved in bulk by a background thread when enabled
+WRITE_BEHIND_MESSAGES = os.getenv('WRITE_BEHIND_MESSAGES', 'true').lower() == 'true'
+MESSAGE_LOG_BATCH_SIZE = int(os.getenv('MESSAGE_LOG_BATCH_SIZE', '100'))
+MESSAGE_LOG_FLUSH_INTERVAL = float(os.getenv('MESSAGE_LOG_FLUSH_INTERVAL', '0.5'))
+# Messages kept at most while the database is unavailable. Older ones are moved to the dead-letter file
+MESSAGE_LOG_MAX_BUFFER = int(os.getenv('MESSAGE_LOG_MAX_BUFFER', '10000'))
+# Messages that could not be saved, one JSON object per line
+MESSAGE_LOG_DEAD_LETTER_PATH = os.getenv('MESSAGE_LOG_DEAD_LETTER_PATH', './cache/message_log_dead_letters.jsonl')
+
+# Chat history retention configs
+# PostgreSQL only, chat_history is partitioned by month
+CHAT_HISTORY_PARTITIONING = os.getenv('CHAT_HISTORY_PARTITIONING', 'true').lower() == 'true'
+# Months of messages kept in the database, including the current one. Older months are archived. 0 keeps everything.
+CHAT_HISTORY_RETENTION_MONTHS = int(os.getenv('CHAT_HISTORY_RETENTION_MONTHS', '0'))
+CHAT_ARCHIVE_PATH = os.getenv('CHAT_ARCHIVE_PATH', './archive/')
+# Seconds between runs of the partition and retention maintenance
+CHAT_HISTORY_MAINTENANCE_INTERVAL = float(os.getenv('CHAT_HISTORY_MAINTENANCE_INTERVAL', '86400'))
+
+# Ingestion jobs configs
+INGEST_JOBS_PATH = os.getenv('INGEST_JOBS_PATH', './cache/ingestion_jobs.sqlite3')
+INGEST_JOB_WORKERS = int(os.getenv('INGEST_JOB_WORKERS', '1'))
+# Seconds between progress updates of a running ingestion job
+INGEST_PROGRESS_INTERVAL = float(os.getenv('INGEST_PROGRESS_INTERVAL', '5'))
+# Seconds between checks for the jobs queued by the other webhook workers
+INGEST_JOBS_POLL_INTERVAL = float(os.getenv('INGEST_JOBS_POLL_INTERVAL', '2'))
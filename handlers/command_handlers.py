@@ -1,6 +1,11 @@
 from telegram import KeyboardButton, ReplyKeyboardMarkup, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
+from telegram.helpers import escape_markdown
+import asyncio
+import metrics
+from storage.registry import get_registry
+from storage.sqlalchemy_database import run_in_thread
 from .utils import NOT_AUTHORIZED_MESSAGE, validate_date, get_stats_by_date, is_authorized
 
 
@@ -41,13 +46,13 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Handler for the /stats command. Sends user stats for users with admin access.
+    Handler for the /stats command. Sends user stats of a day or a range of days for users with admin access.
     
     Args:
         update (Update): The update object containing the message.
         context (ContextTypes.DEFAULT_TYPE): The context object for the bot.
     """
-    if not is_authorized(update):
+    if not is_authorized(update.message.from_user.username):
         await update.message.reply_text(NOT_AUTHORIZED_MESSAGE)
         return
 
@@ -56,31 +61,53 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
     
     date = context.args[0]
+    end_date = context.args[1] if len(context.args) > 1 else date
     
-    if not validate_date(date):
+    if not validate_date(date) or not validate_date(end_date):
         await update.message.reply_text("Неверный формат даты. Пожалуйста, укажите дату в формате ГГГГ-ММ-ДД.")
         return
+
+    if end_date < date:
+        await update.message.reply_text("Конечная дата должна быть не раньше начальной.")
+        return
     
-    stats_data = get_stats_by_date(date)
+    stats_data = await run_in_thread(get_stats_by_date, date, end_date)
+    period = format_period(date, end_date)
 
     if not stats_data:
-        await update.message.reply_text(f'Нет данных за дату {date}.')
+        await update.message.reply_text(f'Нет данных {period}.')
     else:
         total_users = len(stats_data)
         total_requests = sum(stat['request_count'] for stat in stats_data)
         total_files = sum(stat['file_count'] for stat in stats_data)
 
-        formatted_response = (f"*Общая статистика за дату {date}:*\n\n"
+        formatted_response = (f"*Общая статистика {period}:*\n\n"
                               f"*Всего пользователей:* `{total_users}`\n"
                               f"*Всего запросов:* `{total_requests}`\n"
                               f"*Всего файлов:* `{total_files}`\n")
 
-        keyboard = [[InlineKeyboardButton("Показать детали", callback_data=f"show_details_{date}")]]
+        keyboard = [[InlineKeyboardButton("Показать детали", callback_data=f"show_details_{date}_{end_date}")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         await update.message.reply_text(formatted_response, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
 
 
+def format_period(date: str, end_date: str) -> str:
+    """
+    Formats a day or a range of days for the stats messages.
+
+    Args:
+        date (str): The first day.
+        end_date (str): The last day.
+
+    Returns:
+        str: "за дату ..." for a single day, "за период ... — ..." for a range.
+    """
+    if date == end_date:
+        return f"за дату {date}"
+    return f"за период {date} — {end_date}"
+
+
 async def show_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handler for showing detailed user stats after pressing the /stats command button.
@@ -90,14 +117,17 @@ async def show_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         context (ContextTypes.DEFAULT_TYPE): The context object for the bot.
     """
     query = update.callback_query
-    date = query.data.split('_')[-1]
+    # "show_details_<date>_<end date>", or "show_details_<date>" for buttons sent before ranges were supported
+    dates = query.data[len("show_details_"):].split('_')
+    date, end_date = dates[0], dates[-1]
 
-    stats_data = get_stats_by_date(date)
+    stats_data = await run_in_thread(get_stats_by_date, date, end_date)
+    period = format_period(date, end_date)
 
     if not stats_data:
-        await query.message.reply_text(f'Нет подробной информации на дату {date}.')
+        await query.message.reply_text(f'Нет подробной информации {period}.')
     else:
-        formatted_response = f"*Детальная статистика за дату {date}:*\n"
+        formatted_response = f"*Детальная статистика {period}:*\n"
         for stat in stats_data:
             formatted_response += (f"\n*ID пользователя:* `{stat['user_id']}`\n"
                                    f"*Запросов:* `{stat['request_count']}`\n"
@@ -106,6 +136,55 @@ async def show_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await query.message.reply_text(formatted_response, parse_mode=ParseMode.MARKDOWN)
 
 
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handler for the /metrics command. Sends the bot performance metrics for users with admin access.
+    
+    Args:
+        update (Update): The update object containing the message.
+        context (ContextTypes.DEFAULT_TYPE): The context object for the bot.
+    """
+    if not is_authorized(update.message.from_user.username):
+        await update.message.reply_text(NOT_AUTHORIZED_MESSAGE)
+        return
+
+    data = metrics.snapshot()
+    formatted_response = "*Метрики:*\n"
+    for name, value in sorted(data.pop("counters").items()):
+        formatted_response += f"\n*{escape_markdown(name)}:* `{value:g}`"
+    for name, summary in sorted(data.items()):
+        values = ", ".join(f"{key}={value:.1f}" for key, value in summary.items())
+        formatted_response += f"\n*{escape_markdown(name)}:* `{values}`"
+
+    await update.message.reply_text(formatted_response, parse_mode=ParseMode.MARKDOWN)
+
+
+async def sources_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handler for the /sources command. Lists the documents in the knowledge base for users with admin access.
+    
+    Args:
+        update (Update): The update object containing the message.
+        context (ContextTypes.DEFAULT_TYPE): The context object for the bot.
+    """
+    if not is_authorized(update.message.from_user.username):
+        await update.message.reply_text(NOT_AUTHORIZED_MESSAGE)
+        return
+
+    sources = await asyncio.to_thread(get_registry().manifest.sources)
+    if not sources:
+        await update.message.reply_text('База знаний не содержит загруженных документов.')
+        return
+
+    formatted_response = "*Документы базы знаний:*\n"
+    for source in sources:
+        formatted_response += (f"\n*{escape_markdown(source.source)}*\n"
+                               f"Версия: `{source.version}`, векторов: `{source.vector_count}`, "
+                               f"обновлён: `{source.updated_at}`\n")
+
+    await update.message.reply_text(formatted_response, parse_mode=ParseMode.MARKDOWN)
+
+
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     CallbackQueryHandler to handle button presses.
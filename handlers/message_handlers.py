@@ -1,19 +1,24 @@
+import asyncio
 import os
-from langchain_openai import ChatOpenAI
-from telegram import Update
+import tempfile
+import time
+from datetime import datetime
+from telegram import Bot, Update
 from telegram.ext import ContextTypes
-from telegram.constants import ChatAction
-from model.chat_model import get_answer, get_chat_model
-from storage.database import get_index, get_base_messages, get_vectorstore
-from storage.trainers import train_textual_data
-from storage.updaters import update_knowledge_base
+from telegram.constants import ChatAction, FileSizeLimit
+import metrics
+from config import STREAM_ANSWERS, STREAM_EDIT_INTERVAL, STREAM_GROUP_EDIT_INTERVAL
+from model.chat_model import ERROR_MESSAGE, get_answer
+from model.summarizer import schedule_summary_update
+from storage.registry import get_registry
+from storage.trainers import text_source
+from storage.jobs import DONE, FAILED, IngestionJob, get_ingestion_queue
 from storage.utils import get_received_file_path, save_update_text
-from .utils import NOT_AUTHORIZED_MESSAGE, in_group_not_tagged, is_authorized
+from .streaming import StreamingReply
+from .utils import NOT_AUTHORIZED_MESSAGE, in_group_not_tagged, is_authorized, validate_date
 import logging
-from storage.sqlalchemy_database import get_db, save_message, get_chat_history
-from langchain_core.messages.base import BaseMessage
-from typing import List
-from pinecone.data.index import Index
+from storage.history_export import export_chat_history
+from storage.sqlalchemy_database import record_message
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,50 +26,78 @@ logger = logging.getLogger(__name__)
 
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Handler for echoing messages. Processes user input and generates a response.
+    Handler for echoing messages. Processes user input and generates a response. With STREAM_ANSWERS,
+    the reply is edited as the answer is generated.
 
     Args:s
         update (Update): The update object containing the message.
         context (ContextTypes.DEFAULT_TYPE): The context object for the bot.
     """
-    index: Index = get_index()
-    vectorstore = get_vectorstore(index)
-    chat: ChatOpenAI = get_chat_model()
-    messages: List[BaseMessage] = get_base_messages()
-
     # Ignore the message if the bot is in a group but not tagged
     if in_group_not_tagged(update, context):
         return
 
-    user_input = update.message.text
+    started = time.monotonic()
+    registry = get_registry()
+    # Picks up the updates ingested by another process since the last message
+    await asyncio.to_thread(registry.refresh_knowledge_base)
 
-    db = next(get_db())
+    user_input = update.message.text
 
     user_id = update.message.from_user.id
     group_id = update.message.chat.id if update.message.chat.type in [
         'group', 'supergroup'] else None
     is_group = update.message.chat.type in ['group', 'supergroup']
 
-    save_message(db, user_id, group_id, False, user_input, is_group)
-
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
-
-    answer = get_answer(user_input, chat, vectorstore,
-                        messages, user_id, group_id, db)
-    save_message(db, user_id, group_id, True, answer, is_group)
-    await update.message.reply_text(answer)
+    if STREAM_ANSWERS:
+        reply = StreamingReply(update.message, STREAM_GROUP_EDIT_INTERVAL if is_group else STREAM_EDIT_INTERVAL,
+                               started)
+        await asyncio.gather(
+            record_message(user_id, group_id, False, user_input, is_group),
+            reply.start()
+        )
+        try:
+            answer = await registry.acall(lambda clients: get_answer(user_input, clients.chat, clients.vectorstore,
+                                                                     clients.embeddings, clients.answer_cache,
+                                                                     clients.lexical_index, user_id, group_id,
+                                                                     on_text=reply.update))
+        except Exception:
+            # Don't leave the placeholder or a partial answer behind
+            await reply.fail(ERROR_MESSAGE)
+            raise
+        await asyncio.gather(
+            record_message(user_id, group_id, True, answer, is_group),
+            reply.finish(answer)
+        )
+    else:
+        await asyncio.gather(
+            record_message(user_id, group_id, False, user_input, is_group),
+            context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+        )
+
+        answer = await registry.acall(lambda clients: get_answer(user_input, clients.chat, clients.vectorstore,
+                                                                 clients.embeddings, clients.answer_cache,
+                                                                 clients.lexical_index, user_id, group_id))
+        await asyncio.gather(
+            record_message(user_id, group_id, True, answer, is_group),
+            update.message.reply_text(answer)
+        )
+        metrics.observe("time_to_first_token_ms", (time.monotonic() - started) * 1000)
+
+    # Fold older messages into the conversation summary without delaying the next answers
+    schedule_summary_update(registry.summarizer, user_id, group_id)
 
 
 async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Handler for the /upd command. Updates the knowledge base with new information.
+    Handler for the /upd command. Queues the text after the command for ingestion into the knowledge base.
 
     Args:
         update (Update): The update object containing the message.
         context (ContextTypes.DEFAULT_TYPE): The context object for the bot.
     """
 
-    if not is_authorized(update):
+    if not is_authorized(update.message.from_user.username):
         await update.message.reply_text(NOT_AUTHORIZED_MESSAGE)
         return
 
@@ -79,13 +112,17 @@ async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text('Пожалуйста, предоставьте текст после команды /upd.')
         return
 
-    index: Index = get_index()
     print("Updating with text info...")
-    await update.message.reply_text('Обновление получено. Обновление базы знаний...')
-    update_text = user_input[4:]
-    save_update_text(username=username, text=update_text)
-    train_textual_data(update_text, index)
-    await update.message.reply_text('База знаний успешно обновлена!')
+    # Everything after the command, which can also be written as /upd@botname
+    update_text = user_input.split(maxsplit=1)[1]
+    file_path = save_update_text(username=username, text=update_text)
+    if file_path is None:
+        await update.message.reply_text('Ошибка при сохранении обновления.')
+        return
+    progress_message = await update.message.reply_text('Обновление получено. Обновление базы знаний...')
+    # Ingested by the ingestion queue like uploaded files, so a single process writes to the indexes
+    await get_ingestion_queue().submit(file_path, text_source(update_text), progress_message.chat_id,
+                                       progress_message.message_id)
 
 
 async def update_with_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -119,29 +156,50 @@ async def update_with_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Check if the file was saved
         if os.path.exists(file_path):
             print(f"Файл сохранен как {file_path}")
-            db = next(get_db())
             user_id = update.message.from_user.id
             group_id = update.message.chat.id if update.message.chat.type in [
                 'group', 'supergroup'] else None
             is_group = update.message.chat.type in ['group', 'supergroup']
             print(f"filename {file_name}")
             print(f"filetype {file_type}")
-            save_message(db, user_id, group_id, is_bot=False, content=f"File uploaded: {file_name}",
-                         is_group=is_group, file_name=file_name, file_type=file_type)
+            await record_message(user_id, group_id, is_bot=False, content=f"File uploaded: {file_name}",
+                                 is_group=is_group, file_name=file_name, file_type=file_type)
 
-            await update.message.reply_text(f'Файл сохранен. Обновление базы знаний...')
+            progress_message = await update.message.reply_text(f'Файл сохранен. Обновление базы знаний...')
         else:
             print(f"Ошибка при сохранении файла {file_path}")
             await update.message.reply_text(f'Ошибка при сохранении файла {file_path}')
+            return
+
+        # Update the knowledge base in the background, editing the progress message as it goes
+        # Uploads of a file with the same name are versions of the same document, even if saved under another name
+        await get_ingestion_queue().submit(file_path, file_name, progress_message.chat_id, progress_message.message_id)
+
 
-        # Update the knowledge base after file upload
-        await update_knowledge_base(file_path)
-        await update.message.reply_text('База знаний успешно обновлена!')
+async def report_ingestion_job(bot: Bot, job: IngestionJob) -> None:
+    """
+    Edits the progress message of an ingestion job with its current status.
+
+    Args:
+        bot (Bot): The Telegram bot.
+        job (IngestionJob): The ingestion job.
+    """
+    if job.status == DONE:
+        text = f'База знаний успешно обновлена! Файл {job.source}: {job.processed} фрагментов обработано.'
+    elif job.status == FAILED:
+        text = f'Ошибка при обновлении базы знаний файлом {job.source}.'
+    elif job.total:
+        text = f'Обновление базы знаний: {job.processed}/{job.total} фрагментов обработано...'
+    else:
+        text = f'Обновление базы знаний: {job.processed} фрагментов обработано...'
+    await bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.message_id)
 
 
 async def get_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Handler for the /history command. Retrieves and displays chat history.
+    Handler for the /history command. Sends the chat history as a compressed text file.
+    `/history all` also includes the messages moved to the archive by the retention policy, and one or
+    two dates in format YYYY-MM-DD limit the history to a day or a range of days.
 
     Args:
         update (Update): The update object containing the message.
@@ -151,38 +209,47 @@ async def get_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if in_group_not_tagged(update, context):
         return
 
-    db = next(get_db())
-
     user_id = update.message.from_user.id
     group_id = update.message.chat.id if update.message.chat.type in [
         'group', 'supergroup'] else None
 
-    try:
-        if group_id:
-            history = get_chat_history(db, group_id=group_id)
-            context_text = f"group {group_id}"
-        else:
-            history = get_chat_history(db, user_id=user_id)
-            context_text = f"user {user_id}"
+    args = list(context.args or [])
+    include_archive = bool(args) and args[0].lower() == 'all'
+    if include_archive:
+        args = args[1:]
+    if len(args) > 2 or not all(validate_date(arg) for arg in args):
+        await update.message.reply_text("Usage: /history [all] [YYYY-MM-DD [YYYY-MM-DD]]")
+        return
+    start_date = datetime.strptime(args[0], '%Y-%m-%d').date() if args else None
+    end_date = datetime.strptime(args[-1], '%Y-%m-%d').date() if args else None
+    if start_date and end_date < start_date:
+        await update.message.reply_text("The end date must not be before the start date.")
+        return
 
-        if not history:
+    context_text = f"group {group_id}" if group_id else f"user {user_id}"
+    file_name = f"history_{group_id or user_id}"
+    if start_date:
+        file_name += f"_{start_date}" if start_date == end_date else f"_{start_date}_{end_date}"
+    file_name += ".txt.gz"
+
+    file_descriptor, file_path = tempfile.mkstemp(suffix=".txt.gz")
+    os.close(file_descriptor)
+    try:
+        await context.bot.send_chat_action(chat_id=update.message.chat_id, action=ChatAction.UPLOAD_DOCUMENT)
+        count = await asyncio.to_thread(export_chat_history, file_path, user_id, group_id, start_date, end_date,
+                                        include_archive)
+        if count == 0:
             await update.message.reply_text(f"No chat history found for {context_text}.")
             return
-
-        history_text = f"Chat history for {context_text}:\n\n"
-        for msg in history:
-            sender = "Bot" if msg.is_bot else "User"
-            history_text += f"{sender}: {msg.content}\n"
-
-        # If the message is too long, split it into multiple messages
-        if len(history_text) > 4096:
-            for i in range(0, len(history_text), 4096):
-                await update.message.reply_text(history_text[i:i+4096])
-        else:
-            await update.message.reply_text(history_text)
+        if os.path.getsize(file_path) > FileSizeLimit.FILESIZE_UPLOAD:
+            await update.message.reply_text("The chat history is too large to send, please choose a shorter date range.")
+            return
+        with open(file_path, "rb") as history_file:
+            await update.message.reply_document(history_file, filename=file_name,
+                                                caption=f"Chat history for {context_text}: {count} messages.")
 
     except Exception as e:
         logger.error(f"Error retrieving chat history: {str(e)}")
         await update.message.reply_text("An error occurred while retrieving chat history.")
     finally:
-        db.close()
+        os.remove(file_path)
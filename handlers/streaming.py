@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+from telegram import Message
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter, TelegramError
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = "…"
+
+
+class StreamingReply:
+    """
+    Reply to a message that is edited while the answer is generated.
+
+    The placeholder is replaced by the first text right away, then edits are sent at most every
+    `interval` seconds to stay under the Telegram rate limits, and `finish` always shows the complete
+    answer. Answers longer than a Telegram message continue in new replies. A failed edit never stops
+    the answer: it is shown by a later update or by `finish`.
+    """
+
+    def __init__(self, message: Message, interval: float, started: float):
+        """
+        Args:
+            message (Message): The message being answered.
+            interval (float): The minimum number of seconds between two edits.
+            started (float): The `time.monotonic()` time the message was received, to measure the
+                time to the first visible token.
+        """
+        self.message = message
+        self.interval = interval
+        self.started = started
+        self._reply: Optional[Message] = None
+        self._shown = ""
+        # Length of the answer already shown in the previous, full replies
+        self._offset = 0
+        self._next_edit = 0.0
+        self._first_token_shown = False
+
+    async def start(self) -> None:
+        """
+        Sends the placeholder reply.
+        """
+        self._reply = await self.message.reply_text(PLACEHOLDER)
+        self._shown = PLACEHOLDER
+
+    async def update(self, text: str) -> None:
+        """
+        Shows the answer generated so far, unless the last edit was less than `interval` seconds ago.
+
+        Args:
+            text (str): The answer generated so far.
+        """
+        if time.monotonic() < self._next_edit or not text.strip():
+            return
+        try:
+            await self._show(text)
+        except RetryAfter as e:
+            # Rate limited: the text is shown by a later update or by finish
+            self._next_edit = time.monotonic() + e.retry_after
+            metrics.increment("stream_edits_rate_limited")
+        except TelegramError as e:
+            # Like a timeout or a deleted reply, the text is shown by a later update or by finish
+            logger.warning(f"Error editing the streamed answer: {e}")
+            self._next_edit = time.monotonic() + self.interval
+            metrics.increment("stream_edits_failed")
+
+    async def finish(self, text: str) -> None:
+        """
+        Shows the complete answer, waiting out the rate limit if needed.
+
+        Args:
+            text (str): The complete answer.
+        """
+        while True:
+            try:
+                await self._show(text)
+                return
+            except RetryAfter as e:
+                metrics.increment("stream_edits_rate_limited")
+                await asyncio.sleep(e.retry_after)
+
+    async def fail(self, text: str) -> None:
+        """
+        Shows an error message instead of the answer, in place of the placeholder or of the partial
+        answer. When the answer already continued in new replies, the error is sent as a new reply
+        after them. Errors of Telegram are logged, so the error of the answer is the one raised.
+
+        Args:
+            text (str): The error message.
+        """
+        if self._offset > 0:
+            self._reply = None
+            self._shown = ""
+            self._offset = 0
+        try:
+            await self.finish(text)
+        except TelegramError as e:
+            logger.warning(f"Error showing the error message: {e}")
+
+    async def _show(self, text: str) -> None:
+        while len(text) - self._offset > MessageLimit.MAX_TEXT_LENGTH:
+            await self._set(text[self._offset:self._offset + MessageLimit.MAX_TEXT_LENGTH])
+            self._offset += MessageLimit.MAX_TEXT_LENGTH
+            self._reply = None
+            self._shown = ""
+        await self._set(text[self._offset:])
+
+    async def _set(self, part: str) -> None:
+        if not part or part == self._shown:
+            return
+        if self._reply is None:
+            self._reply = await self.message.reply_text(part)
+        else:
+            await self._reply.edit_text(part)
+        self._shown = part
+        self._next_edit = time.monotonic() + self.interval
+        metrics.increment("stream_edits")
+        if not self._first_token_shown:
+            self._first_token_shown = True
+            metrics.observe("time_to_first_token_ms", (time.monotonic() - self.started) * 1000)
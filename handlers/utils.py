@@ -2,8 +2,8 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from datetime import datetime
 from config import AUTHORIZED_USERNAMES
-from storage.sqlalchemy_database import get_db, Message
-from sqlalchemy import func, case
+from storage.usage import get_usage
+from sqlalchemy.orm import Session
 
 NOT_AUTHORIZED_MESSAGE = 'Извините. Вам не разрешено использовать эту команду.'
 
@@ -45,34 +45,18 @@ def validate_date(date_text: str) -> bool:
     except ValueError:
         return False
 
-def get_stats_by_date(date: str):
+def get_stats_by_date(db: Session, date: str, end_date: str = None):
     """
-    Returns fetched user stats data. 
+    Returns fetched user stats data of a day, or of a range of days, from the daily usage rollup.
 
     Args:
-        date_text: string date text.
+        db (Session): The database session.
+        date (str): The day, or first day of the range, in format YYYY-MM-DD.
+        end_date (str): The last day of the range, included. Defaults to the first day.
     
     Returns:
         json: reponse json that contains all fetched information.
     """
-    db = next(get_db())
-    user_stats = db.query(
-        Message.user_id,
-        func.count(Message.id).label('request_count'),
-        func.sum(case((Message.file_name.isnot(None), 1), else_=0)
-                 ).label('file_count')
-    ).filter(
-        func.date(Message.timestamp) == date
-    ).group_by(Message.user_id).all()
-    
-    # Convert the result to a list of dictionaries
-    result = [
-        {
-            "user_id": stat.user_id,
-            "request_count": stat.request_count,
-            "file_count": stat.file_count
-        }
-        for stat in user_stats
-    ]
-    
-    return result
\ No newline at end of file
+    start = datetime.strptime(date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else start
+    return get_usage(db, start, end)
@@ -1,14 +1,16 @@
-import nest_asyncio
 from bot.setup import setup_telegram_bot
-
-# Apply nest_asyncio to allow nested asynchronous event loops
-nest_asyncio.apply()
+from bot.webhook import run_webhook_ingress
+from config import BOT_MODE
 
 def main():
+    if BOT_MODE == 'webhook':
+        # Receive updates over HTTP and answer them in several worker processes
+        run_webhook_ingress()
+        return
     # Setup and initialize the Telegram bot
     bot = setup_telegram_bot()
     # Start polling for updates from Telegram
     bot.run_polling(close_loop=False)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,57 @@
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict
+
+# Number of latest observations kept per metric to compute percentiles
+OBSERVATIONS_WINDOW = 1000
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_observations: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=OBSERVATIONS_WINDOW))
+
+
+def increment(name: str, value: float = 1) -> None:
+    """
+    Increments a counter.
+
+    Args:
+        name (str): The name of the counter.
+        value (float): The value to add.
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+    """
+    Records an observation of a value, like a latency or a prompt size.
+
+    Args:
+        name (str): The name of the metric.
+        value (float): The observed value.
+    """
+    with _lock:
+        _observations[name].append(value)
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """
+    Returns the current value of every counter and a summary of the latest observations of every metric.
+
+    Returns:
+        dict: The counters under "counters" and the count, average, p50, p95 and max of every metric by name.
+    """
+    with _lock:
+        result = {"counters": dict(_counters)}
+        for name, values in _observations.items():
+            ordered = sorted(values)
+            if not ordered:
+                continue
+            result[name] = {
+                "count": len(ordered),
+                "avg": sum(ordered) / len(ordered),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+            }
+        return result
@@ -0,0 +1,128 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Tuple
+import numpy as np
+import metrics
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query so trivially different spellings share a cache key.
+
+    Args:
+        query (str): The user query.
+
+    Returns:
+        str: The query in lower case, without bot mentions, punctuation at the ends and repeated spaces.
+    """
+    query = re.sub(r"@\w+", " ", query.lower())
+    return " ".join(query.split()).strip(" ?!.,")
+
+
+@dataclass
+class CacheEntry:
+    answer: str
+    embedding: np.ndarray
+    created_at: float
+
+
+class AnswerCache:
+    """
+    LRU cache of answers with a time to live, looked up by normalized query text or, failing that,
+    by the cosine similarity of the query embedding to the cached queries.
+
+    Answers depend on the history of the conversation they were generated in, so every conversation
+    only gets its own cached answers.
+    """
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[Hashable, str], CacheEntry]" = OrderedDict()
+        # Keys and stacked embeddings of the entries of every conversation, rebuilt lazily after the entries change
+        self._matrices: Dict[Hashable, Tuple[List[Tuple[Hashable, str]], np.ndarray]] = {}
+
+    @staticmethod
+    def _normalize_embedding(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrices.clear()
+
+    def _closest(self, conversation: Hashable, embedding: np.ndarray) -> Optional[Tuple[Hashable, str]]:
+        if conversation not in self._matrices:
+            keys = [key for key in self._entries if key[0] == conversation]
+            if not keys:
+                return None
+            self._matrices[conversation] = keys, np.stack([self._entries[key].embedding for key in keys])
+        keys, matrix = self._matrices[conversation]
+        similarities = matrix @ embedding
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.threshold else None
+
+    def get(self, conversation: Hashable, query: str, embedding: List[float]) -> Optional[str]:
+        """
+        Returns the cached answer of the same or a similar enough query in the same conversation.
+
+        Args:
+            conversation (Hashable): The key of the conversation, like its `conversation_key`.
+            query (str): The user query.
+            embedding (List[float]): The embedding of the query.
+
+        Returns:
+            Optional[str]: The cached answer, or None on a cache miss.
+        """
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            key = (conversation, normalize_query(query))
+            if key not in self._entries:
+                key = self._closest(conversation, self._normalize_embedding(embedding))
+            if key is None:
+                metrics.increment("answer_cache_misses")
+                return None
+            self._entries.move_to_end(key)
+            metrics.increment("answer_cache_hits")
+            return self._entries[key].answer
+
+    def put(self, conversation: Hashable, query: str, embedding: List[float], answer: str) -> None:
+        """
+        Caches the answer of a query, evicting the least recently used answers above the max size.
+
+        Args:
+            conversation (Hashable): The key of the conversation the answer was generated in.
+            query (str): The user query.
+            embedding (List[float]): The embedding of the query.
+            answer (str): The answer to cache.
+        """
+        with self._lock:
+            key = (conversation, normalize_query(query))
+            self._entries[key] = CacheEntry(answer, self._normalize_embedding(embedding), time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrices.clear()
+
+    def clear(self) -> None:
+        """
+        Drops every cached answer. Called whenever the knowledge base changes.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+            metrics.increment("answer_cache_invalidations")
+
+    def __len__(self) -> int:
+        return len(self._entries)
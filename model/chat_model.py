@@ -1,27 +1,41 @@
-from typing import List
-from sqlalchemy.orm import Session
-from langchain.schema import HumanMessage, AIMessage
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+from langchain_core.embeddings import Embeddings
 from langchain_openai import ChatOpenAI
 from langchain_pinecone import PineconeVectorStore
-from config import MODEL_NAME, OPENAI_API_KEY
-from storage.sqlalchemy_database import get_chat_history
-from .utils import exceeds_model_tokens_limit
-from langchain_core.messages.base import BaseMessage
+from config import (MODEL_NAME, OPENAI_API_KEY, MAX_CONCURRENT_ANSWERS, MAX_TOKENS, HYBRID_RETRIEVAL, RETRIEVAL_K,
+                    RETRIEVAL_CANDIDATES)
+import metrics
+from storage.lexical import BM25Index, reciprocal_rank_fusion
+from storage.sqlalchemy_database import (conversation_key, get_conversation_summary, get_recent_chat_history,
+                                         message_tokens, run_in_thread, run_with_db)
+from .cache import AnswerCache
+from .prompt import base_messages_tokens, build_messages, to_chat_messages
+from .summarizer import summary_message
+from .utils import count_tokens
 
+ERROR_MESSAGE = "Произошла ошибка.\n(Код ошибки: 0x310).\n\nПожалуйста, сообщите об этом разработчику бота @hamadasalhab"
 
-def augment_prompt(query: str, vectorstore: PineconeVectorStore) -> str:
+# Limits the number of answers being generated at the same time
+answer_slots = asyncio.Semaphore(MAX_CONCURRENT_ANSWERS)
+
+
+async def augment_prompt(query: str, vectorstore: PineconeVectorStore, embedding: List[float],
+                         lexical_index: Optional[BM25Index] = None) -> str:
     """
-    Augments the user query with relevant context from the vector store.
+    Augments the user query with relevant context from the vector store and, if given, the lexical index.
 
     Args:
         query (str): The user query.
         vectorstore (PineconeVectorStore): The vector store containing relevant context.
+        embedding (List[float]): The embedding of the user query.
+        lexical_index (BM25Index): The keyword index of the same context, fused with the vector results.
 
     Returns:
         str: The augmented prompt containing the context and the user query.
     """
-    results = vectorstore.similarity_search(query, k=3)
-    source_knowledge = "\n".join([x.page_content for x in results])
+    results = await retrieve(query, vectorstore, embedding, lexical_index)
+    source_knowledge = "\n".join(results)
     augmented_prompt = f"""Using the context below, and the previous chat history, answer the query.
 
     Context:
@@ -31,45 +45,115 @@ def augment_prompt(query: str, vectorstore: PineconeVectorStore) -> str:
     return augmented_prompt
 
 
-def get_answer(query: str, chat: ChatOpenAI, vectorstore: PineconeVectorStore, messages: List[BaseMessage], user_id: int, group_id: int, db: Session) -> str:
+async def retrieve(query: str, vectorstore: PineconeVectorStore, embedding: List[float],
+                   lexical_index: Optional[BM25Index] = None, k: int = RETRIEVAL_K) -> List[str]:
     """
-    Generates an answer to the user query using the chat model and vector store.
+    Retrieves the context most relevant to the query. The vector and keyword results are merged with
+    reciprocal rank fusion, so exact matches on abbreviations and names aren't missed.
 
     Args:
         query (str): The user query.
-        chat: The chat model instance.
         vectorstore (PineconeVectorStore): The vector store containing relevant context.
-        messages (List[str]): The list of previous messages.
+        embedding (List[float]): The embedding of the user query.
+        lexical_index (BM25Index): The keyword index of the same context.
+        k (int): The number of results.
 
     Returns:
-        str: The generated answer.
-        List[str]: The updated list of messages.
+        List[str]: The contents of the best results, best first.
     """
-    chat_history = get_chat_history(db, user_id, group_id)
-
-    # Add all chat history to messages
-    for message in chat_history:
-        messages.append(AIMessage(content=message.content)
-                        if message.is_bot else HumanMessage(content=message.content))
+    if lexical_index is None or not HYBRID_RETRIEVAL:
+        results = await asyncio.to_thread(vectorstore.similarity_search_by_vector_with_score, embedding, k=k)
+        return [document.page_content for document, _ in results]
+
+    vector_results, lexical_results = await asyncio.gather(
+        asyncio.to_thread(vectorstore.similarity_search_by_vector_with_score, embedding, k=RETRIEVAL_CANDIDATES),
+        asyncio.to_thread(lexical_index.search, query, RETRIEVAL_CANDIDATES)
+    )
+    # Vector results don't carry ids, so both rankings are keyed by content
+    return reciprocal_rank_fusion([[document.page_content for document, _ in vector_results],
+                                   [content for _, _, content in lexical_results]])[:k]
+
+
+async def get_answer(query: str, chat: ChatOpenAI, vectorstore: PineconeVectorStore, embeddings: Embeddings,
+                     answer_cache: AnswerCache, lexical_index: BM25Index, user_id: int, group_id: int,
+                     on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    """
+    Generates an answer to the user query using the chat model and vector store, or returns the cached
+    answer of the same or a similar query in the same conversation.
 
-    # Augment prompt with vector store data
-    augmented_prompt = augment_prompt(query, vectorstore)
+    If `on_text` is given, the answer is streamed and `on_text` is called with the text generated so far
+    every time a new token arrives, or once with a cached answer.
 
-    messages.append(HumanMessage(content=augmented_prompt))
+    Args:
+        query (str): The user query.
+        chat: The chat model instance.
+        vectorstore (PineconeVectorStore): The vector store containing relevant context.
+        embeddings (Embeddings): The embeddings model used to embed the query.
+        answer_cache (AnswerCache): The cache of answers to previous queries.
+        lexical_index (BM25Index): The keyword index of the knowledge base.
+        user_id (int): The ID of the user asking.
+        group_id (int): The ID of the group the query was sent in, if any.
+        on_text (Callable): Coroutine function called with the partial answer while it is generated.
 
-    while exceeds_model_tokens_limit("".join(message.content for message in messages)):
-        # Remove the oldest human-AI message pair
-        if len(messages) > 4:  # Keep the initial SystemMessage and at least one exchange
-            messages.pop(3)
-            messages.pop(3)
-        else:
-            # Only occurs when the first human-AI message pair + first augmented prompt exceed token limit
-            return "Произошла ошибка.\n(Код ошибки: 0x310).\n\nПожалуйста, сообщите об этом разработчику бота @hamadasalhab"
+    Returns:
+        str: The generated answer.
+    """
+    async with answer_slots:
+        # The query is embedded once, both to look up the cache and to search the vector store
+        embedding = await embeddings.aembed_query(query)
+        conversation = conversation_key(user_id, group_id)
+        cached_answer = answer_cache.get(conversation, query, embedding)
+        if cached_answer is not None:
+            if on_text is not None:
+                await on_text(cached_answer)
+            return cached_answer
+
+        answer = await _generate_answer(query, chat, vectorstore, embedding, lexical_index, user_id, group_id,
+                                        on_text)
+        if answer != ERROR_MESSAGE:
+            answer_cache.put(conversation, query, embedding, answer)
+        return answer
+
+
+async def _generate_answer(query: str, chat: ChatOpenAI, vectorstore: PineconeVectorStore, embedding: List[float],
+                           lexical_index: BM25Index, user_id: int, group_id: int,
+                           on_text: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    # Augment prompt with vector store and lexical index data
+    augmented_prompt = await augment_prompt(query, vectorstore, embedding, lexical_index)
+
+    # The earlier part of the conversation is sent as its running summary
+    summary = await run_with_db(get_conversation_summary, user_id, group_id)
+    summary_tokens = summary.token_count if summary else 0
+
+    # Load only as much of the latest history as fits next to the prompt. Token counts are
+    # stored with each message, so the history is never tokenized again here.
+    prompt_tokens = base_messages_tokens() + count_tokens(augmented_prompt) + summary_tokens
+    token_budget = MAX_TOKENS - prompt_tokens
+    if token_budget < 0:
+        # Only occurs when the base messages + augmented prompt exceed token limit
+        return ERROR_MESSAGE
+    chat_history = await run_in_thread(get_recent_chat_history, user_id, group_id, token_budget=token_budget,
+                                       after_id=summary.last_message_id if summary else None)
+    messages = build_messages(to_chat_messages(chat_history), augmented_prompt,
+                              summary_message(summary.summary) if summary else None)
+
+    history_tokens = sum(message_tokens(message) for message in chat_history)
+    metrics.observe("prompt_tokens", prompt_tokens + history_tokens)
+    metrics.observe("prompt_tokens_without_summary",
+                    min(prompt_tokens - summary_tokens + history_tokens + (summary.covered_tokens if summary else 0),
+                        MAX_TOKENS))
 
     # Generate response using the chat model
-    res = chat.invoke(messages)
-
-    return res.content
+    if on_text is None:
+        res = await chat.ainvoke(messages)
+        return res.content
+
+    answer = ""
+    async for chunk in chat.astream(messages):
+        if chunk.content:
+            answer += chunk.content
+            await on_text(answer)
+    return answer
 
 
 def get_chat_model() -> ChatOpenAI:
@@ -1,5 +1,16 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
-from config import EMBEDDING_MODEL_NAME
+import metrics
+from config import (EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_SIZE, EMBEDDING_DISK_CACHE_PATH, EMBEDDING_DISK_CACHE_SIZE,
+                    EMBEDDING_BATCH_WINDOW, EMBEDDING_MAX_BATCH_SIZE)
 
 
 def get_embeddings_model() -> OpenAIEmbeddings:
@@ -10,3 +21,227 @@ def get_embeddings_model() -> OpenAIEmbeddings:
         OpenAIEmbeddings: The initialized embeddings model instance.
     """
     return OpenAIEmbeddings(model=EMBEDDING_MODEL_NAME)
+
+
+def get_embedding_service() -> "EmbeddingService":
+    """
+    Initializes and returns the embedding service in front of the OpenAIEmbeddings model.
+
+    Returns:
+        EmbeddingService: The initialized embedding service.
+    """
+    return EmbeddingService(get_embeddings_model())
+
+
+class EmbeddingCache:
+    """
+    Bounded cache of embeddings keyed by content hash: an in-memory LRU in front of an optional
+    SQLite file on disk, so embeddings survive restarts.
+    """
+
+    def __init__(self, size: int = EMBEDDING_CACHE_SIZE, disk_path: str = EMBEDDING_DISK_CACHE_PATH,
+                 disk_size: int = EMBEDDING_DISK_CACHE_SIZE):
+        self.size = size
+        self.disk_size = disk_size
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_writes = 0
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                               "(key TEXT PRIMARY KEY, vector BLOB, created_at REAL DEFAULT (julianday('now')))")
+            self._disk.commit()
+
+    @property
+    def on_disk(self) -> bool:
+        return self._disk is not None
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns the cached embeddings of the given keys.
+
+        Args:
+            keys (List[str]): The content hashes to look up.
+
+        Returns:
+            dict: The embeddings found, by key.
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            missing = [key for key in keys if key not in found]
+            if self._disk is not None and missing:
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = self._disk.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                    for key, blob in rows:
+                        found[key] = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, found[key])
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        """
+        Caches the given embeddings, evicting the oldest ones above the memory and disk sizes.
+
+        Args:
+            items (dict): The embeddings to cache, by key.
+        """
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            if self._disk is None or not items:
+                return
+            self._disk.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                   [(key, vector.tobytes()) for key, vector in items.items()])
+            self._disk_writes += len(items)
+            # Pruning scans the table, so it only runs every thousand writes
+            if self._disk_writes >= 1000:
+                self._disk_writes = 0
+                self._disk.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings "
+                                   "ORDER BY created_at DESC LIMIT -1 OFFSET ?)", (self.disk_size,))
+            self._disk.commit()
+
+
+class EmbeddingService(Embeddings):
+    """
+    Embeddings model wrapper that caches embeddings by content hash, merges concurrent async embed
+    calls made within a small time window into one request, and shares a single request between
+    identical texts that are already being embedded.
+    """
+
+    def __init__(self, model: Embeddings, cache: Optional[EmbeddingCache] = None,
+                 batch_window: float = EMBEDDING_BATCH_WINDOW, max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE):
+        self.model = model
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._model_name = getattr(model, "model", type(model).__name__)
+        # Async micro-batcher state, only used from the event loop
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending: List[Tuple[str, str]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks: Set[asyncio.Task] = set()
+
+    def key(self, text: str) -> str:
+        """
+        Returns the cache key of a text: a hash of the model name and the text.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            str: The content hash of the text.
+        """
+        return hashlib.sha256(f"{self._model_name}\n{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds the texts, only sending the ones that are not cached to the model, each of them once.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: The embeddings, in the order of the texts.
+        """
+        keys = [self.key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        metrics.increment("embedding_cache_hits", len(keys) - len(missing))
+        metrics.increment("embedding_cache_misses", len(missing))
+        if missing:
+            missing_keys = list(missing)
+            new_vectors = {}
+            for start in range(0, len(missing_keys), self.max_batch_size):
+                batch = missing_keys[start:start + self.max_batch_size]
+                embeds = self.model.embed_documents([missing[key] for key in batch])
+                metrics.increment("embedding_requests")
+                new_vectors.update({key: np.asarray(embed, dtype=np.float32) for key, embed in zip(batch, embeds)})
+            self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.aembed_query(text) for text in texts)))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Embeds a text, joining an identical in-flight request or the next micro-batch on a cache miss.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            List[float]: The embedding of the text.
+        """
+        key = self.key(text)
+        future = self._inflight.get(key)
+        if future is None:
+            # Only a disk lookup is slow enough to need a worker thread
+            cached = await asyncio.to_thread(self.cache.get_many, [key]) if self.cache.on_disk else \
+                self.cache.get_many([key])
+            if key in cached:
+                metrics.increment("embedding_cache_hits")
+                return cached[key].tolist()
+            # Another call may have started embedding the same text while the cache was read
+            future = self._inflight.get(key)
+        if future is None:
+            metrics.increment("embedding_cache_misses")
+            future = self._enqueue(key, text)
+        else:
+            metrics.increment("embedding_coalesced")
+        # Shielded, so a cancelled caller doesn't cancel the request shared with other callers
+        return (await asyncio.shield(future)).tolist()
+
+    def _enqueue(self, key: str, text: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[key] = future
+        self._pending.append((key, text))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._embed_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _embed_batch(self, batch: List[Tuple[str, str]]) -> None:
+        try:
+            embeds = await self.model.aembed_documents([text for _, text in batch])
+            metrics.increment("embedding_requests")
+            metrics.observe("embedding_batch_size", len(batch))
+            vectors = {key: np.asarray(embed, dtype=np.float32) for (key, _), embed in zip(batch, embeds)}
+            await asyncio.to_thread(self.cache.put_many, vectors)
+            for key, _ in batch:
+                self._inflight[key].set_result(vectors[key])
+        except Exception as e:
+            for key, _ in batch:
+                if not self._inflight[key].done():
+                    self._inflight[key].set_exception(e)
+        finally:
+            for key, _ in batch:
+                self._inflight.pop(key, None)
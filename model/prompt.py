@@ -0,0 +1,56 @@
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+from langchain.schema import SystemMessage, HumanMessage, AIMessage, BaseMessage
+from storage.models import Message
+from .utils import count_tokens
+
+# Default messages to initialize the bot conversation. A tuple, so no request can modify it.
+BASE_MESSAGES: Tuple[BaseMessage, ...] = (
+    SystemMessage(content="Вы - полезный ассистент, хорошо разбирающийся в простых вопросах из разных профессиональных сфер. Ваша аудитория - обычные пользователи, имеющие небольшой контекст во всех профессиональных сферах. Стремитесь к тому, чтобы уровень чтения по Флешу составил 80 баллов или выше. Используйте активный залог и избегайте наречий. Избегайте сложных терминов и используйте простой язык. Избегайте навязчивости или чрезмерного энтузиазма, вместо этого выражайте спокойную уверенность. Отвечайте кратко и структурировано. Если у вас нет контекста про аббревиатуру, не придумывайте её расшифровку."),
+    HumanMessage(content="Привет, ИИ, как ты сегодня?"),
+    AIMessage(content="У меня все отлично, спасибо вам. Чем я могу вам помочь?")
+)
+
+
+def to_chat_messages(chat_history: Sequence[Message]) -> List[BaseMessage]:
+    """
+    Converts stored chat history rows to chat model messages.
+
+    Args:
+        chat_history (Sequence[Message]): The stored messages, oldest first.
+
+    Returns:
+        List[BaseMessage]: The messages to send to the chat model.
+    """
+    return [AIMessage(content=message.content) if message.is_bot else HumanMessage(content=message.content)
+            for message in chat_history]
+
+
+def build_messages(history: Sequence[BaseMessage], augmented_prompt: str,
+                   summary: Optional[BaseMessage] = None) -> List[BaseMessage]:
+    """
+    Builds the messages for a single request: the base prompt, the conversation summary if any, the given
+    history and the augmented prompt. A new list is allocated on every call, so requests never share
+    conversation state.
+
+    Args:
+        history (Sequence[BaseMessage]): The previous messages of the conversation, oldest first.
+        augmented_prompt (str): The user query augmented with context.
+        summary (Optional[BaseMessage]): The message with the summary of the earlier conversation.
+
+    Returns:
+        List[BaseMessage]: The messages to send to the chat model.
+    """
+    summary_messages = [summary] if summary is not None else []
+    return [*BASE_MESSAGES, *summary_messages, *history, HumanMessage(content=augmented_prompt)]
+
+
+@lru_cache(maxsize=None)
+def base_messages_tokens() -> int:
+    """
+    Returns the number of tokens of the base messages. Counted once per process.
+
+    Returns:
+        int: The number of tokens in the base messages.
+    """
+    return sum(count_tokens(message.content) for message in BASE_MESSAGES)
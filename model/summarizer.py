@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Sequence, Set, Tuple
+from langchain.schema import SystemMessage, HumanMessage, AIMessage, BaseMessage
+from langchain_openai import ChatOpenAI
+import metrics
+from config import SUMMARIZER, SUMMARY_MAX_TOKENS, SUMMARY_TRIGGER_MESSAGES
+from storage.sqlalchemy_database import (get_conversation_summary, get_messages_to_summarize, message_tokens,
+                                         run_in_thread, run_with_db, save_conversation_summary)
+from .prompt import to_chat_messages
+from .utils import get_encoding
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Ниже приведены краткое содержание предыдущей части разговора и новые сообщения.
+Обновите краткое содержание так, чтобы оно включало важные факты, вопросы и ответы из новых сообщений.
+Пишите кратко, не более {max_tokens} токенов.
+
+Краткое содержание:
+{summary}
+
+Новые сообщения:
+{messages}"""
+
+
+def format_messages(messages: Sequence[BaseMessage]) -> str:
+    """
+    Formats chat messages as plain text lines.
+
+    Args:
+        messages (Sequence[BaseMessage]): The messages to format.
+
+    Returns:
+        str: One "Bot: ..." or "User: ..." line per message.
+    """
+    return "\n".join(f"{'Bot' if isinstance(message, AIMessage) else 'User'}: {message.content}"
+                     for message in messages)
+
+
+class Summarizer(ABC):
+    """
+    Folds new conversation messages into a running summary.
+    """
+
+    @abstractmethod
+    async def summarize(self, summary: str, messages: Sequence[BaseMessage]) -> str:
+        """
+        Returns the summary updated with the given messages.
+
+        Args:
+            summary (str): The current summary, empty if there is none yet.
+            messages (Sequence[BaseMessage]): The new messages, oldest first.
+
+        Returns:
+            str: The updated summary.
+        """
+
+
+class ChatSummarizer(Summarizer):
+    """
+    Summarizer that asks the chat model to update the summary.
+    """
+
+    def __init__(self, chat: ChatOpenAI, max_tokens: int = SUMMARY_MAX_TOKENS):
+        self.chat = chat
+        self.max_tokens = max_tokens
+
+    async def summarize(self, summary: str, messages: Sequence[BaseMessage]) -> str:
+        prompt = SUMMARY_PROMPT.format(max_tokens=self.max_tokens, summary=summary or "-",
+                                       messages=format_messages(messages))
+        res = await self.chat.ainvoke([HumanMessage(content=prompt)])
+        return res.content
+
+
+class FakeSummarizer(Summarizer):
+    """
+    Local summarizer that keeps the tail of the summary and the new messages, up to the tokens limit.
+    Used to run and test the bot offline.
+    """
+
+    def __init__(self, max_tokens: int = SUMMARY_MAX_TOKENS):
+        self.max_tokens = max_tokens
+
+    async def summarize(self, summary: str, messages: Sequence[BaseMessage]) -> str:
+        text = "\n".join(filter(None, [summary, format_messages(messages)]))
+        tokens = get_encoding().encode(text)
+        return get_encoding().decode(tokens[-self.max_tokens:])
+
+
+def get_summarizer(chat: ChatOpenAI) -> Summarizer:
+    """
+    Returns the summarizer selected by the SUMMARIZER config.
+
+    Args:
+        chat (ChatOpenAI): The chat model used by the chat summarizer.
+
+    Returns:
+        Summarizer: The configured summarizer.
+    """
+    if SUMMARIZER == "fake":
+        return FakeSummarizer()
+    return ChatSummarizer(chat)
+
+
+def summary_message(summary: str) -> BaseMessage:
+    """
+    Returns the message that gives the chat model the summary of the earlier conversation.
+
+    Args:
+        summary (str): The conversation summary.
+
+    Returns:
+        BaseMessage: The summary message.
+    """
+    return SystemMessage(content=f"Краткое содержание предыдущей части разговора:\n{summary}")
+
+
+async def update_summary(summarizer: Summarizer, user_id: int, group_id: int,
+                         trigger: int = SUMMARY_TRIGGER_MESSAGES) -> bool:
+    """
+    Folds the older unsummarized messages of a conversation into its running summary, once there are
+    at least `trigger` of them.
+
+    Args:
+        summarizer (Summarizer): The summarizer to use.
+        user_id (int): The ID of the user.
+        group_id (int): The ID of the group, if any.
+        trigger (int): The minimum number of unsummarized messages needed to update the summary.
+
+    Returns:
+        bool: True if the summary was updated, False otherwise.
+    """
+    current = await run_with_db(get_conversation_summary, user_id, group_id)
+    summary = current.summary if current else ""
+    last_message_id = current.last_message_id if current else 0
+    covered_tokens = current.covered_tokens if current else 0
+
+    messages = await run_in_thread(get_messages_to_summarize, user_id, group_id, after_id=last_message_id)
+    if len(messages) < trigger:
+        return False
+
+    new_summary = await summarizer.summarize(summary, to_chat_messages(messages))
+    await run_with_db(save_conversation_summary, user_id, group_id, new_summary, messages[-1].id,
+                      covered_tokens + sum(message_tokens(message) for message in messages))
+    metrics.increment("summary_updates")
+    return True
+
+
+# Conversations with a summary update in progress, and the tasks running them
+_summarizing: Set[Tuple[int, int]] = set()
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def schedule_summary_update(summarizer: Summarizer, user_id: int, group_id: int) -> None:
+    """
+    Updates the summary of a conversation in the background, unless an update is already running for it.
+
+    Args:
+        summarizer (Summarizer): The summarizer to use.
+        user_id (int): The ID of the user.
+        group_id (int): The ID of the group, if any.
+    """
+    key = (None if group_id else user_id, group_id)
+    if key in _summarizing:
+        return
+    _summarizing.add(key)
+
+    async def run() -> None:
+        try:
+            await update_summary(summarizer, user_id, group_id)
+        except Exception as e:
+            logger.error(f"Error updating the conversation summary: {str(e)}")
+        finally:
+            _summarizing.discard(key)
+
+    task = asyncio.create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
@@ -1,19 +1,28 @@
+from functools import lru_cache
 import tiktoken
-from config import MAX_TOKENS, MODEL_NAME
+from config import MODEL_NAME
 
 
-def exceeds_model_tokens_limit(text: str) -> bool:
+@lru_cache(maxsize=None)
+def get_encoding() -> tiktoken.Encoding:
     """
-    Uses tiktoken to count the number of tokens in the messages.
+    Returns the tiktoken encoding for the OpenAI model. Loaded once per process.
+
+    Returns:
+        tiktoken.Encoding: The encoding of the chat model.
+    """
+    return tiktoken.encoding_for_model(MODEL_NAME)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the number of tokens in the text.
 
     Args:
         text (string): The text to be tokenized.
 
     Returns:
-        bool: True if the given text exceeds the token limit, False otherise.
+        int: The number of tokens in the text.
     """
-    # Initialize the tiktoken encoding for the OpenAI model
-    encoding = tiktoken.encoding_for_model(MODEL_NAME)
+    return len(get_encoding().encode(text))
 
-    total_tokens = len(encoding.encode(text))
-    return total_tokens > MAX_TOKENS
@@ -0,0 +1,185 @@
+import glob
+import gzip
+import heapq
+import json
+import logging
+import os
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, Optional
+from sqlalchemy import delete, func, select
+from sqlalchemy.engine import Engine
+import metrics
+from config import CHAT_ARCHIVE_PATH, CHAT_HISTORY_RETENTION_MONTHS
+from .models import Message
+from .partitions import (drop_partition, ensure_partitions, month_start, months_between, next_month, partition_name,
+                         previous_month)
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [column.name for column in Message.__table__.columns]
+
+
+def archive_path(month: date, archive_dir: str = CHAT_ARCHIVE_PATH) -> str:
+    return os.path.join(archive_dir, f"{partition_name(month)}.jsonl.gz")
+
+
+def archive_file_month(path: str) -> Optional[date]:
+    # Archive files are named after the partition of their month
+    try:
+        year, month = os.path.basename(path)[len(Message.__tablename__) + 1:].split(".")[0].split("_")
+        return date(int(year), int(month), 1)
+    except ValueError:
+        return None
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, "rt", encoding="utf-8") as archive_file:
+        for line in archive_file:
+            yield json.loads(line)
+
+
+def merge_records(new: Iterable[Dict[str, Any]], archived: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Merges the messages of a month being archived with the ones already in its archive file, both
+    sorted by timestamp and ID. A message in both, like after a run that failed once the file was
+    written, is kept once. Records are compared whole, since SQLite reuses the IDs of deleted rows.
+
+    Args:
+        new (Iterable[dict]): The records of the messages being archived.
+        archived (Iterable[dict]): The records of the archive file.
+
+    Yields:
+        dict: The records of the month, sorted.
+    """
+    previous = None
+    # ISO timestamps sort like the dates, so copies of a message come one after the other
+    for record in heapq.merge(new, archived, key=lambda record: (record['timestamp'] or "", record['id'])):
+        if record != previous:
+            yield record
+        previous = record
+
+
+def archive_month(engine: Engine, month: date, archive_dir: str = CHAT_ARCHIVE_PATH) -> int:
+    """
+    Moves the messages of a month to a gzip compressed JSON lines file, then drops the partition of
+    the month, or deletes its rows on databases without partitioning.
+
+    The file is written completely before anything is deleted. When the month was already archived,
+    like when messages of the month were saved afterwards, they are merged into its file instead of
+    replacing it, and messages archived again after a failure are kept once.
+
+    Args:
+        engine (Engine): The database engine.
+        month (date): The first day of the month.
+        archive_dir (str): The directory of the archive files.
+
+    Returns:
+        int: The number of archived messages.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_path(month, archive_dir)
+    start, end = datetime.combine(month, datetime.min.time()), datetime.combine(next_month(month), datetime.min.time())
+    in_month = (Message.timestamp >= start) & (Message.timestamp < end)
+
+    count = 0
+    with engine.begin() as connection:
+        rows = connection.execute(select(Message.__table__).where(in_month).order_by(Message.timestamp, Message.id)
+                                  .execution_options(yield_per=1000))
+
+        def new_records() -> Iterator[Dict[str, Any]]:
+            nonlocal count
+            for row in rows:
+                record = dict(row._mapping)
+                record['timestamp'] = record['timestamp'].isoformat() if record['timestamp'] else None
+                count += 1
+                yield record
+
+        with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as archive_file:
+            for record in merge_records(new_records(), read_records(path)):
+                archive_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if count == 0:
+            os.remove(f"{path}.tmp")
+            drop_partition(connection, month)
+            return 0
+        os.replace(f"{path}.tmp", path)
+
+        # The partition holds exactly the month, other rows of the month can only be in the default partition
+        drop_partition(connection, month)
+        connection.execute(delete(Message.__table__).where(in_month))
+
+    metrics.increment("archived_messages", count)
+    logger.info(f"Archived {count} messages of {month:%Y-%m} to {path}")
+    return count
+
+
+def apply_retention(engine: Engine, retention_months: int = CHAT_HISTORY_RETENTION_MONTHS,
+                    archive_dir: str = CHAT_ARCHIVE_PATH) -> int:
+    """
+    Archives every month older than the retention period.
+
+    Args:
+        engine (Engine): The database engine.
+        retention_months (int): The number of months kept in the database, including the current one.
+            0 keeps every message.
+        archive_dir (str): The directory of the archive files.
+
+    Returns:
+        int: The number of archived messages.
+    """
+    if retention_months <= 0:
+        return 0
+    # First day of the oldest month that is kept
+    cutoff = month_start(datetime.utcnow().date())
+    for _ in range(retention_months - 1):
+        cutoff = previous_month(cutoff)
+    with engine.connect() as connection:
+        oldest = connection.execute(select(func.min(Message.timestamp))).scalar()
+    if oldest is None or oldest.date() >= cutoff:
+        return 0
+    return sum(archive_month(engine, month, archive_dir) for month in months_between(oldest.date(), cutoff)
+               if month < cutoff)
+
+
+def maintain_chat_history(engine: Engine) -> None:
+    """
+    Creates the upcoming monthly partitions and archives the months older than the retention period.
+    Run periodically by the bot.
+
+    Args:
+        engine (Engine): The database engine.
+    """
+    ensure_partitions(engine)
+    apply_retention(engine)
+
+
+def read_archive(user_id: int = None, group_id: int = None, start_date: date = None, end_date: date = None,
+                 archive_dir: str = CHAT_ARCHIVE_PATH) -> Iterator[Message]:
+    """
+    Reads the archived messages of a conversation, oldest first. The files of the months outside the
+    given dates are not read.
+
+    Args:
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+        start_date (date): If given, the first day of the months to read.
+        end_date (date): If given, the last day of the months to read.
+        archive_dir (str): The directory of the archive files.
+
+    Yields:
+        Message: The archived messages of the months, detached from any session.
+    """
+    # File names sort by month
+    for path in sorted(glob.glob(os.path.join(archive_dir, f"{Message.__tablename__}_*.jsonl.gz"))):
+        month = archive_file_month(path)
+        if month and ((start_date and next_month(month) <= start_date) or (end_date and month > end_date)):
+            continue
+        for record in read_records(path):
+            if group_id and record['group_id'] != group_id:
+                continue
+            if not group_id and user_id and record['user_id'] != user_id:
+                continue
+            if record['timestamp']:
+                record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+            yield Message(**{column: record.get(column) for column in COLUMNS})
@@ -0,0 +1,110 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import tiktoken
+import metrics
+from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from model.utils import get_encoding
+from .ingestion import Chunk
+
+# A piece of a document as returned by the readers: its text and metadata, e.g. {"page": 3}
+Section = Tuple[str, Dict[str, Any]]
+
+
+def ends_with_complete_character(data: bytes) -> bool:
+    """
+    Checks whether UTF-8 bytes end with a complete character rather than the first bytes of one.
+
+    Args:
+        data (bytes): The UTF-8 bytes.
+
+    Returns:
+        bool: False if the last character is cut, True otherwise.
+    """
+    # The last character starts at the last byte that is not a continuation byte, 10xxxxxx
+    for length in range(1, min(4, len(data)) + 1):
+        byte = data[-length]
+        if byte & 0xC0 != 0x80:
+            expected = 1 if byte < 0x80 else 2 if byte >> 5 == 0b110 else 3 if byte >> 4 == 0b1110 else 4
+            return length == expected
+    return True
+
+
+def character_boundary(encoding: tiktoken.Encoding, tokens: List[int], cut: int) -> int:
+    """
+    Moves a cut in a list of tokens back to the nearest position between two characters. Tokens are pieces
+    of UTF-8 bytes, so a Cyrillic letter can span two tokens, and decoding either half gives U+FFFD.
+
+    Args:
+        encoding (tiktoken.Encoding): The encoding of the tokens.
+        tokens (List[int]): The tokens.
+        cut (int): The position of the cut.
+
+    Returns:
+        int: The position of the cut, moved back by a few tokens if it was inside a character.
+    """
+    # A character is at most 4 bytes, so it spans at most 4 tokens
+    for boundary in range(cut, max(cut - 4, 0), -1):
+        tail = b"".join(encoding.decode_single_token_bytes(token) for token in tokens[max(boundary - 4, 0):boundary])
+        if ends_with_complete_character(tail):
+            return boundary
+    return cut
+
+
+def chunk_sections(sections: Iterable[Section], source: Optional[str] = None, max_tokens: int = CHUNK_MAX_TOKENS,
+                   overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Chunk]:
+    """
+    Turns document sections into token-bounded chunks. Small sections, like headings and short paragraphs,
+    are merged with the next ones, and sections larger than max_tokens are split. Consecutive chunks
+    share `overlap` tokens, so a sentence cut at a chunk boundary is complete in one of them. Cuts are
+    never made inside a character.
+
+    Args:
+        sections (Iterable[Section]): The (text, metadata) sections of the document, in order.
+        source (str): The name of the document, stored in the metadata of every chunk.
+        max_tokens (int): The maximum number of tokens per chunk.
+        overlap (int): The number of tokens repeated at the start of the next chunk.
+
+    Yields:
+        Chunk: The chunks of the document, in order.
+    """
+    encoding = get_encoding()
+    newline = encoding.encode("\n")
+    overlap = min(overlap, max_tokens // 2)
+    buffer: List[int] = []
+    buffer_metadata: Dict[str, Any] = {}
+    count = 0
+
+    def make_chunk(tokens: List[int], metadata: Dict[str, Any]) -> Chunk:
+        chunk_metadata = dict(metadata)
+        if source is not None:
+            chunk_metadata["source"] = source
+        return Chunk(text=encoding.decode(tokens).strip(), metadata=chunk_metadata)
+
+    for text, metadata in sections:
+        if not text or not text.strip():
+            continue
+        tokens = encoding.encode(text.strip())
+        # A section that fits in a chunk is never split, a larger one fills up the current chunk
+        if buffer and len(tokens) <= max_tokens and len(buffer) + len(newline) + len(tokens) > max_tokens:
+            yield make_chunk(buffer, buffer_metadata)
+            count += 1
+            # Start the next chunk with the tail of the previous one
+            buffer = buffer[character_boundary(encoding, buffer, len(buffer) - overlap):] if overlap else []
+            buffer_metadata = dict(metadata)
+        if not buffer:
+            buffer_metadata = dict(metadata)
+        elif "page" in metadata and metadata["page"] != buffer_metadata.get("page"):
+            buffer_metadata["page_end"] = metadata["page"]
+        buffer = buffer + newline + tokens if buffer else tokens
+
+        # Split what doesn't fit in one chunk into windows that overlap
+        while len(buffer) > max_tokens:
+            end = character_boundary(encoding, buffer, max_tokens)
+            yield make_chunk(buffer[:end], buffer_metadata)
+            count += 1
+            buffer = buffer[character_boundary(encoding, buffer, end - overlap):]
+            buffer_metadata = dict(metadata)
+
+    if buffer and (count == 0 or len(buffer) > overlap):
+        yield make_chunk(buffer, buffer_metadata)
+        count += 1
+    metrics.observe("chunks_per_document", count)
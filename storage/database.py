@@ -1,25 +1,22 @@
 import time
-from typing import List
+from typing import Union
+from langchain_core.embeddings import Embeddings
 from langchain_pinecone import PineconeVectorStore
 from pinecone import ServerlessSpec, Pinecone
-from langchain.schema import SystemMessage, HumanMessage, AIMessage, BaseMessage
 from config import PINECONE_API_KEY
 from model.embeddings import get_embeddings_model
-from config import INDEX_NAME
+from config import INDEX_NAME, INDEX_DIMENSION, VECTOR_BACKEND, LOCAL_INDEX_PATH
 from pinecone.data.index import Index
+from .local_index import LocalIndex
 
-# Default messages to initialize the bot conversation
-messages = [
-    SystemMessage(content="Вы - полезный ассистент, хорошо разбирающийся в простых вопросах из разных профессиональных сфер. Ваша аудитория - обычные пользователи, имеющие небольшой контекст во всех профессиональных сферах. Стремитесь к тому, чтобы уровень чтения по Флешу составил 80 баллов или выше. Используйте активный залог и избегайте наречий. Избегайте сложных терминов и используйте простой язык. Избегайте навязчивости или чрезмерного энтузиазма, вместо этого выражайте спокойную уверенность. Отвечайте кратко и структурировано. Если у вас нет контекста про аббревиатуру, не придумывайте её расшифровку."),
-    HumanMessage(content="Привет, ИИ, как ты сегодня?"),
-    AIMessage(content="У меня все отлично, спасибо вам. Чем я могу вам помочь?")
-]
 
-
-def get_index() -> Index:
+def get_index(pool_threads: int = 1) -> Index:
     """
     Initializes and returns the Pinecone index. Creates the index if it doesn't exist.
 
+    Args:
+        pool_threads (int): The number of threads in the index connection pool.
+
     Returns:
         index: The initialized Pinecone index.
     """
@@ -31,38 +28,55 @@ def get_index() -> Index:
     if INDEX_NAME not in existing_indexes:
         pinecone_client.create_index(
             INDEX_NAME,
-            dimension=1536,
+            dimension=INDEX_DIMENSION,
             metric='dotproduct',
             spec=spec
         )
         while not pinecone_client.describe_index(INDEX_NAME).status['ready']:
             time.sleep(1)
 
-    index = pinecone_client.Index(INDEX_NAME)
+    index = pinecone_client.Index(INDEX_NAME, pool_threads=pool_threads)
     time.sleep(1)
     index.describe_index_stats()
 
     return index
 
 
-def get_vectorstore(index: Index) -> PineconeVectorStore:
+def get_local_index() -> LocalIndex:
     """
-    Initializes and returns the Pinecone vector store with the specified index.
+    Opens and returns the local vector index, creating it if it doesn't exist.
+
+    Returns:
+        LocalIndex: The local index.
+    """
+    return LocalIndex(LOCAL_INDEX_PATH, dimension=INDEX_DIMENSION)
+
+
+def get_configured_index(pool_threads: int = 1) -> Union[Index, LocalIndex]:
+    """
+    Returns the index of the vector store backend selected by the VECTOR_BACKEND config.
 
     Args:
-        index: The Pinecone index to use.
+        pool_threads (int): The number of threads in the Pinecone index connection pool.
 
     Returns:
-        PineconeVectorStore: The initialized vector store.
+        The Pinecone index, or the local index.
     """
-    return PineconeVectorStore(index=index, embedding=get_embeddings_model(), text_key="text")
+    if VECTOR_BACKEND == "local":
+        return get_local_index()
+    return get_index(pool_threads=pool_threads)
 
 
-def get_base_messages() -> List[BaseMessage]:
+def get_vectorstore(index: Union[Index, LocalIndex], embeddings: Embeddings = None) -> PineconeVectorStore:
     """
-    Returns the default list of messages to initialize the bot conversation.
+    Initializes and returns the Pinecone vector store with the specified index.
+
+    Args:
+        index: The Pinecone or local index to use.
+        embeddings (Embeddings): The embeddings model to use. A new one is created if not given.
 
     Returns:
-        list: The default messages.
+        PineconeVectorStore: The initialized vector store.
     """
-    return messages
+    return PineconeVectorStore(index=index, embedding=embeddings or get_embeddings_model(), text_key="text")
+
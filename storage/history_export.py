@@ -0,0 +1,109 @@
+import gzip
+import itertools
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional
+import metrics
+from config import HISTORY_EXPORT_BATCH_SIZE
+from .archive import read_archive
+from .message_log import message_key, pending_messages
+from .models import Message, SessionLocal
+
+
+def in_range(message: Message, start: Optional[datetime], end: Optional[datetime]) -> bool:
+    return (start is None or message.timestamp >= start) and (end is None or message.timestamp < end)
+
+
+def format_message(message: Message) -> str:
+    """
+    Formats a message as one line of the exported history. Line breaks in the content are kept, and
+    the following lines are indented so every message starts with its time and sender.
+
+    Args:
+        message (Message): The message.
+
+    Returns:
+        str: The line, ending with a line break.
+    """
+    sender = "Bot" if message.is_bot else "User"
+    content = (message.content or "").replace("\n", "\n    ")
+    timestamp = f"{message.timestamp:%Y-%m-%d %H:%M:%S}" if message.timestamp else "-"
+    return f"[{timestamp}] {sender}: {content}\n"
+
+
+def stream_saved_messages(user_id: int = None, group_id: int = None, start: datetime = None, end: datetime = None,
+                          batch_size: int = HISTORY_EXPORT_BATCH_SIZE) -> Iterator[Message]:
+    """
+    Streams the saved messages of a conversation, oldest first, through a server-side cursor, so only
+    one batch of rows is in memory at a time.
+
+    Args:
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+        start (datetime): If given, only messages sent at or after this time are returned.
+        end (datetime): If given, only messages sent before this time are returned.
+        batch_size (int): The number of rows fetched at a time.
+
+    Yields:
+        Message: The saved messages.
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(Message)
+        if group_id:
+            query = query.filter(Message.group_id == group_id)
+        elif user_id:
+            query = query.filter(Message.user_id == user_id)
+        if start is not None:
+            query = query.filter(Message.timestamp >= start)
+        if end is not None:
+            query = query.filter(Message.timestamp < end)
+        for message in query.order_by(Message.timestamp, Message.id).yield_per(batch_size):
+            yield message
+            # Rows already written are not needed anymore
+            db.expunge(message)
+    finally:
+        db.close()
+
+
+def export_chat_history(file_path: str, user_id: int = None, group_id: int = None, start_date: date = None,
+                        end_date: date = None, include_archive: bool = False) -> int:
+    """
+    Writes the history of a conversation to a gzip compressed text file, one message per line, oldest
+    first. Messages are streamed from the archive and the database to the file, so memory use doesn't
+    depend on the length of the history.
+
+    Args:
+        file_path (str): The path of the file to write.
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+        start_date (date): If given, the first day of the exported history.
+        end_date (date): If given, the last day of the exported history, included.
+        include_archive (bool): Whether to include the months moved to the archive by the retention policy.
+
+    Returns:
+        int: The number of exported messages.
+    """
+    start = datetime.combine(start_date, datetime.min.time()) if start_date else None
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time()) if end_date else None
+
+    # Read before the saved rows, so a message saved in between is found in one of them
+    pending = [message for message in pending_messages(user_id, group_id) if in_range(message, start, end)]
+    pending_keys = {message_key(message) for message in pending}
+
+    saved = (message for message in stream_saved_messages(user_id, group_id, start, end)
+             if message_key(message) not in pending_keys)
+    messages = itertools.chain(saved, pending)
+    if include_archive:
+        # Archived months are older than every message kept in the database
+        archived = (message for message in read_archive(user_id, group_id, start_date, end_date)
+                    if in_range(message, start, end))
+        messages = itertools.chain(archived, messages)
+
+    count = 0
+    with gzip.open(file_path, "wt", encoding="utf-8") as history_file:
+        for message in messages:
+            history_file.write(format_message(message))
+            count += 1
+    metrics.increment("history_exports")
+    metrics.observe("history_export_messages", count)
+    return count
@@ -0,0 +1,220 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+from langchain_core.embeddings import Embeddings
+from pinecone.data.index import Index
+from tenacity import Retrying, stop_after_attempt, wait_exponential
+from tqdm import tqdm
+import metrics
+from config import INGEST_BATCH_SIZE, INGEST_BATCH_TOKENS, INGEST_WORKERS, INGEST_RETRIES
+from model.utils import count_tokens
+from .lexical import BM25Index
+from .manifest import IngestionManifest
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Chunk:
+    """
+    A unit of the knowledge base: the text that is embedded, and the metadata stored with its vector.
+    The "text" metadata key is the content given to the chat model, and defaults to the text.
+    """
+    text: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    # Text indexed for keyword search, defaults to the text
+    search_text: Optional[str] = None
+    # Vector id, derived from the source and content when not given
+    id: Optional[str] = None
+
+
+def content_id(chunk: Chunk) -> str:
+    """
+    Returns the deterministic vector id of a chunk: a hash of its source followed by a hash of its
+    source and content. Ingesting the same chunk twice gives the same id, and ids of one source share
+    a prefix.
+
+    Args:
+        chunk (Chunk): The chunk.
+
+    Returns:
+        str: The vector id.
+    """
+    source = chunk.metadata.get("source", "")
+    content = chunk.search_text or chunk.text
+    source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+    content_hash = hashlib.sha256(f"{source}\n{content}".encode("utf-8")).hexdigest()[:32]
+    return f"{source_hash}-{content_hash}"
+
+
+@dataclass
+class IngestionStats:
+    chunks: int = 0
+    skipped: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    # Ids of every chunk of the ingested document, including the skipped ones
+    ids: Set[str] = field(default_factory=set)
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+
+def make_batches(chunks: Iterable[Chunk], max_size: int = INGEST_BATCH_SIZE,
+                 max_tokens: int = INGEST_BATCH_TOKENS) -> Iterator[List[Chunk]]:
+    """
+    Groups chunks into batches bounded both by number of chunks and by number of tokens.
+
+    Args:
+        chunks (Iterable[Chunk]): The chunks to group.
+        max_size (int): The maximum number of chunks per batch.
+        max_tokens (int): The maximum number of tokens per batch.
+
+    Yields:
+        List[Chunk]: A batch of chunks.
+    """
+    batch: List[Chunk] = []
+    batch_tokens = 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk.text)
+        if batch and (len(batch) >= max_size or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(chunk)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def with_retries(operation: Callable[[], Any], retries: int = INGEST_RETRIES) -> Any:
+    """
+    Runs an operation, retrying it with exponential backoff when it fails.
+
+    Args:
+        operation (Callable): The operation to run.
+        retries (int): The maximum number of attempts.
+
+    Returns:
+        The result of the operation.
+    """
+    for attempt in Retrying(stop=stop_after_attempt(retries), wait=wait_exponential(multiplier=0.5, max=10),
+                            reraise=True):
+        with attempt:
+            return operation()
+
+
+def ingest_chunks(chunks: Iterable[Chunk], index: Index, embeddings: Embeddings, lexical_index: BM25Index,
+                  manifest: Optional[IngestionManifest] = None, batch_size: int = INGEST_BATCH_SIZE,
+                  workers: int = INGEST_WORKERS, on_batch: Callable[[int], None] = None) -> IngestionStats:
+    """
+    Streams chunks into the knowledge base: batches them, then embeds and upserts every batch in a
+    bounded pool of workers, retrying failed calls with backoff. Chunks get content-addressed ids, and
+    chunks already recorded in the manifest are skipped without being embedded.
+
+    Args:
+        chunks (Iterable[Chunk]): The chunks to ingest. Consumed lazily, so it can be a generator.
+        index: The Pinecone index to update.
+        embeddings (Embeddings): The embeddings model.
+        lexical_index (BM25Index): The keyword index to update.
+        manifest (IngestionManifest): The record of the chunks already ingested.
+        batch_size (int): The maximum number of chunks per embedding request.
+        workers (int): The number of batches processed at the same time.
+        on_batch (Callable[[int], None]): Called with the number of chunks processed so far after every batch.
+
+    Returns:
+        IngestionStats: The number of chunks ingested and skipped, batches, and the time it took.
+    """
+    stats = IngestionStats()
+    started = time.monotonic()
+    lock = threading.Lock()
+    # Bounds the batches held in memory when the chunks are produced faster than they are ingested
+    slots = threading.Semaphore(workers * 2)
+    progress = tqdm(desc="Ingesting chunks", unit="chunk")
+
+    def process(batch: List[Chunk]) -> None:
+        try:
+            existing = manifest.existing(chunk.id for chunk in batch) if manifest is not None else set()
+            new_chunks = [chunk for chunk in batch if chunk.id not in existing]
+            if new_chunks:
+                embeds = with_retries(lambda: embeddings.embed_documents([chunk.text for chunk in new_chunks]))
+                ids = [chunk.id for chunk in new_chunks]
+                metadata = [{'text': chunk.text, **chunk.metadata} for chunk in new_chunks]
+                with_retries(lambda: index.upsert(vectors=list(zip(ids, embeds, metadata))))
+                lexical_index.add_many((vector_id, chunk.search_text or chunk.text, item['text'])
+                                       for vector_id, chunk, item in zip(ids, new_chunks, metadata))
+                if manifest is not None:
+                    manifest.add_many((chunk.id, chunk.metadata.get("source", "")) for chunk in new_chunks)
+            with lock:
+                stats.chunks += len(new_chunks)
+                stats.skipped += len(batch) - len(new_chunks)
+                stats.batches += 1
+                progress.update(len(batch))
+                processed = stats.chunks + stats.skipped
+            if on_batch is not None:
+                on_batch(processed)
+        finally:
+            slots.release()
+
+    def unique_chunks() -> Iterator[Chunk]:
+        # Repeated chunks of the document, like a header on every page, are only ingested once
+        seen = stats.ids
+        for chunk in chunks:
+            chunk.id = chunk.id or content_id(chunk)
+            if chunk.id in seen:
+                with lock:
+                    stats.skipped += 1
+                continue
+            seen.add(chunk.id)
+            yield chunk
+
+    futures: Set[Future] = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as executor:
+        for batch in make_batches(unique_chunks(), max_size=batch_size):
+            slots.acquire()
+            futures.add(executor.submit(process, batch))
+            # Surface failures early instead of after the whole document
+            for future in [future for future in futures if future.done()]:
+                futures.discard(future)
+                future.result()
+        for future in futures:
+            future.result()
+    progress.close()
+
+    stats.seconds = time.monotonic() - started
+    metrics.increment("ingested_chunks", stats.chunks)
+    metrics.increment("skipped_chunks", stats.skipped)
+    metrics.observe("ingestion_chunks_per_second", stats.chunks_per_second)
+    logger.info(f"Ingested {stats.chunks} chunks, skipped {stats.skipped} unchanged chunks, in {stats.batches} "
+                f"batches in {stats.seconds:.1f}s ({stats.chunks_per_second:.1f} chunks/sec)")
+    return stats
+
+
+def remove_vectors(ids: Iterable[str], index: Index, lexical_index: BM25Index,
+                   manifest: Optional[IngestionManifest] = None, batch_size: int = 1000) -> int:
+    """
+    Deletes chunks from the vector index, the keyword index and the manifest.
+
+    Args:
+        ids (Iterable[str]): The vector ids of the chunks to delete.
+        index: The Pinecone index to update.
+        lexical_index (BM25Index): The keyword index to update.
+        manifest (IngestionManifest): The record of the chunks already ingested.
+        batch_size (int): The maximum number of ids per delete request, 1000 for Pinecone.
+
+    Returns:
+        int: The number of deleted chunks.
+    """
+    ids = list(ids)
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        with_retries(lambda: index.delete(ids=batch))
+        lexical_index.remove_many(batch)
+        if manifest is not None:
+            manifest.remove_many(batch)
+    metrics.increment("removed_chunks", len(ids))
+    return len(ids)
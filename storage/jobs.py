@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Set
+import metrics
+from config import INGEST_JOBS_PATH, INGEST_JOB_WORKERS, INGEST_JOBS_POLL_INTERVAL, INGEST_PROGRESS_INTERVAL
+from storage.updaters import update_knowledge_base
+from storage.utils import count_tabular_rows
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class IngestionJob:
+    """
+    An uploaded file waiting to be ingested, and the message that reports its progress.
+    """
+    id: int
+    file_path: str
+    source: str
+    chat_id: int
+    message_id: int
+    status: str = QUEUED
+    processed: int = 0
+    # Estimated number of chunks, when it can be estimated before ingesting
+    total: Optional[int] = None
+    error: Optional[str] = None
+
+
+class JobStore:
+    """
+    SQLite table of the ingestion jobs, so queued and interrupted jobs survive a restart.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS jobs "
+                                 "(id INTEGER PRIMARY KEY AUTOINCREMENT, file_path TEXT, source TEXT, chat_id INTEGER, "
+                                 "message_id INTEGER, status TEXT, processed INTEGER, total INTEGER, error TEXT, "
+                                 "created_at TEXT DEFAULT (datetime('now')), updated_at TEXT DEFAULT (datetime('now')))")
+        self._connection.commit()
+
+    def add(self, file_path: str, source: str, chat_id: int, message_id: int) -> IngestionJob:
+        """
+        Stores a new queued job.
+
+        Args:
+            file_path (str): The path to the uploaded file.
+            source (str): The name identifying the document across versions.
+            chat_id (int): The chat of the progress message.
+            message_id (int): The ID of the progress message.
+
+        Returns:
+            IngestionJob: The new job.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (file_path, source, chat_id, message_id, status, processed) VALUES (?, ?, ?, ?, ?, 0)",
+                (file_path, source, chat_id, message_id, QUEUED))
+            self._connection.commit()
+        return IngestionJob(cursor.lastrowid, file_path, source, chat_id, message_id)
+
+    def update(self, job: IngestionJob) -> None:
+        """
+        Saves the status and progress of a job.
+
+        Args:
+            job (IngestionJob): The job to save.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, processed = ?, total = ?, error = ?, updated_at = datetime('now') "
+                "WHERE id = ?", (job.status, job.processed, job.total, job.error, job.id))
+            self._connection.commit()
+
+    def unfinished(self) -> List[IngestionJob]:
+        """
+        Returns the jobs that are queued, or were running when the bot stopped, oldest first.
+
+        Returns:
+            List[IngestionJob]: The unfinished jobs.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, file_path, source, chat_id, message_id, status, processed, total, error FROM jobs "
+                "WHERE status IN (?, ?) ORDER BY id", (QUEUED, RUNNING)).fetchall()
+        return [IngestionJob(*row) for row in rows]
+
+
+def estimate_total(file_path: str) -> Optional[int]:
+    """
+    Returns an estimate of the number of chunks a file will be split into, if it can be made without
+    parsing the file.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        Optional[int]: The estimated number of rows of a tabular file, None for other files.
+    """
+    if file_path.endswith(('.xlsx', '.csv')):
+        return count_tabular_rows(file_path)
+    return None
+
+
+class IngestionQueue:
+    """
+    Persistent queue of uploaded files that are ingested by background workers, so handlers return
+    right away and chats stay responsive while large files are ingested.
+
+    Progress is saved after every batch. A job interrupted by a restart is run again from the start,
+    and the chunks ingested before the restart are found in the ingestion manifest and skipped, so
+    only the rest of the file is embedded.
+
+    The local indexes take a single writer, so in webhook mode only the first worker runs jobs. The
+    queues of the other workers have no workers and only store the jobs, which the first worker finds
+    with `watch`.
+    """
+
+    def __init__(self, store: JobStore, report: Callable[[IngestionJob], Awaitable[None]],
+                 workers: int = INGEST_JOB_WORKERS, progress_interval: float = INGEST_PROGRESS_INTERVAL):
+        self.store = store
+        self.report = report
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: Set[asyncio.Task] = set()
+        # Ids of the jobs queued and not finished yet, so they are not queued twice
+        self._known: Set[int] = set()
+
+    async def start(self, resume: bool = True) -> None:
+        """
+        Starts the workers and requeues the jobs left unfinished by the previous run.
+
+        Args:
+            resume (bool): Whether to requeue the unfinished jobs now, or leave it to a later `resume` call.
+        """
+        self._queue = asyncio.Queue()
+        if resume:
+            await self.resume()
+        for _ in range(self.workers):
+            task = asyncio.create_task(self._work())
+            self._tasks.add(task)
+
+    async def resume(self) -> None:
+        """
+        Requeues the jobs left unfinished by the previous run. When several bot processes share the job
+        store, only one of them resumes the jobs.
+        """
+        for job in await asyncio.to_thread(self.store.unfinished):
+            if job.id in self._known:
+                continue
+            logger.info(f"Resuming ingestion job {job.id} of {job.source}")
+            self._enqueue(job)
+
+    async def watch(self, interval: float = INGEST_JOBS_POLL_INTERVAL) -> None:
+        """
+        Queues the jobs submitted by the other processes sharing the job store, until cancelled.
+
+        Args:
+            interval (float): The number of seconds between two checks of the store.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.resume()
+            except Exception as e:
+                logger.error(f"Could not check the ingestion jobs: {e}")
+
+    def _enqueue(self, job: IngestionJob) -> None:
+        # Without workers, the job is left in the store for the process running them
+        if self.workers:
+            self._known.add(job.id)
+            self._queue.put_nowait(job)
+
+    async def stop(self) -> None:
+        """
+        Stops the workers. Running jobs stay unfinished in the store and are resumed on the next start.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def submit(self, file_path: str, source: str, chat_id: int, message_id: int) -> IngestionJob:
+        """
+        Queues a file for ingestion.
+
+        Args:
+            file_path (str): The path to the uploaded file.
+            source (str): The name identifying the document across versions.
+            chat_id (int): The chat of the progress message.
+            message_id (int): The ID of the progress message.
+
+        Returns:
+            IngestionJob: The queued job.
+        """
+        job = await asyncio.to_thread(self.store.add, file_path, source, chat_id, message_id)
+        self._enqueue(job)
+        metrics.increment("ingestion_jobs_queued")
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._known.discard(job.id)
+                self._queue.task_done()
+
+    async def _run(self, job: IngestionJob) -> None:
+        job.status = RUNNING
+        job.processed = 0
+        try:
+            job.total = await asyncio.to_thread(estimate_total, job.file_path)
+        except Exception as e:
+            logger.warning(f"Could not count the chunks of {job.file_path}: {e}")
+        await asyncio.to_thread(self.store.update, job)
+        await self._report(job)
+
+        def on_batch(processed: int) -> None:
+            # Called from the ingestion threads, saving the checkpoint of the job
+            job.processed = processed
+            self.store.update(job)
+
+        task = asyncio.create_task(update_knowledge_base(job.file_path, job.source, on_batch))
+        reported = job.processed
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=self.progress_interval)
+                if not task.done() and job.processed != reported:
+                    reported = job.processed
+                    await self._report(job)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+        try:
+            task.result()
+            job.status = DONE
+            metrics.increment("ingestion_jobs_done")
+        except Exception as e:
+            logger.error(f"Ingestion job {job.id} of {job.source} failed: {e}")
+            job.status = FAILED
+            job.error = str(e)
+            metrics.increment("ingestion_jobs_failed")
+        await asyncio.to_thread(self.store.update, job)
+        await self._report(job)
+
+    async def _report(self, job: IngestionJob) -> None:
+        try:
+            await self.report(job)
+        except Exception as e:
+            logger.warning(f"Could not report the progress of ingestion job {job.id}: {e}")
+
+
+_queue: Optional[IngestionQueue] = None
+
+
+def init_ingestion_queue(report: Callable[[IngestionJob], Awaitable[None]],
+                         workers: int = INGEST_JOB_WORKERS) -> IngestionQueue:
+    """
+    Creates the process-wide ingestion queue. Called once when the bot starts, before starting the queue.
+
+    Args:
+        report (Callable): Coroutine function called with a job when its progress or status changes.
+        workers (int): The number of jobs run at once. 0 in the processes that only submit jobs.
+
+    Returns:
+        IngestionQueue: The new queue.
+    """
+    global _queue
+    _queue = IngestionQueue(JobStore(INGEST_JOBS_PATH), report, workers)
+    return _queue
+
+
+def get_ingestion_queue() -> IngestionQueue:
+    """
+    Returns the process-wide ingestion queue.
+
+    Returns:
+        IngestionQueue: The shared queue.
+    """
+    if _queue is None:
+        raise RuntimeError("The ingestion queue was not initialized")
+    return _queue
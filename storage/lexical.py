@@ -0,0 +1,238 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from config import LEXICAL_INDEX_COMPACT_RATIO
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Logs shorter than this are never compacted, as replaying them is cheap anyway
+MIN_COMPACT_ENTRIES = 1000
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lower case word tokens. Works for Russian and English text, and keeps
+    abbreviations and product names like "CRM" or "1С" as whole tokens.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The tokens of the text.
+    """
+    return TOKEN_PATTERN.findall(text.lower().replace("ё", "е"))
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """
+    Merges several rankings of the same items into one with reciprocal rank fusion.
+
+    Args:
+        rankings (Sequence[Sequence[str]]): The rankings to merge, best item first.
+        k (int): The rank offset that dampens the weight of the top ranks.
+
+    Returns:
+        List[str]: The merged ranking, best item first.
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    """
+    Local inverted index that ranks documents with BM25. Updated incrementally and persisted as an
+    append-only log of added and removed documents.
+
+    Every update of a document appends to the log, so once it has `compact_ratio` entries per live
+    document it is rewritten to the live documents, and loading the index stays proportional to them.
+
+    A single process writes to the index. Other processes open it too and `refresh` it to read the
+    documents written since.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75,
+                 compact_ratio: float = LEXICAL_INDEX_COMPACT_RATIO):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        # Document id -> (content returned by searches, number of tokens, term frequencies)
+        self._documents: Dict[str, Tuple[str, int, Counter]] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._total_length = 0
+        # Bytes of the log already applied, and the device and inode of the log file they were read from
+        self._offset = 0
+        self._log_id: Optional[Tuple[int, int]] = None
+        # Number of entries in the log
+        self._entries = 0
+        if os.path.exists(path):
+            self._read_log()
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._open_log()
+
+    def _open_log(self) -> None:
+        self._log = open(self.path, "a", encoding="utf-8")
+        stat = os.fstat(self._log.fileno())
+        self._log_id = (stat.st_dev, stat.st_ino)
+
+    def _read_log(self) -> None:
+        # Applies the entries appended to the log since it was last read. A line another process is
+        # still writing is left for the next read.
+        with open(self.path, "rb") as log_file:
+            stat = os.fstat(log_file.fileno())
+            if (stat.st_dev, stat.st_ino) != self._log_id:
+                # Another file replaced the log, like a compacted one, so it is read from the start
+                self._documents.clear()
+                self._postings.clear()
+                self._total_length = self._offset = self._entries = 0
+                self._log_id = (stat.st_dev, stat.st_ino)
+            log_file.seek(self._offset)
+            for line in log_file:
+                if not line.endswith(b"\n"):
+                    break
+                self._offset += len(line)
+                self._entries += 1
+                entry = json.loads(line)
+                if entry["op"] == "add":
+                    self._add(entry["id"], entry["text"], entry["content"])
+                elif entry["op"] == "remove":
+                    self._remove(entry["id"])
+
+    def _log_written(self, entries: int) -> None:
+        self._log.flush()
+        self._offset = os.fstat(self._log.fileno()).st_size
+        self._entries += entries
+        if self._entries > max(MIN_COMPACT_ENTRIES, self.compact_ratio * len(self._documents)):
+            self._compact()
+
+    def _compact(self) -> None:
+        # Writes the live documents to a new log that atomically replaces the old one. The processes
+        # reading the index see another file and read it again from the start.
+        compacted_path = f"{self.path}.compacting"
+        with open(compacted_path, "w", encoding="utf-8") as log_file:
+            for document_id, (content, _, frequencies) in self._documents.items():
+                # The indexed text is only kept as term frequencies, which is all BM25 needs
+                text = " ".join(term for term, frequency in frequencies.items() for _ in range(frequency))
+                log_file.write(json.dumps({"op": "add", "id": document_id, "text": text, "content": content},
+                                          ensure_ascii=False) + "\n")
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        self._log.close()
+        os.replace(compacted_path, self.path)
+        self._open_log()
+        self._offset = os.fstat(self._log.fileno()).st_size
+        self._entries = len(self._documents)
+
+    def refresh(self) -> bool:
+        """
+        Reads the documents added and removed by the process writing to the index since it was
+        opened or last refreshed.
+
+        Returns:
+            bool: Whether the index changed.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if (stat.st_dev, stat.st_ino) == self._log_id and stat.st_size == self._offset:
+                return False
+            log_id = self._log_id
+            self._read_log()
+            if self._log_id != log_id:
+                self._log.close()
+                self._open_log()
+            return True
+
+    def _add(self, document_id: str, text: str, content: str) -> None:
+        self._remove(document_id)
+        frequencies = Counter(tokenize(text))
+        length = sum(frequencies.values())
+        self._documents[document_id] = (content, length, frequencies)
+        self._total_length += length
+        for term, frequency in frequencies.items():
+            self._postings[term][document_id] = frequency
+
+    def _remove(self, document_id: str) -> None:
+        document = self._documents.pop(document_id, None)
+        if document is None:
+            return
+        _, length, frequencies = document
+        self._total_length -= length
+        for term in frequencies:
+            self._postings[term].pop(document_id, None)
+            if not self._postings[term]:
+                del self._postings[term]
+
+    def add_many(self, documents: Iterable[Tuple[str, str, str]]) -> None:
+        """
+        Adds or replaces documents.
+
+        Args:
+            documents (Iterable): (id, text to index, content to return) tuples.
+        """
+        entries = 0
+        with self._lock:
+            for document_id, text, content in documents:
+                self._add(document_id, text, content)
+                self._log.write(json.dumps({"op": "add", "id": document_id, "text": text, "content": content},
+                                           ensure_ascii=False) + "\n")
+                entries += 1
+            self._log_written(entries)
+
+    def remove_many(self, document_ids: Iterable[str]) -> None:
+        """
+        Removes documents.
+
+        Args:
+            document_ids (Iterable[str]): The ids of the documents to remove.
+        """
+        entries = 0
+        with self._lock:
+            for document_id in document_ids:
+                if document_id in self._documents:
+                    self._remove(document_id)
+                    self._log.write(json.dumps({"op": "remove", "id": document_id}) + "\n")
+                    entries += 1
+            self._log_written(entries)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float, str]]:
+        """
+        Returns the documents that best match the query terms.
+
+        Args:
+            query (str): The search query.
+            k (int): The maximum number of results.
+
+        Returns:
+            List[Tuple[str, float, str]]: (id, score, content) of the best documents, best first.
+        """
+        with self._lock:
+            count = len(self._documents)
+            if count == 0:
+                return []
+            average_length = self._total_length / count
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for document_id, frequency in postings.items():
+                    length = self._documents[document_id][1]
+                    scores[document_id] += idf * frequency * (self.k1 + 1) / (
+                        frequency + self.k1 * (1 - self.b + self.b * length / average_length))
+            best = sorted(scores, key=scores.get, reverse=True)[:k]
+            return [(document_id, scores[document_id], self._documents[document_id][0]) for document_id in best]
+
+    def __len__(self) -> int:
+        return len(self._documents)
@@ -0,0 +1,359 @@
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+VECTORS_FILE = "vectors.f32"
+LOG_FILE = "metadata.jsonl"
+MIN_CAPACITY = 1024
+
+
+def matches_filter(metadata: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+    """
+    Checks metadata against a Pinecone style filter. Supports field equality, "$eq", "$ne", "$in" and "$nin".
+
+    Args:
+        metadata (dict): The metadata of a vector.
+        filter (dict): The filter, e.g. {"source_id": {"$eq": "faq.xlsx"}}.
+
+    Returns:
+        bool: True if the metadata matches every condition of the filter.
+    """
+    for field, condition in (filter or {}).items():
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, expected in condition.items():
+            if operator == "$eq" and value != expected:
+                return False
+            if operator == "$ne" and value == expected:
+                return False
+            if operator == "$in" and value not in expected:
+                return False
+            if operator == "$nin" and value in expected:
+                return False
+    return True
+
+
+class LocalIndex:
+    """
+    In-process vector index with the subset of the Pinecone index API the bot uses, so it can replace
+    Pinecone in small deployments and CI.
+
+    Vectors are rows of a memory-mapped float32 matrix that grows by appending, and scores are dot
+    products, like the "dotproduct" metric of the Pinecone index. Ids and metadata are kept in memory
+    and persisted as an append-only log next to the matrix.
+
+    A single process writes to the index. Other processes open it too and `refresh` it to read the
+    vectors written since.
+    """
+
+    def __init__(self, path: str, dimension: int):
+        self.path = path
+        self.dimension = dimension
+        self._lock = threading.RLock()
+        self._ids: List[Optional[str]] = []
+        self._metadata: List[Optional[Dict[str, Any]]] = []
+        self._rows: Dict[str, int] = {}
+        # Bytes of the log already applied, and the device and inode of the log file they were read from
+        self._offset = 0
+        self._log_id: Optional[Tuple[int, int]] = None
+        os.makedirs(path, exist_ok=True)
+        self._read_log()
+        self._matrix = self._open_matrix(max(MIN_CAPACITY, len(self._ids)))
+        # Rows holding a vector, so searches can skip deleted rows without a Python loop
+        self._live = np.zeros(self._matrix.shape[0], dtype=bool)
+        self._live[list(self._rows.values())] = True
+        self._open_log()
+
+    def _open_log(self) -> None:
+        self._log = open(os.path.join(self.path, LOG_FILE), "a", encoding="utf-8")
+        stat = os.fstat(self._log.fileno())
+        self._log_id = (stat.st_dev, stat.st_ino)
+
+    def _open_matrix(self, capacity: int) -> np.memmap:
+        vectors_path = os.path.join(self.path, VECTORS_FILE)
+        size = capacity * self.dimension * np.dtype(np.float32).itemsize
+        with open(vectors_path, "ab") as vectors_file:
+            if vectors_file.tell() < size:
+                vectors_file.truncate(size)
+        capacity = os.path.getsize(vectors_path) // (self.dimension * np.dtype(np.float32).itemsize)
+        return np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+
+    def _read_log(self) -> None:
+        # Applies the entries appended to the log since it was last read. A line another process is
+        # still writing is left for the next read.
+        log_path = os.path.join(self.path, LOG_FILE)
+        if not os.path.exists(log_path):
+            return
+        with open(log_path, "rb") as log_file:
+            stat = os.fstat(log_file.fileno())
+            if (stat.st_dev, stat.st_ino) != self._log_id:
+                # Another index replaced this one, like a restored snapshot, so it is read from the start
+                self._ids, self._metadata, self._rows, self._offset = [], [], {}, 0
+                self._log_id = (stat.st_dev, stat.st_ino)
+            log_file.seek(self._offset)
+            for line in log_file:
+                if not line.endswith(b"\n"):
+                    break
+                self._offset += len(line)
+                entry = json.loads(line)
+                if entry["op"] == "upsert":
+                    row = entry["row"]
+                    while len(self._ids) <= row:
+                        self._ids.append(None)
+                        self._metadata.append(None)
+                    self._ids[row] = entry["id"]
+                    self._metadata[row] = entry["metadata"]
+                    self._rows[entry["id"]] = row
+                elif entry["op"] == "delete":
+                    row = self._rows.pop(entry["id"], None)
+                    if row is not None:
+                        self._ids[row] = None
+                        self._metadata[row] = None
+
+    def _log_written(self) -> None:
+        self._log.flush()
+        self._offset = os.fstat(self._log.fileno()).st_size
+
+    def refresh(self) -> bool:
+        """
+        Reads the vectors upserted and deleted by the process writing to the index since it was opened
+        or last refreshed.
+
+        Returns:
+            bool: Whether the index changed.
+        """
+        try:
+            stat = os.stat(os.path.join(self.path, LOG_FILE))
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if (stat.st_dev, stat.st_ino) == self._log_id and stat.st_size == self._offset:
+                return False
+            log_id = self._log_id
+            self._read_log()
+            if self._log_id != log_id:
+                self._log.close()
+                self._open_log()
+            # The writer may have grown or replaced the matrix
+            self._matrix = self._open_matrix(max(MIN_CAPACITY, len(self._ids)))
+            self._live = np.zeros(self._matrix.shape[0], dtype=bool)
+            self._live[list(self._rows.values())] = True
+            return True
+
+    def _append_row(self) -> int:
+        row = len(self._ids)
+        if row >= self._matrix.shape[0]:
+            self._matrix.flush()
+            self._matrix = self._open_matrix(self._matrix.shape[0] * 2)
+            self._live = np.concatenate([self._live, np.zeros(self._matrix.shape[0] - len(self._live), dtype=bool)])
+        self._ids.append(None)
+        self._metadata.append(None)
+        return row
+
+    def upsert(self, vectors: Iterable[Any], **kwargs) -> Dict[str, int]:
+        """
+        Inserts or overwrites vectors, given as (id, values, metadata) tuples or dicts with these keys.
+
+        Args:
+            vectors (Iterable): The vectors to upsert.
+
+        Returns:
+            dict: The number of upserted vectors under "upserted_count".
+        """
+        count = 0
+        with self._lock:
+            for vector in vectors:
+                if isinstance(vector, dict):
+                    vector_id, values, metadata = vector["id"], vector["values"], vector.get("metadata") or {}
+                else:
+                    vector_id, values, metadata = vector[0], vector[1], vector[2] if len(vector) > 2 else {}
+                row = self._rows.get(vector_id)
+                if row is None:
+                    row = self._append_row()
+                    self._rows[vector_id] = row
+                self._matrix[row] = np.asarray(values, dtype=np.float32)
+                self._live[row] = True
+                self._ids[row] = vector_id
+                self._metadata[row] = dict(metadata)
+                self._log.write(json.dumps({"op": "upsert", "row": row, "id": vector_id, "metadata": metadata},
+                                           ensure_ascii=False) + "\n")
+                count += 1
+            self._matrix.flush()
+            self._log_written()
+        return {"upserted_count": count}
+
+    def delete(self, ids: Optional[Sequence[str]] = None, delete_all: bool = False,
+               filter: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Deletes vectors by id, by metadata filter, or all of them.
+
+        Args:
+            ids (Sequence[str]): The ids of the vectors to delete.
+            delete_all (bool): Whether to delete every vector.
+            filter (dict): A metadata filter selecting the vectors to delete.
+
+        Returns:
+            dict: An empty response, like Pinecone.
+        """
+        with self._lock:
+            if delete_all:
+                ids = list(self._rows)
+            elif filter is not None:
+                ids = [vector_id for vector_id, row in self._rows.items()
+                       if matches_filter(self._metadata[row], filter)]
+            for vector_id in ids or []:
+                row = self._rows.pop(vector_id, None)
+                if row is None:
+                    continue
+                self._live[row] = False
+                self._ids[row] = None
+                self._metadata[row] = None
+                self._log.write(json.dumps({"op": "delete", "id": vector_id}) + "\n")
+            self._log_written()
+        return {}
+
+    def query_batch(self, vectors: Sequence[Sequence[float]], top_k: int = 10, include_values: bool = False,
+                    include_metadata: bool = False, filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Finds the top k vectors by dot product for several query vectors with a single matrix product.
+
+        Args:
+            vectors (Sequence): The query vectors.
+            top_k (int): The number of matches per query.
+            include_values (bool): Whether to return the vector values.
+            include_metadata (bool): Whether to return the metadata.
+            filter (dict): A metadata filter the matches must pass.
+
+        Returns:
+            List[dict]: One query response with "matches" per query vector.
+        """
+        with self._lock:
+            count = len(self._ids)
+            queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+            if count == 0:
+                return [{"matches": [], "namespace": ""} for _ in queries]
+            scores = queries @ self._matrix[:count].T
+            live = self._live[:count].copy()
+            if filter is not None:
+                live[[row for row in np.flatnonzero(live) if not matches_filter(self._metadata[row], filter)]] = False
+            scores[:, ~live] = -np.inf
+
+            k = min(top_k, int(live.sum()))
+            responses = []
+            for query_scores in scores:
+                if k == 0:
+                    responses.append({"matches": [], "namespace": ""})
+                    continue
+                top = np.argpartition(-query_scores, k - 1)[:k]
+                top = top[np.argsort(-query_scores[top])]
+                matches = []
+                for row in top:
+                    match = {"id": self._ids[row], "score": float(query_scores[row])}
+                    if include_values:
+                        match["values"] = self._matrix[row].tolist()
+                    if include_metadata:
+                        # Copied, since callers like PineconeVectorStore pop keys from it
+                        match["metadata"] = dict(self._metadata[row])
+                    matches.append(match)
+                responses.append({"matches": matches, "namespace": ""})
+            return responses
+
+    def query(self, vector: Sequence[float] = None, top_k: int = 10, include_values: bool = False,
+              include_metadata: bool = False, filter: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Finds the top k vectors by dot product for a query vector.
+
+        Args:
+            vector (Sequence[float]): The query vector.
+            top_k (int): The number of matches.
+            include_values (bool): Whether to return the vector values.
+            include_metadata (bool): Whether to return the metadata.
+            filter (dict): A metadata filter the matches must pass.
+
+        Returns:
+            dict: The query response, with the matches under "matches".
+        """
+        return self.query_batch([vector], top_k, include_values, include_metadata, filter)[0]
+
+    def fetch(self, ids: Sequence[str], **kwargs) -> Dict[str, Any]:
+        """
+        Returns the vectors with the given ids.
+
+        Args:
+            ids (Sequence[str]): The ids of the vectors.
+
+        Returns:
+            dict: The found vectors by id under "vectors".
+        """
+        with self._lock:
+            vectors = {}
+            for vector_id in ids:
+                row = self._rows.get(vector_id)
+                if row is not None:
+                    vectors[vector_id] = {"id": vector_id, "values": self._matrix[row].tolist(),
+                                          "metadata": dict(self._metadata[row])}
+            return {"vectors": vectors, "namespace": ""}
+
+    def list(self, prefix: str = "", limit: int = 100, **kwargs) -> Iterator[List[str]]:
+        """
+        Lists vector ids starting with a prefix, in pages, like Pinecone serverless indexes.
+
+        Args:
+            prefix (str): The prefix of the ids.
+            limit (int): The number of ids per page.
+
+        Yields:
+            List[str]: A page of ids.
+        """
+        with self._lock:
+            ids = sorted(vector_id for vector_id in self._rows if vector_id.startswith(prefix))
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    def describe_index_stats(self, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            return {"dimension": self.dimension, "index_fullness": 0.0, "total_vector_count": len(self._rows),
+                    "namespaces": {"": {"vector_count": len(self._rows)}}}
+
+    def snapshot(self, target: str) -> None:
+        """
+        Writes a compacted copy of the index, without deleted rows, to a directory.
+
+        Args:
+            target (str): The snapshot directory.
+        """
+        with self._lock:
+            os.makedirs(target, exist_ok=True)
+            rows = sorted(self._rows.values())
+            self._matrix[rows].tofile(os.path.join(target, VECTORS_FILE))
+            with open(os.path.join(target, LOG_FILE), "w", encoding="utf-8") as log_file:
+                for new_row, row in enumerate(rows):
+                    log_file.write(json.dumps({"op": "upsert", "row": new_row, "id": self._ids[row],
+                                               "metadata": self._metadata[row]}, ensure_ascii=False) + "\n")
+
+    @classmethod
+    def restore(cls, snapshot: str, path: str, dimension: int) -> "LocalIndex":
+        """
+        Replaces the index at a path with a snapshot and opens it.
+
+        Args:
+            snapshot (str): The snapshot directory.
+            path (str): The directory of the index to replace.
+            dimension (int): The dimension of the vectors.
+
+        Returns:
+            LocalIndex: The restored index.
+        """
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        shutil.copytree(snapshot, path)
+        return cls(path, dimension)
+
+    def close(self) -> None:
+        with self._lock:
+            self._matrix.flush()
+            self._log.close()
@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, NamedTuple, Set, Tuple
+
+
+class SourceInfo(NamedTuple):
+    source: str
+    version: int
+    vector_count: int
+    updated_at: str
+
+
+class IngestionManifest:
+    """
+    Local record of the chunks already in the knowledge base, by their content-addressed vector id,
+    so ingesting a document again only embeds and upserts the chunks that changed. Also keeps the
+    current version of every source document.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS chunks "
+                                 "(id TEXT PRIMARY KEY, source TEXT, ingested_at REAL DEFAULT (julianday('now')))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_chunks_source ON chunks (source)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS sources "
+                                 "(source TEXT PRIMARY KEY, version INTEGER, updated_at TEXT)")
+        self._connection.commit()
+
+    def existing(self, ids: Iterable[str]) -> Set[str]:
+        """
+        Returns which of the given vector ids were already ingested.
+
+        Args:
+            ids (Iterable[str]): The vector ids to check.
+
+        Returns:
+            Set[str]: The ids found in the manifest.
+        """
+        ids = list(ids)
+        found = set()
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT id FROM chunks WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                found.update(row[0] for row in rows)
+        return found
+
+    def add_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        """
+        Records ingested chunks.
+
+        Args:
+            items (Iterable[Tuple[str, str]]): (vector id, source) pairs.
+        """
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO chunks (id, source) VALUES (?, ?)", items)
+            self._connection.commit()
+
+    def remove_many(self, ids: Iterable[str]) -> None:
+        """
+        Forgets chunks that were deleted from the knowledge base.
+
+        Args:
+            ids (Iterable[str]): The vector ids to forget.
+        """
+        with self._lock:
+            self._connection.executemany("DELETE FROM chunks WHERE id = ?", [(vector_id,) for vector_id in ids])
+            self._connection.commit()
+
+    def ids_for_source(self, source: str) -> List[str]:
+        """
+        Returns the vector ids of the chunks of a source document.
+
+        Args:
+            source (str): The source document.
+
+        Returns:
+            List[str]: The vector ids.
+        """
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT id FROM chunks WHERE source = ?", (source,))]
+
+    def version(self, source: str) -> int:
+        """
+        Returns the current version of a source document.
+
+        Args:
+            source (str): The source document.
+
+        Returns:
+            int: The version, 0 if the source was never ingested.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT version FROM sources WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else 0
+
+    def set_version(self, source: str, version: int) -> None:
+        """
+        Records the version of a source document that is now in the knowledge base.
+
+        Args:
+            source (str): The source document.
+            version (int): The new version.
+        """
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO sources (source, version, updated_at) "
+                                     "VALUES (?, ?, datetime('now'))", (source, version))
+            self._connection.commit()
+
+    def sources(self) -> List[SourceInfo]:
+        """
+        Returns the source documents in the knowledge base, with their version and number of vectors.
+
+        Returns:
+            List[SourceInfo]: The sources, by name.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT sources.source, sources.version, COUNT(chunks.id), sources.updated_at FROM sources "
+                "LEFT JOIN chunks ON chunks.source = sources.source "
+                "GROUP BY sources.source ORDER BY sources.source").fetchall()
+        return [SourceInfo(*row) for row in rows]
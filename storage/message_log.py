@@ -0,0 +1,271 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import exc, insert
+import metrics
+from config import (MESSAGE_LOG_BATCH_SIZE, MESSAGE_LOG_FLUSH_INTERVAL, MESSAGE_LOG_MAX_BUFFER,
+                    MESSAGE_LOG_DEAD_LETTER_PATH)
+from model.utils import count_tokens
+from .models import Message, SessionLocal
+from .usage import add_daily_usage
+
+logger = logging.getLogger(__name__)
+
+
+def message_key(message: Message) -> Tuple[Any, ...]:
+    """
+    Returns what identifies a message before it has an ID, to tell a buffered message from its saved row.
+
+    Args:
+        message (Message): The message.
+
+    Returns:
+        tuple: The timestamp, sender and content of the message.
+    """
+    return message.timestamp, bool(message.is_bot), message.content
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Tells a database that is unavailable, where the same insert can succeed later, from a database
+    rejecting the rows themselves.
+
+    Args:
+        error (Exception): The error raised by the insert.
+
+    Returns:
+        bool: Whether the insert should be retried as is.
+    """
+    return (isinstance(error, (exc.DisconnectionError, exc.InterfaceError, exc.OperationalError, exc.TimeoutError))
+            or getattr(error, 'connection_invalidated', False))
+
+
+class MessageLog:
+    """
+    Write-behind buffer of chat messages. Messages are appended without waiting for the database,
+    and a background thread inserts them in bulk when the buffer reaches `batch_size` messages or
+    every `flush_interval` seconds.
+
+    Buffered messages are not in the database yet, so the history readers merge them in with
+    `pending` to see the messages they just wrote.
+
+    Messages the database rejects, and the oldest messages once `max_buffer` messages wait for an
+    unavailable database, are appended to the dead-letter file instead of being retried forever.
+    """
+
+    def __init__(self, batch_size: int = MESSAGE_LOG_BATCH_SIZE, flush_interval: float = MESSAGE_LOG_FLUSH_INTERVAL,
+                 max_buffer: int = MESSAGE_LOG_MAX_BUFFER, dead_letter_path: str = MESSAGE_LOG_DEAD_LETTER_PATH):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dead_letter_path = dead_letter_path
+        self._dead_letter_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        # Serializes flushes, so rows are inserted in the order they were appended
+        self._flush_lock = threading.Lock()
+        self._buffer: List[Dict[str, Any]] = []
+        # Rows taken from the buffer by a flush that is not committed yet
+        self._inflight: List[Dict[str, Any]] = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="message-log", daemon=True)
+        self._thread.start()
+
+    def append(self, user_id: int, group_id: int, is_bot: bool, content: str, is_group: bool,
+               file_name: str = None, file_type: str = None) -> None:
+        """
+        Buffers a message to be saved.
+
+        Args:
+            user_id (int): The ID of the user.
+            group_id (int): The ID of the group, if any.
+            is_bot (bool): Whether the message was sent by the bot.
+            content (str): The content of the message.
+            is_group (bool): Whether the message was sent in a group.
+            file_name (str): The name of the uploaded file, if any.
+            file_type (str): The type of the uploaded file, if any.
+        """
+        row = dict(user_id=user_id, group_id=group_id, is_bot=is_bot, content=content, is_group=is_group,
+                   file_name=file_name, file_type=file_type, timestamp=datetime.utcnow(),
+                   token_count=count_tokens(content))
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The message log is closed")
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+            # Bounds the memory used while the database is unavailable
+            excess = len(self._inflight) + len(self._buffer) - self.max_buffer
+            overflow = self._buffer[:excess] if excess > 0 else []
+            del self._buffer[:len(overflow)]
+        if overflow:
+            self._dead_letter(overflow, f"more than {self.max_buffer} messages waiting to be saved")
+
+    def pending(self, user_id: int = None, group_id: int = None) -> List[Message]:
+        """
+        Returns the messages of a conversation that are not saved yet.
+
+        Args:
+            user_id (int): The ID of the user, used when no group ID is given.
+            group_id (int): The ID of the group.
+
+        Returns:
+            List[Message]: Unsaved messages, without IDs, oldest first.
+        """
+        with self._lock:
+            rows = self._inflight + self._buffer
+        if group_id:
+            rows = [row for row in rows if row['group_id'] == group_id]
+        elif user_id:
+            rows = [row for row in rows if row['user_id'] == user_id]
+        return [Message(**row) for row in rows]
+
+    def flush(self) -> int:
+        """
+        Inserts the buffered messages in a single bulk insert. When the database is unavailable, the
+        messages are kept in the buffer for the next flush. When it rejects the batch, the halves of the
+        batch are inserted in turn, down to single messages, and the messages it rejects go to the
+        dead-letter file, so one bad message doesn't hold back the others.
+
+        Returns:
+            int: The number of saved messages.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                self._inflight, self._buffer = self._buffer, []
+            started = time.monotonic()
+            try:
+                count = self._insert_inflight()
+            except Exception as e:
+                logger.error(f"Error saving {len(self._inflight)} messages, retrying on next flush: {e}")
+                with self._lock:
+                    self._buffer[:0] = self._inflight
+                    self._inflight = []
+                raise
+            metrics.increment("message_log_flushes")
+            metrics.observe("message_log_batch_size", count)
+            metrics.observe("message_log_flush_ms", (time.monotonic() - started) * 1000)
+            return count
+
+    def _insert(self, rows: List[Dict[str, Any]]) -> int:
+        db = SessionLocal()
+        try:
+            db.execute(insert(Message), rows)
+            add_daily_usage(db, rows)
+            db.commit()
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _insert_inflight(self) -> int:
+        # Sizes of the runs of in-flight rows left to insert, the next one last. Saved and rejected
+        # messages leave the in-flight rows, so a failure of the database in between only puts back the rest
+        sizes = [len(self._inflight)]
+        count = 0
+        while sizes:
+            size = sizes.pop()
+            rows = self._inflight[:size]
+            try:
+                count += self._insert(rows)
+            except Exception as e:
+                if is_transient(e):
+                    raise
+                if size > 1:
+                    logger.warning(f"Error saving {size} messages at once, saving them in halves: {e}")
+                    sizes += [size - size // 2, size // 2]
+                    continue
+                self._dead_letter(rows, e)
+            with self._lock:
+                del self._inflight[:size]
+        return count
+
+    def _dead_letter(self, rows: List[Dict[str, Any]], reason: Any) -> None:
+        logger.error(f"Moving {len(rows)} messages that could not be saved to {self.dead_letter_path}: {reason}")
+        metrics.increment("message_log_dead_letters", len(rows))
+        with self._dead_letter_lock:
+            os.makedirs(os.path.dirname(self.dead_letter_path) or ".", exist_ok=True)
+            with open(self.dead_letter_path, "a", encoding="utf-8") as file:
+                for row in rows:
+                    file.write(json.dumps({**row, 'error': str(reason)}, default=str, ensure_ascii=False) + "\n")
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # Already logged, the messages stay buffered
+                pass
+
+    def close(self) -> None:
+        """
+        Stops the background thread and saves the remaining buffered messages.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+
+_message_log: Optional[MessageLog] = None
+_message_log_lock = threading.Lock()
+
+
+def get_message_log() -> MessageLog:
+    """
+    Returns the process-wide message log, creating it on first use.
+
+    Returns:
+        MessageLog: The shared message log.
+    """
+    global _message_log
+    with _message_log_lock:
+        if _message_log is None:
+            _message_log = MessageLog()
+        return _message_log
+
+
+def pending_messages(user_id: int = None, group_id: int = None) -> List[Message]:
+    """
+    Returns the messages of a conversation that are buffered in the message log and not saved yet.
+
+    Args:
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+
+    Returns:
+        List[Message]: Unsaved messages, oldest first.
+    """
+    if _message_log is None:
+        return []
+    return _message_log.pending(user_id, group_id)
+
+
+@atexit.register
+def close_message_log() -> None:
+    """
+    Saves the buffered messages and stops the message log. Called on shutdown, and at exit in case
+    the bot stops without shutting down.
+    """
+    global _message_log
+    with _message_log_lock:
+        if _message_log is not None:
+            _message_log.close()
+            _message_log = None
@@ -1,18 +1,52 @@
 # storage/models.py
 
-from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Text, Boolean, TIMESTAMP, func
+from sqlalchemy import create_engine, inspect, make_url, text, Column, Integer, BigInteger, String, Text, Boolean, Date, TIMESTAMP, Index, case, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+from config import (ASYNC_DATABASE_URL, CHAT_HISTORY_PARTITIONING, DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+                    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_SYNC_POOL_SIZE, DB_SYNC_MAX_OVERFLOW)
 from sqlalchemy.engine.base import Engine
 
-engine: Engine = create_engine(DATABASE_URL)
+
+def pool_options(url: str, pool_size: int, max_overflow: int) -> dict:
+    """
+    Returns the connection pool settings of an engine. SQLite databases keep the pool SQLAlchemy picks
+    for their driver, since a sized pool would open several connections to an in-memory database.
+
+    Args:
+        url (str): The database URL.
+        pool_size (int): The number of connections kept open.
+        max_overflow (int): The number of connections opened on top of them under load.
+
+    Returns:
+        dict: The keyword arguments of `create_engine`.
+    """
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return dict(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=DB_POOL_TIMEOUT,
+                pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+
+
+# Sync engine for the schema setup, the background message log thread and the loaders of large results,
+# which run in threads. Engines don't connect until first used.
+engine: Engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL, DB_SYNC_POOL_SIZE, DB_SYNC_MAX_OVERFLOW))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine used by the handlers
+async_engine: AsyncEngine = create_async_engine(ASYNC_DATABASE_URL,
+                                                **pool_options(ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
 class Message(Base):
     __tablename__ = 'chat_history'
+    __table_args__ = (
+        # Used to read the latest messages of a conversation newest-first
+        Index('ix_chat_history_group_id_timestamp', 'group_id', 'timestamp'),
+        Index('ix_chat_history_user_id_timestamp', 'user_id', 'timestamp'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(BigInteger, index=True)
@@ -23,6 +57,68 @@ class Message(Base):
     is_group = Column(Boolean)
     file_name = Column(String, nullable=True)
     file_type = Column(String, nullable=True)
+    # Number of tokens in the content, computed once when the message is saved
+    token_count = Column(Integer, nullable=True)
+
+
+class ConversationSummary(Base):
+    __tablename__ = 'conversation_summaries'
+    __table_args__ = (
+        # One running summary per conversation. The key columns are never NULL, since a unique index
+        # doesn't treat two NULLs as equal.
+        Index('ux_conversation_summaries_conversation', 'conversation_id', 'is_group', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    # The group ID for group conversations, the user ID otherwise
+    conversation_id = Column(BigInteger, nullable=False)
+    is_group = Column(Boolean, nullable=False)
+    summary = Column(Text)
+    token_count = Column(Integer)
+    # ID of the newest chat_history message folded into the summary
+    last_message_id = Column(Integer)
+    # Total tokens of the messages folded into the summary
+    covered_tokens = Column(Integer)
+    updated_at = Column(TIMESTAMP, server_default=func.now())
+
+
+class DailyUsage(Base):
+    __tablename__ = 'daily_usage'
+
+    # Messages and uploaded files of a user per UTC day, kept up to date when messages are saved
+    date = Column(Date, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    request_count = Column(Integer, nullable=False, default=0)
+    file_count = Column(Integer, nullable=False, default=0)
+
+
+def create_tables() -> None:
+    """
+    Creates the tables, and the columns and indexes added to existing tables. Called once when the bot is set up.
+    """
+    # Imported here, since the partitioning module reads the Message model
+    from .partitions import create_partitioned_table, ensure_partitions
+
+    backfill_usage = not inspect(engine).has_table(DailyUsage.__tablename__)
+    if CHAT_HISTORY_PARTITIONING:
+        create_partitioned_table(engine)
+        ensure_partitions(engine)
+    Base.metadata.create_all(bind=engine)
+
+    # create_all doesn't add columns and indexes to tables that already exist
+    existing_columns = {column['name'] for column in inspect(engine).get_columns(Message.__tablename__)}
+    if 'token_count' not in existing_columns:
+        with engine.begin() as connection:
+            connection.execute(text(f'ALTER TABLE {Message.__tablename__} ADD COLUMN token_count INTEGER'))
 
+    for table_index in Message.__table__.indexes:
+        table_index.create(bind=engine, checkfirst=True)
 
-Base.metadata.create_all(bind=engine)
+    # The usage rollup is built from the existing messages once, then maintained on every write
+    if backfill_usage:
+        usage = select(func.date(Message.timestamp), Message.user_id, func.count(Message.id),
+                       func.sum(case((Message.file_name.isnot(None), 1), else_=0))
+                       ).group_by(func.date(Message.timestamp), Message.user_id)
+        with engine.begin() as connection:
+            connection.execute(insert(DailyUsage).from_select(
+                ['date', 'user_id', 'request_count', 'file_count'], usage))
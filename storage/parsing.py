@@ -0,0 +1,124 @@
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Iterator, List, Optional, Tuple
+from docx import Document
+from pypdf import PdfReader
+from config import PARSER_PROCESSES, PDF_PAGES_PER_TASK
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_parser_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Returns the process pool that parses documents, creating it on first use.
+
+    Returns:
+        Optional[ProcessPoolExecutor]: The pool, or None if parsing is configured to run in the calling thread.
+    """
+    global _pool
+    if PARSER_PROCESSES <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked, since the bot process runs threads
+            _pool = ProcessPoolExecutor(max_workers=PARSER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_parser_pool() -> None:
+    """
+    Stops the parser processes.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def extract_pdf_pages(file_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """
+    Extracts the text of a range of pages of a .pdf file. Runs in the parser processes.
+
+    Args:
+        file_path (str): The path to the .pdf file.
+        start (int): The index of the first page, starting at 0.
+        stop (int): The index after the last page.
+
+    Returns:
+        List[Tuple[int, str]]: The page numbers, starting at 1, and texts of the pages that have text.
+    """
+    reader = PdfReader(file_path)
+    pages = []
+    for page_index in range(start, stop):
+        text = reader.pages[page_index].extract_text()
+        if text:
+            pages.append((page_index + 1, text))
+    return pages
+
+
+def extract_docx_paragraphs(file_path: str) -> List[str]:
+    """
+    Extracts the paragraphs of a .docx file. Runs in the parser processes.
+
+    Args:
+        file_path (str): The path to the .docx file.
+
+    Returns:
+        List[str]: The texts of the paragraphs.
+    """
+    return [paragraph.text for paragraph in Document(file_path).paragraphs]
+
+
+def stream_pdf_pages(file_path: str, pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[Tuple[int, str]]:
+    """
+    Extracts the pages of a .pdf file in parallel in the parser processes, and yields them in order as
+    soon as they are extracted, so chunking and embedding start before the whole file is parsed.
+
+    Args:
+        file_path (str): The path to the .pdf file.
+        pages_per_task (int): The number of pages extracted by each task.
+
+    Yields:
+        Tuple[int, str]: The page number, starting at 1, and text of every page that has text.
+    """
+    page_count = len(PdfReader(file_path).pages)
+    pool = get_parser_pool()
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    if pool is None:
+        for start, stop in ranges:
+            yield from extract_pdf_pages(file_path, start, stop)
+        return
+
+    # At most two tasks per process are queued, so a slow consumer doesn't hold the whole text in memory
+    pending: Deque[Future] = deque()
+    next_range = 0
+    try:
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < PARSER_PROCESSES * 2:
+                pending.append(pool.submit(extract_pdf_pages, file_path, *ranges[next_range]))
+                next_range += 1
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def read_docx_paragraphs(file_path: str) -> List[str]:
+    """
+    Reads the paragraphs of a .docx file in a parser process, so the XML parsing doesn't hold the GIL
+    of the bot process.
+
+    Args:
+        file_path (str): The path to the .docx file.
+
+    Returns:
+        List[str]: The texts of the paragraphs.
+    """
+    pool = get_parser_pool()
+    if pool is None:
+        return extract_docx_paragraphs(file_path)
+    return pool.submit(extract_docx_paragraphs, file_path).result()
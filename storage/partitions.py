@@ -0,0 +1,175 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import List
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+TABLE = Message.__tablename__
+
+# Same columns as the Message model. The primary key of a partitioned table must include the
+# partition key, so it is (id, timestamp) in the database while the model still maps it by id.
+PARTITIONED_TABLE_DDL = f"""
+CREATE TABLE {TABLE} (
+    id INTEGER NOT NULL DEFAULT nextval('{TABLE}_id_seq'),
+    user_id BIGINT,
+    group_id BIGINT,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+    content TEXT,
+    is_bot BOOLEAN,
+    is_group BOOLEAN,
+    file_name VARCHAR,
+    file_type VARCHAR,
+    token_count INTEGER,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp)
+"""
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def previous_month(day: date) -> date:
+    return month_start(month_start(day) - timedelta(days=1))
+
+
+def months_between(start: date, end: date) -> List[date]:
+    """
+    Returns the first days of the months from the month of `start` to the month of `end`, included.
+
+    Args:
+        start (date): A day of the first month.
+        end (date): A day of the last month.
+
+    Returns:
+        List[date]: The first day of every month.
+    """
+    months = []
+    month = month_start(start)
+    while month <= end:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_{month.year:04d}_{month.month:02d}"
+
+
+def supports_partitioning(engine: Engine) -> bool:
+    """
+    Checks whether the database has native range partitioning. Other databases, like the SQLite
+    databases used locally, keep a single table and apply the retention policy with range deletes.
+
+    Args:
+        engine (Engine): The database engine.
+
+    Returns:
+        bool: True for PostgreSQL.
+    """
+    return engine.dialect.name == 'postgresql'
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return connection.execute(text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                                   "WHERE partrelid = to_regclass(:table))"), {"table": TABLE}).scalar()
+
+
+def create_partition(connection: Connection, month: date) -> None:
+    """
+    Creates the partition holding the messages of a month, if it doesn't exist.
+
+    Args:
+        connection (Connection): A PostgreSQL connection.
+        month (date): The first day of the month.
+    """
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {TABLE} "
+                            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"))
+
+
+def create_partitioned_table(engine: Engine) -> None:
+    """
+    Creates chat_history as a table partitioned by month of the message timestamp, converting the
+    existing unpartitioned table if there is one. Runs in one transaction, so a failed conversion
+    leaves the old table as it was. Does nothing on databases without native partitioning.
+
+    Args:
+        engine (Engine): The database engine.
+    """
+    if not supports_partitioning(engine):
+        return
+    with engine.begin() as connection:
+        exists = inspect(connection).has_table(TABLE)
+        if exists and is_partitioned(connection):
+            return
+
+        connection.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {TABLE}_id_seq"))
+        if exists:
+            logger.info(f"Converting {TABLE} to a partitioned table...")
+            connection.execute(text(f"ALTER TABLE {TABLE} RENAME TO {TABLE}_unpartitioned"))
+            # Frees the primary key name for the new table
+            primary_key = connection.execute(text("SELECT conname FROM pg_constraint WHERE contype = 'p' AND "
+                                                  "conrelid = to_regclass(:table)"),
+                                             {"table": f"{TABLE}_unpartitioned"}).scalar()
+            if primary_key is not None:
+                connection.execute(text(f'ALTER TABLE {TABLE}_unpartitioned RENAME CONSTRAINT "{primary_key}" '
+                                        f'TO {TABLE}_unpartitioned_pkey'))
+            # Keeps the sequence when the old table is dropped
+            connection.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY NONE"))
+        connection.execute(text(PARTITIONED_TABLE_DDL))
+        connection.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id"))
+        # Catches messages outside of the monthly partitions, like clock skewed timestamps
+        connection.execute(text(f"CREATE TABLE IF NOT EXISTS {TABLE}_default PARTITION OF {TABLE} DEFAULT"))
+
+        if exists:
+            first, last = connection.execute(text(f"SELECT min(timestamp), max(timestamp) "
+                                                  f"FROM {TABLE}_unpartitioned")).one()
+            if first is not None:
+                for month in months_between(first.date(), last.date()):
+                    create_partition(connection, month)
+            columns = "id, user_id, group_id, timestamp, content, is_bot, is_group, file_name, file_type, token_count"
+            connection.execute(text(f"INSERT INTO {TABLE} ({columns}) SELECT {columns} FROM {TABLE}_unpartitioned"))
+            connection.execute(text(f"DROP TABLE {TABLE}_unpartitioned"))
+
+
+def ensure_partitions(engine: Engine, months_ahead: int = 1) -> None:
+    """
+    Creates the partitions of the current month and the next ones, so inserts never wait for DDL.
+
+    Args:
+        engine (Engine): The database engine.
+        months_ahead (int): The number of future months to create partitions for.
+    """
+    if not supports_partitioning(engine):
+        return
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return
+        month = month_start(datetime.utcnow().date())
+        for _ in range(months_ahead + 1):
+            create_partition(connection, month)
+            month = next_month(month)
+
+
+def drop_partition(connection: Connection, month: date) -> bool:
+    """
+    Drops the partition of a month, if the table is partitioned and the partition exists.
+
+    Args:
+        connection (Connection): A database connection.
+        month (date): The first day of the month.
+
+    Returns:
+        bool: True if a partition was dropped.
+    """
+    if connection.dialect.name != 'postgresql' or not inspect(connection).has_table(partition_name(month)):
+        return False
+    connection.execute(text(f"DROP TABLE {partition_name(month)}"))
+    return True
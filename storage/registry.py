@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar, Union
+from langchain_openai import ChatOpenAI
+from langchain_pinecone import PineconeVectorStore
+from pinecone.data.index import Index
+from config import INDEX_POOL_THREADS, INGEST_MANIFEST_PATH, LEXICAL_INDEX_PATH
+from model.chat_model import get_chat_model
+from model.cache import AnswerCache
+from model.embeddings import EmbeddingService, get_embedding_service
+from model.summarizer import Summarizer, get_summarizer
+from storage.database import get_configured_index, get_vectorstore
+from storage.lexical import BM25Index
+from storage.local_index import LocalIndex
+from storage.manifest import IngestionManifest
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ClientRegistry:
+    """
+    Process-wide holder of the clients used to answer queries and update the knowledge base.
+
+    Clients are created lazily on first access and then shared by every handler, so the
+    Pinecone index lookup and the client construction are paid once per process instead
+    of once per message.
+    """
+
+    def __init__(self, pool_threads: int = INDEX_POOL_THREADS):
+        self._pool_threads = pool_threads
+        self._lock = threading.RLock()
+        self._index: Optional[Union[Index, LocalIndex]] = None
+        self._vectorstore: Optional[PineconeVectorStore] = None
+        self._embeddings: Optional[EmbeddingService] = None
+        self._chat: Optional[ChatOpenAI] = None
+        self._summarizer: Optional[Summarizer] = None
+        self._lexical_index: Optional[BM25Index] = None
+        self._manifest: Optional[IngestionManifest] = None
+        # Answers are only valid for the current knowledge base, so updates must clear this cache
+        self.answer_cache = AnswerCache()
+
+    @property
+    def index(self) -> Union[Index, LocalIndex]:
+        with self._lock:
+            if self._index is None:
+                logger.info("Connecting to the vector index...")
+                self._index = get_configured_index(pool_threads=self._pool_threads)
+            return self._index
+
+    @property
+    def embeddings(self) -> EmbeddingService:
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = get_embedding_service()
+            return self._embeddings
+
+    @property
+    def vectorstore(self) -> PineconeVectorStore:
+        with self._lock:
+            if self._vectorstore is None:
+                self._vectorstore = get_vectorstore(self.index, self.embeddings)
+            return self._vectorstore
+
+    @property
+    def chat(self) -> ChatOpenAI:
+        with self._lock:
+            if self._chat is None:
+                self._chat = get_chat_model()
+            return self._chat
+
+    @property
+    def lexical_index(self) -> BM25Index:
+        with self._lock:
+            if self._lexical_index is None:
+                self._lexical_index = BM25Index(LEXICAL_INDEX_PATH)
+            return self._lexical_index
+
+    @property
+    def manifest(self) -> IngestionManifest:
+        with self._lock:
+            if self._manifest is None:
+                self._manifest = IngestionManifest(INGEST_MANIFEST_PATH)
+            return self._manifest
+
+    @property
+    def summarizer(self) -> Summarizer:
+        with self._lock:
+            if self._summarizer is None:
+                self._summarizer = get_summarizer(self.chat)
+            return self._summarizer
+
+    def warm_up(self) -> None:
+        """
+        Eagerly creates every client so the first user message doesn't pay the setup cost.
+        """
+        _ = self.vectorstore
+        _ = self.chat
+        _ = self.lexical_index
+
+    def is_healthy(self) -> bool:
+        """
+        Checks that the index connection is alive.
+
+        Returns:
+            bool: True if the index answered a stats request, False otherwise.
+        """
+        try:
+            self.index.describe_index_stats()
+            return True
+        except Exception as e:
+            logger.warning(f"Index health check failed: {e}")
+            return False
+
+    def reconnect(self) -> None:
+        """
+        Drops the index and vector store so they are recreated on next access.
+        """
+        with self._lock:
+            if isinstance(self._index, LocalIndex):
+                self._index.close()
+            self._index = None
+            self._vectorstore = None
+
+    def refresh_knowledge_base(self) -> bool:
+        """
+        Reads the changes made to the local indexes by the process ingesting the updates, like the first
+        worker in webhook mode, and clears the cached answers if there were any.
+
+        Returns:
+            bool: Whether the knowledge base changed.
+        """
+        with self._lock:
+            indexes = [index for index in (self._lexical_index, self._index)
+                       if isinstance(index, (BM25Index, LocalIndex))]
+        # Every index is refreshed, even once a change was found
+        changed = any([index.refresh() for index in indexes])
+        if changed:
+            self.answer_cache.clear()
+        return changed
+
+    def call(self, operation: Callable[["ClientRegistry"], T]) -> T:
+        """
+        Runs an operation against the registry, reconnecting and retrying once if it fails
+        and the index turns out to be unhealthy.
+
+        Args:
+            operation (Callable): A function that receives the registry and returns a result.
+
+        Returns:
+            The result of the operation.
+        """
+        try:
+            return operation(self)
+        except Exception:
+            if self.is_healthy():
+                raise
+            logger.warning("Reconnecting to the vector index and retrying...")
+            self.reconnect()
+            return operation(self)
+
+    async def acall(self, operation: Callable[["ClientRegistry"], Awaitable[T]]) -> T:
+        """
+        Async version of `call`. The clients and the health check are created in a worker
+        thread so the event loop isn't blocked while connecting.
+
+        Args:
+            operation (Callable): A coroutine function that receives the registry.
+
+        Returns:
+            The result of the operation.
+        """
+        try:
+            await asyncio.to_thread(self.warm_up)
+            return await operation(self)
+        except Exception:
+            if await asyncio.to_thread(self.is_healthy):
+                raise
+            logger.warning("Reconnecting to the vector index and retrying...")
+            self.reconnect()
+            await asyncio.to_thread(self.warm_up)
+            return await operation(self)
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def init_registry() -> ClientRegistry:
+    """
+    Creates the process-wide client registry. Called once when the bot is set up.
+
+    Returns:
+        ClientRegistry: The new registry.
+    """
+    global _registry
+    with _registry_lock:
+        _registry = ClientRegistry()
+        return _registry
+
+
+def get_registry() -> ClientRegistry:
+    """
+    Returns the process-wide client registry, creating it if it was not initialized yet.
+
+    Returns:
+        ClientRegistry: The shared registry.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
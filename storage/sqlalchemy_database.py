@@ -1,19 +1,83 @@
 # storage/sqlalchemy_database.py
 
-from typing import List
-from sqlalchemy.orm import Session
-from .models import Message, SessionLocal
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, Optional, Tuple, TypeVar
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Query, Session
+from .message_log import get_message_log, message_key, pending_messages
+from .usage import add_daily_usage
+from .models import AsyncSessionLocal, ConversationSummary, Message, SessionLocal
 from datetime import datetime
+from config import HISTORY_BATCH_SIZE, MAX_TOKENS, SUMMARY_BATCH_MESSAGES, SUMMARY_KEEP_MESSAGES, WRITE_BEHIND_MESSAGES
+from model.utils import count_tokens
 # from .models import Base
 # from config import DATABASE_URL
 # from sqlalchemy import create_engine, inspect, text
 
-def get_db():
-    db: Session = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+T = TypeVar("T")
+
+
+@asynccontextmanager
+async def db_session() -> AsyncIterator[AsyncSession]:
+    """
+    Opens an async session for one unit of work. Its connection goes back to the pool when the block
+    exits, and the transaction is rolled back if the block raises.
+
+    Yields:
+        AsyncSession: The session.
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+
+
+async def run_with_db(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a database function with its own async session. The function uses the regular session API,
+    and its queries are awaited on the async engine, so the event loop is never blocked by a query or
+    a commit.
+
+    The session only lives for the function call, so no connection is held while a handler waits for
+    Telegram or the chat model.
+
+    Args:
+        func (Callable): A function taking a session as its first argument.
+        *args: Positional arguments passed to the function after the session.
+        **kwargs: Keyword arguments passed to the function.
+
+    Returns:
+        The result of the function.
+    """
+    async with db_session() as session:
+        return await session.run_sync(lambda db: func(db, *args, **kwargs))
+
+
+async def run_in_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a database function with its own sync session in a worker thread. Used for the functions
+    loading many rows: with `run_with_db` the queries are awaited, but the rows are still turned into
+    objects on the event loop, which blocks the other updates meanwhile.
+
+    Args:
+        func (Callable): A function taking a session as its first argument.
+        *args: Positional arguments passed to the function after the session.
+        **kwargs: Keyword arguments passed to the function.
+
+    Returns:
+        The result of the function.
+    """
+    def call() -> T:
+        with SessionLocal() as db:
+            return func(db, *args, **kwargs)
+
+    return await asyncio.to_thread(call)
 
 # def drop_and_recreate_table():
 #     # Create engine and session
@@ -45,22 +109,212 @@ def save_message(db: Session, user_id: int, group_id: int, is_bot: bool, content
         is_bot=is_bot,
         timestamp=current_time,
         file_name=file_name,
-        file_type=file_type
+        file_type=file_type,
+        token_count=count_tokens(content)
     )
     db.add(db_message)
+    add_daily_usage(db, [{'user_id': user_id, 'timestamp': current_time, 'file_name': file_name}])
     db.commit()
     db.refresh(db_message)
-
-    print(f"Saved message: user_id={db_message.user_id}, group_id={db_message.group_id}, "
-          f"timestamp={db_message.timestamp}, is_group={db_message.is_group}, "
-          f"content='{content}', file_name='{file_name}', file_type='{file_type}'")
     return db_message
 
 
-def get_chat_history(db: Session, user_id: int = None, group_id: int = None) -> List[Message]:
+async def record_message(user_id: int, group_id: int, is_bot: bool, content: str, is_group: bool,
+                         file_name: str = None, file_type: str = None) -> None:
+    """
+    Saves a chat message. With write-behind enabled, the message is buffered and saved in bulk in the
+    background, so the handler doesn't wait for the database.
+
+    Args:
+        user_id (int): The ID of the user.
+        group_id (int): The ID of the group, if any.
+        is_bot (bool): Whether the message was sent by the bot.
+        content (str): The content of the message.
+        is_group (bool): Whether the message was sent in a group.
+        file_name (str): The name of the uploaded file, if any.
+        file_type (str): The type of the uploaded file, if any.
+    """
+    if WRITE_BEHIND_MESSAGES:
+        get_message_log().append(user_id, group_id, is_bot, content, is_group, file_name, file_type)
+    else:
+        await run_with_db(save_message, user_id, group_id, is_bot, content, is_group, file_name, file_type)
+
+
+def message_tokens(message: Message) -> int:
+    """
+    Returns the number of tokens of a stored message, counting them for rows saved before token counts were stored.
+
+    Args:
+        message (Message): The stored message.
+
+    Returns:
+        int: The number of tokens in the message content.
+    """
+    if message.token_count is None:
+        return count_tokens(message.content or "")
+    return message.token_count
+
+
+def filter_conversation(query: Query, user_id: int = None, group_id: int = None) -> Query:
+    """
+    Filters a chat history query to the messages of a conversation: the group if a group ID is given,
+    the user otherwise.
+
+    Args:
+        query (Query): The chat history query.
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+
+    Returns:
+        Query: The filtered query.
+    """
     if group_id:
-        return db.query(Message).filter(Message.group_id == group_id).order_by(Message.timestamp).all()
+        return query.filter(Message.group_id == group_id)
     elif user_id:
-        return db.query(Message).filter(Message.user_id == user_id).order_by(Message.timestamp).all()
-    else:
-        return db.query(Message).order_by(Message.timestamp).all()
+        return query.filter(Message.user_id == user_id)
+    return query
+
+
+def get_recent_chat_history(db: Session, user_id: int = None, group_id: int = None, token_budget: int = MAX_TOKENS,
+                            batch_size: int = HISTORY_BATCH_SIZE, after_id: int = None) -> List[Message]:
+    """
+    Returns the most recent chat history that fits in the given token budget.
+
+    Rows are read newest-first in batches, using the (group_id/user_id, timestamp) indexes, and reading
+    stops as soon as the budget is filled, so the cost doesn't depend on how old the conversation is.
+    Messages still buffered in the message log are included, as the newest ones.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+        token_budget (int): The maximum number of tokens of the returned messages.
+        batch_size (int): The number of rows fetched per query.
+        after_id (int): If given, only messages with a greater ID are returned.
+
+    Returns:
+        List[Message]: The most recent messages, oldest first.
+    """
+    # Read before the saved rows, so a message saved in between is found in one of them
+    pending = pending_messages(user_id, group_id)
+    pending_keys = {message_key(message) for message in pending}
+    query = filter_conversation(db.query(Message), user_id, group_id)
+    if after_id is not None:
+        query = query.filter(Message.id > after_id)
+    query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+
+    history: List[Message] = []
+    used_tokens = 0
+    for message in reversed(pending):
+        used_tokens += message_tokens(message)
+        if used_tokens > token_budget:
+            history.reverse()
+            return history
+        history.append(message)
+
+    last = None
+    while True:
+        batch_query = query
+        if last is not None:
+            # Keyset pagination: continue right after the oldest row seen so far
+            batch_query = batch_query.filter(or_(Message.timestamp < last.timestamp,
+                                                 and_(Message.timestamp == last.timestamp, Message.id < last.id)))
+        batch = batch_query.limit(batch_size).all()
+
+        for message in batch:
+            if message_key(message) in pending_keys:
+                continue
+            used_tokens += message_tokens(message)
+            if used_tokens > token_budget:
+                history.reverse()
+                return history
+            history.append(message)
+
+        if len(batch) < batch_size:
+            history.reverse()
+            return history
+        last = batch[-1]
+
+
+def conversation_key(user_id: int = None, group_id: int = None) -> Tuple[int, bool]:
+    """
+    Returns the key of a conversation: the group if a group ID is given, the user otherwise.
+
+    Args:
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+
+    Returns:
+        Tuple[int, bool]: The conversation ID and whether it is a group.
+    """
+    return (group_id, True) if group_id else (user_id, False)
+
+
+def get_conversation_summary(db: Session, user_id: int = None, group_id: int = None) -> Optional[ConversationSummary]:
+    """
+    Returns the running summary of a conversation, if there is one.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+
+    Returns:
+        Optional[ConversationSummary]: The conversation summary.
+    """
+    conversation_id, is_group = conversation_key(user_id, group_id)
+    return db.query(ConversationSummary).filter(ConversationSummary.conversation_id == conversation_id,
+                                                ConversationSummary.is_group == is_group).first()
+
+
+def get_messages_to_summarize(db: Session, user_id: int = None, group_id: int = None, after_id: int = 0,
+                              keep: int = SUMMARY_KEEP_MESSAGES, limit: int = SUMMARY_BATCH_MESSAGES) -> List[Message]:
+    """
+    Returns the oldest messages of a conversation that are not summarized yet, leaving out the newest ones
+    that are always sent as they are.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+        after_id (int): The ID of the newest message already in the summary.
+        keep (int): The number of newest messages that are never summarized.
+        limit (int): The maximum number of messages returned.
+
+    Returns:
+        List[Message]: The messages to fold into the summary, oldest first.
+    """
+    messages = filter_conversation(db.query(Message), user_id, group_id).filter(
+        Message.id > after_id).order_by(Message.id).limit(limit + keep).all()
+    return messages[:max(len(messages) - keep, 0)]
+
+
+def save_conversation_summary(db: Session, user_id: int, group_id: int, summary: str, last_message_id: int,
+                              covered_tokens: int) -> ConversationSummary:
+    """
+    Creates or updates the running summary of a conversation in a single upsert, so concurrent updates
+    never create a second summary. A summary covering fewer messages than the saved one is dropped.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user, used when no group ID is given.
+        group_id (int): The ID of the group.
+        summary (str): The new summary.
+        last_message_id (int): The ID of the newest message folded into the summary.
+        covered_tokens (int): The total tokens of the messages folded into the summary.
+
+    Returns:
+        ConversationSummary: The saved summary.
+    """
+    conversation_id, is_group = conversation_key(user_id, group_id)
+    insert = postgresql_insert if db.get_bind().dialect.name == 'postgresql' else sqlite_insert
+    statement = insert(ConversationSummary).values(
+        conversation_id=conversation_id, is_group=is_group, summary=summary, token_count=count_tokens(summary),
+        last_message_id=last_message_id, covered_tokens=covered_tokens, updated_at=datetime.utcnow())
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[ConversationSummary.conversation_id, ConversationSummary.is_group],
+        set_={column: statement.excluded[column]
+              for column in ('summary', 'token_count', 'last_message_id', 'covered_tokens', 'updated_at')},
+        where=ConversationSummary.last_message_id <= statement.excluded.last_message_id))
+    db.commit()
+    return get_conversation_summary(db, user_id, group_id)
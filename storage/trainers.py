@@ -1,46 +1,168 @@
-import time
-from typing import List
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Union
 import pandas as pd
-from tqdm import tqdm
-from model.embeddings import get_embeddings_model
 from pinecone.data.index import Index
+from config import INGEST_BATCH_SIZE
+from storage.chunking import Section, chunk_sections
+from storage.ingestion import Chunk, IngestionStats, ingest_chunks, remove_vectors
+from storage.registry import get_registry
 
-# Initialize the embeddings model
-embeddings_model = get_embeddings_model()
+logger = logging.getLogger(__name__)
 
+# Updates of the same source are serialized, so they don't delete each other's vectors
+_source_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+_source_locks_lock = threading.Lock()
 
-def train_tabular_data(data: pd.DataFrame, index: Index, batch_size: int =200) -> None:
+
+def train_tabular_data(data: Union[pd.DataFrame, Iterable[pd.DataFrame]], index: Index, batch_size: int =200,
+                       source: str = None, on_batch: Callable[[int], None] = None) -> None:
     """
     Trains the vector store with tabular data by embedding and uploading the data in batches.
 
     Args:
-        data (pd.DataFrame): The tabular data containing questions and answers.
+        data (pd.DataFrame): The tabular data containing questions and answers, or an iterable of batches of rows.
         index: The Pinecone index to update.
         batch_size (int): The size of the data batches to process.
+        source (str): The name of the file the data comes from. Its previous version is replaced.
+        on_batch (Callable[[int], None]): Called with the number of chunks processed so far after every batch.
+    """
+    frames = [data] if isinstance(data, pd.DataFrame) else data
+    chunks = (chunk for frame in frames for chunk in tabular_chunks(frame, source))
+    ingest_source(chunks, index, source, batch_size=batch_size, on_batch=on_batch)
+
+
+def tabular_chunks(frame: pd.DataFrame, source: str = None) -> Iterator[Chunk]:
+    """
+    Turns rows of questions and answers into chunks. The questions are embedded, the answers are the
+    retrieved context, and both are searchable by keywords.
+
+    Args:
+        frame (pd.DataFrame): Rows with the question in the first column and the answer in the second.
+        source (str): The name of the file the rows come from.
+
+    Yields:
+        Chunk: One chunk per row with a question. Empty answers are kept as empty strings.
     """
-    for i in tqdm(range(0, len(data), batch_size)):
-        i_end = min(len(data), i + batch_size)
-        batch = data.iloc[i:i_end]
-        # Generate unique IDs using timestamp and the index within the batch
-        ids = [f"vector-{int(time.time() * 1000)}-{idx}" for idx in batch.index]
-        texts = batch.iloc[:, 0].values  # questions
-        # Embedding the questions
-        embeds = embeddings_model.embed_documents(texts)
+    # The columns are converted at once rather than row by row. Empty cells are NaN or None, which
+    # `astype(str)` would turn into the text "nan" or "None"
+    questions = frame.iloc[:, 0].fillna("").astype(str).str.strip()
+    answers = frame.iloc[:, 1].fillna("").astype(str).str.strip()
+    has_question = questions != ""
+    questions, answers = questions[has_question], answers[has_question]
+    search_texts = (questions + " " + answers).str.strip()
+    source_metadata = {'source': source} if source else {}
+    for question, answer, search_text in zip(questions.tolist(), answers.tolist(), search_texts.tolist()):
+        yield Chunk(text=question, metadata={'question': question, 'answer': answer, 'text': answer, **source_metadata},
+                    search_text=search_text)
 
-        metadata = [{'question': x.iloc[0], 'answer': x.iloc[1],
-                     'text': x.iloc[1]} for _, x in batch.iterrows()]
-        index.upsert(vectors=zip(ids, embeds, metadata))
 
-def train_textual_data(text_list: List[str], index: Index) -> None:
+def train_textual_data(text_list: List[str], index: Index, source: str = None,
+                       on_batch: Callable[[int], None] = None) -> None:
     """
-    Trains the vector store with textual data by embedding and uploading the data.
+    Trains the vector store with textual data by embedding and uploading the data in batches.
 
     Args:
         text (str): The text data to embed and upload.
         index: The Pinecone index to update.
+        source (str): The name of the document the text comes from. Its previous version is replaced.
+        on_batch (Callable[[int], None]): Called with the number of chunks processed so far after every batch.
+    """
+    train_document(((text, {}) for text in text_list), index, source, on_batch)
+
+
+def text_source(text: str) -> str:
+    """
+    Returns the name of the document of a text, like the one of an /upd command: a hash of the text,
+    so the same text sent twice is only ingested once.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The name of the document.
+    """
+    return f"upd-{hashlib.sha256(text.strip().encode('utf-8')).hexdigest()[:16]}"
+
+
+def train_text(text: str, index: Index, source: str = None) -> None:
+    """
+    Trains the vector store with a single text, like the one of an /upd command, as one document.
+
+    Args:
+        text (str): The text to embed and upload.
+        index: The Pinecone index to update.
+        source (str): The name of the document. Defaults to a hash of the text, so the same text sent
+            twice is only ingested once.
+    """
+    source = source or text_source(text)
+    train_document([(text, {})], index, source)
+
+
+def train_document(sections: Iterable[Section], index: Index, source: str = None,
+                   on_batch: Callable[[int], None] = None) -> None:
+    """
+    Trains the vector store with a document, split into token-bounded overlapping chunks.
+
+    Args:
+        sections (Iterable[Section]): The (text, metadata) sections of the document, like paragraphs or pages.
+        index: The Pinecone index to update.
+        source (str): The name of the document. Its previous version is replaced.
+        on_batch (Callable[[int], None]): Called with the number of chunks processed so far after every batch.
+    """
+    ingest_source(chunk_sections(sections, source), index, source, on_batch=on_batch)
+
+
+def ingest_source(chunks: Iterable[Chunk], index: Index, source: str = None, batch_size: int = INGEST_BATCH_SIZE,
+                  on_batch: Callable[[int], None] = None) -> IngestionStats:
+    """
+    Ingests a new version of a source document. The chunks of the new version are upserted first,
+    tagged with the version number, and only then the chunks of the previous versions that are not in
+    the new one are deleted, so the source is answerable during the whole update, and a failed update
+    leaves the previous version in place.
+
+    Args:
+        chunks (Iterable[Chunk]): The chunks of the document.
+        index: The Pinecone index to update.
+        source (str): The name of the document. Without one, the chunks are only added.
+        batch_size (int): The maximum number of chunks per embedding request.
+        on_batch (Callable[[int], None]): Called with the number of chunks processed so far after every batch.
+
+    Returns:
+        IngestionStats: The ingestion stats of the new version.
+    """
+    registry = get_registry()
+    if source is None:
+        return ingest_chunks(chunks, index, registry.embeddings, registry.lexical_index, registry.manifest,
+                             batch_size=batch_size, on_batch=on_batch)
+
+    with _source_locks_lock:
+        source_lock = _source_locks[source]
+    with source_lock:
+        version = registry.manifest.version(source) + 1
+        stats = ingest_chunks(tag_version(chunks, version), index, registry.embeddings, registry.lexical_index,
+                              registry.manifest, batch_size=batch_size, on_batch=on_batch)
+        stale = set(registry.manifest.ids_for_source(source)) - stats.ids
+        removed = remove_vectors(stale, index, registry.lexical_index, registry.manifest)
+        registry.manifest.set_version(source, version)
+    logger.info(f"Updated {source} to version {version}: {len(stats.ids)} chunks, {removed} stale chunks removed")
+    return stats
+
+
+def tag_version(chunks: Iterable[Chunk], version: int) -> Iterator[Chunk]:
+    """
+    Adds the version of the document to the metadata of its chunks. Chunks that are unchanged since
+    an earlier version are not upserted again, so they keep the version they were added in.
+
+    Args:
+        chunks (Iterable[Chunk]): The chunks of the document.
+        version (int): The version of the document.
+
+    Yields:
+        Chunk: The tagged chunks.
     """
-    for text in tqdm(text_list, desc="Embedding textual data"):
-        vector_id = f"vector-{int(time.time() * 1000)}"
-        embeds = embeddings_model.embed_documents([text])
-        metadata = [{'text': text}]
-        index.upsert(vectors=zip([vector_id], embeds, metadata))
+    for chunk in chunks:
+        chunk.metadata['version'] = version
+        yield chunk
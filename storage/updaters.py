@@ -1,32 +1,57 @@
-import csv
-import pandas as pd
-from storage.trainers import train_tabular_data, train_textual_data
-from storage.utils import read_docx, read_pdf
-from storage.database import get_index
+import asyncio
+import os
+from typing import Callable
+from storage.trainers import train_document, train_tabular_data, train_text, train_textual_data
+from storage.parsing import read_docx_paragraphs, stream_pdf_pages
+from storage.utils import read_tabular_batches
+from storage.registry import get_registry
 from pinecone.data.index import Index
 
 
-async def update_knowledge_base(file_path: str) -> None:
+async def update_knowledge_base(file_path: str, source: str = None, on_batch: Callable[[int], None] = None) -> None:
     """
-    Updates the knowledge base with data from the specified file.
+    Updates the knowledge base with data from the specified file, replacing the previous version of the file.
 
     Args:
         file_path (str): The path to the file containing the data.
+        source (str): The name identifying the document across versions, defaults to the file name.
+        on_batch (Callable[[int], None]): Called with the number of chunks processed so far after every batch.
     """
-    index: Index = get_index()
+    registry = get_registry()
+    # Parsing, embedding and upserting are blocking, so they run in a worker thread
+    await registry.acall(lambda clients: asyncio.to_thread(train_from_file, file_path, clients.index,
+                                                           source, on_batch))
+    # Cached answers may be outdated by the new data
+    registry.answer_cache.clear()
+
+
+def train_from_file(file_path: str, index: Index, source: str = None, on_batch: Callable[[int], None] = None) -> None:
+    """
+    Reads the specified file and trains the vector store with its data.
+
+    Args:
+        file_path (str): The path to the file containing the data.
+        index: The Pinecone index to update.
+        source (str): The name identifying the document across versions, defaults to the file name.
+        on_batch (Callable[[int], None]): Called with the number of chunks processed so far after every batch.
+    """
+    source = source or os.path.basename(file_path)
     # Process the file and update the dataset
     if file_path.endswith('.xlsx') or file_path.endswith('.csv'):
-        new_data = pd.read_excel(file_path) if file_path.endswith('xlsx') else pd.read_csv(file_path, sep=',',
-                                                                                           quoting=csv.QUOTE_ALL,
-                                                                                           quotechar='"')
-        new_data.iloc[:, 1] = new_data.iloc[:, 1].astype(str)
-        train_tabular_data(new_data, index)
+        # Streamed in batches of rows, so large exports don't have to fit in memory
+        train_tabular_data(read_tabular_batches(file_path), index, source=source, on_batch=on_batch)
     elif file_path.endswith('.docx'):
-        texts = read_docx(file_path)
-        train_textual_data(texts, index)
+        texts = read_docx_paragraphs(file_path)
+        train_textual_data(texts, index, source=source, on_batch=on_batch)
     elif file_path.endswith('.pdf'):
-        texts = read_pdf(file_path)
-        train_textual_data(texts, index)
+        # Pages are extracted in parallel processes and chunked as they come
+        pages = stream_pdf_pages(file_path)
+        train_document(((text, {'page': page}) for page, text in pages), index, source=source,
+                       on_batch=on_batch)
+    elif file_path.endswith('.txt'):
+        # The text of an /upd command, a single short document
+        with open(file_path, encoding="utf-8") as text_file:
+            train_text(text_file.read(), index, source=source)
     else:
         print("Неизвестный формат файла")
         return
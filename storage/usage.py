@@ -0,0 +1,57 @@
+from collections import Counter
+from datetime import date
+from typing import Any, Dict, Iterable, List
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from .models import DailyUsage
+
+
+def add_daily_usage(db: Session, rows: Iterable[Dict[str, Any]]) -> None:
+    """
+    Adds saved messages to the daily usage rollup, in the transaction that saves them.
+
+    Args:
+        db (Session): The database session.
+        rows (Iterable[dict]): The saved messages, with their user_id, timestamp and file_name.
+    """
+    requests: Counter = Counter()
+    files: Counter = Counter()
+    for row in rows:
+        key = (row['timestamp'].date(), row['user_id'])
+        requests[key] += 1
+        files[key] += row.get('file_name') is not None
+    if not requests:
+        return
+
+    insert = postgresql_insert if db.get_bind().dialect.name == 'postgresql' else sqlite_insert
+    statement = insert(DailyUsage).values([
+        {'date': day, 'user_id': user_id, 'request_count': count, 'file_count': files[(day, user_id)]}
+        for (day, user_id), count in requests.items()
+    ])
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[DailyUsage.date, DailyUsage.user_id],
+        set_={'request_count': DailyUsage.request_count + statement.excluded.request_count,
+              'file_count': DailyUsage.file_count + statement.excluded.file_count}))
+
+
+def get_usage(db: Session, start: date, end: date) -> List[Dict[str, int]]:
+    """
+    Returns the usage of every user over a range of days, read from the daily rollup.
+
+    Args:
+        db (Session): The database session.
+        start (date): The first day.
+        end (date): The last day, included.
+
+    Returns:
+        List[dict]: The user_id, request_count and file_count of every user active in the range.
+    """
+    usage = db.query(
+        DailyUsage.user_id,
+        func.sum(DailyUsage.request_count).label('request_count'),
+        func.sum(DailyUsage.file_count).label('file_count')
+    ).filter(DailyUsage.date.between(start, end)).group_by(DailyUsage.user_id).order_by(DailyUsage.user_id).all()
+    return [{"user_id": row.user_id, "request_count": int(row.request_count), "file_count": int(row.file_count)}
+            for row in usage]
@@ -1,24 +1,28 @@
-from typing import List
-from pypdf import PdfReader
+from typing import Iterator, Optional
+import csv
 import os
-from docx import Document
-from config import UPLOAD_FOLDER
+import uuid
+import pandas as pd
+from openpyxl import load_workbook
+from config import UPLOAD_FOLDER, TABULAR_BATCH_ROWS
 from datetime import datetime
 
-def save_update_text(username: str, text: str) -> bool:
+def save_update_text(username: str, text: str) -> Optional[str]:
     try:
         timestamp = datetime.now().strftime("%d-%m-%Y_%H%M%S")
 
         if not os.path.exists(UPLOAD_FOLDER):
             os.makedirs(UPLOAD_FOLDER)
 
-        filename = f"{UPLOAD_FOLDER}/{username}_at_{timestamp}"
-        with open(f"{filename}", "w") as text_file:
+        # Unique, since the file is only ingested later and several texts can be sent in the same second,
+        # like in groups, which have no username
+        filename = f"{UPLOAD_FOLDER}/{username}_at_{timestamp}_{uuid.uuid4().hex[:8]}.txt"
+        with open(f"{filename}", "x", encoding="utf-8") as text_file:
             text_file.write(text)
-            return True
+            return filename
     except Exception as e:
         print(f"Error occured while saving text file from /upd command: {e}")
-        return False
+        return None
 
 def get_received_file_path(filename: str) -> str:
     file_path = os.path.join(UPLOAD_FOLDER, filename)
@@ -45,37 +49,72 @@ def change_duplicate_filename(file_path: str) -> str:
     return file_path
 
 
-def read_docx(file_path: str) -> List[str]:
+def read_tabular_batches(file_path: str, batch_rows: int = TABULAR_BATCH_ROWS) -> Iterator[pd.DataFrame]:
     """
-    Reads the content of a .docx file.
+    Reads a .csv or .xlsx file in batches of rows, so the memory used doesn't depend on the file size.
+    The first row is the header.
 
     Args:
-        file_path (str): The path to the .docx file.
+        file_path (str): The path to the file.
+        batch_rows (int): The maximum number of rows per batch.
 
-    Returns:
-        str: The content of the .docx file.
+    Yields:
+        pd.DataFrame: The rows of the file, in batches.
     """
-    doc = Document(file_path)
-    full_text = []
-    for paragraph in doc.paragraphs:
-        full_text.append(paragraph.text)
-    return full_text
-
+    if file_path.endswith('.csv'):
+        yield from pd.read_csv(file_path, sep=',', quoting=csv.QUOTE_ALL, quotechar='"', chunksize=batch_rows)
+        return
 
-def read_pdf(file_path: str) -> List[str]:
+    # Read-only workbooks stream the rows of the sheet instead of loading the whole file
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(name) if name is not None else f"Unnamed: {position}" for position, name in enumerate(header)]
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def count_tabular_rows(file_path: str) -> int:
     """
-    Reads the content of a .pdf file.
+    Returns an estimate of the number of data rows of a .csv or .xlsx file, without the header, to
+    report the progress of its ingestion. It is an upper bound: rows without a question are counted
+    but skipped when ingesting, and so are the extra lines of multi-line values in a .csv file.
 
     Args:
-        file_path (str): The path to the .pdf file.
+        file_path (str): The path to the file.
 
     Returns:
-        str: The content of the .pdf file.
+        int: The estimated number of rows.
     """
-    reader = PdfReader(file_path)
-    full_text = []
-    for page in reader.pages:
-        text = page.extract_text()
-        if text:
-            full_text.append(text)
-    return full_text
+    if file_path.endswith('.xlsx'):
+        # The dimensions of the sheet are stored in the file, so the rows aren't read
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            return max((workbook.active.max_row or 1) - 1, 0)
+        finally:
+            workbook.close()
+
+    # Counts the line breaks rather than parsing the file, which is parsed when it is ingested
+    lines = 0
+    last = b"\n"
+    with open(file_path, "rb") as csv_file:
+        for block in iter(lambda: csv_file.read(1 << 20), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    # The last line may not end with a line break
+    if last != b"\n":
+        lines += 1
+    return max(lines - 1, 0)
@@ -0,0 +1,33 @@
+"""
+Tests of the bot. They run offline, with fake clients, for example:
+
+    python -m pytest tests
+
+Importing the package points the bot to a scratch directory before any bot module reads the config,
+so the tests never write to the configured database, caches or uploads.
+"""
+import os
+import tempfile
+
+WORK_DIR = tempfile.mkdtemp(prefix="bot-tests-")
+
+# Settings the config module requires, whose values don't matter offline
+for _name, _value in (("TELEGRAM_BOT_TOKEN", "123456:test"), ("OPENAI_API_KEY", "test"),
+                      ("PINECONE_API_KEY", "test"), ("INDEX_NAME", "test"), ("AUTHORIZED_USERNAMES", "admin")):
+    os.environ.setdefault(_name, _value)
+
+import config  # noqa: E402
+
+# Set on the module rather than in the environment, since config loads the .env file over the environment
+config.DATABASE_URL = f"sqlite:///{os.path.join(WORK_DIR, 'bot.db')}"
+config.ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{os.path.join(WORK_DIR, 'bot.db')}"
+config.VECTOR_BACKEND = "local"
+config.LOCAL_INDEX_PATH = os.path.join(WORK_DIR, "local_index")
+config.LEXICAL_INDEX_PATH = os.path.join(WORK_DIR, "lexical_index.jsonl")
+config.EMBEDDING_DISK_CACHE_PATH = ""
+config.INGEST_MANIFEST_PATH = os.path.join(WORK_DIR, "ingestion_manifest.sqlite3")
+config.INGEST_JOBS_PATH = os.path.join(WORK_DIR, "ingestion_jobs.sqlite3")
+config.MESSAGE_LOG_DEAD_LETTER_PATH = os.path.join(WORK_DIR, "message_log_dead_letters.jsonl")
+config.CHAT_ARCHIVE_PATH = os.path.join(WORK_DIR, "archive")
+config.UPLOAD_FOLDER = os.path.join(WORK_DIR, "uploaded_files")
+config.SUMMARIZER = "fake"
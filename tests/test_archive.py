@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from datetime import date, datetime
+from unittest import mock
+from storage import archive
+from storage.archive import archive_month, archive_path, read_archive
+from storage.models import Message, SessionLocal, create_tables, engine
+
+
+class ArchiveTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        create_tables()
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp(prefix="archive-")
+        self.user_id = int.from_bytes(os.urandom(4), "little")
+
+    def save(self, *timestamps: datetime) -> None:
+        with SessionLocal() as db:
+            db.add_all(Message(user_id=self.user_id, group_id=None, content=f"message at {timestamp:%d %H:%M}",
+                               is_bot=False, is_group=False, timestamp=timestamp) for timestamp in timestamps)
+            db.commit()
+
+    def archived_contents(self, **dates):
+        return [message.content for message in read_archive(self.user_id, archive_dir=self.archive_dir, **dates)]
+
+    def test_archiving_a_month_again_keeps_its_archived_messages(self):
+        self.save(datetime(2001, 1, 1, 10), datetime(2001, 1, 20, 10))
+        self.assertEqual(archive_month(engine, date(2001, 1, 1), self.archive_dir), 2)
+        # Saved after the month was archived, and older than one of its archived messages
+        self.save(datetime(2001, 1, 10, 10))
+        self.assertEqual(archive_month(engine, date(2001, 1, 1), self.archive_dir), 1)
+
+        self.assertEqual(self.archived_contents(),
+                         ["message at 01 10:00", "message at 10 10:00", "message at 20 10:00"])
+
+    def test_messages_archived_again_after_a_failure_are_kept_once(self):
+        self.save(datetime(2001, 2, 1, 10), datetime(2001, 2, 2, 10))
+        with mock.patch.object(archive, "drop_partition", side_effect=RuntimeError("connection lost")):
+            with self.assertRaises(RuntimeError):
+                archive_month(engine, date(2001, 2, 1), self.archive_dir)
+        self.assertTrue(os.path.exists(archive_path(date(2001, 2, 1), self.archive_dir)))
+
+        self.assertEqual(archive_month(engine, date(2001, 2, 1), self.archive_dir), 2)
+        self.assertEqual(self.archived_contents(), ["message at 01 10:00", "message at 02 10:00"])
+
+    def test_months_outside_the_dates_are_not_read(self):
+        self.save(datetime(2001, 3, 31, 23), datetime(2001, 4, 1, 1), datetime(2001, 5, 15, 10))
+        for month in (date(2001, 3, 1), date(2001, 4, 1), date(2001, 5, 1)):
+            archive_month(engine, month, self.archive_dir)
+
+        with mock.patch.object(archive, "read_records", wraps=archive.read_records) as read:
+            contents = self.archived_contents(start_date=date(2001, 4, 1), end_date=date(2001, 4, 30))
+        self.assertEqual(contents, ["message at 01 01:00"])
+        self.assertEqual([call.args[0] for call in read.call_args_list], [archive_path(date(2001, 4, 1), self.archive_dir)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from typing import List, Tuple
+from unittest import mock
+from handlers import message_handlers
+from handlers.message_handlers import update_command
+from storage.trainers import text_source
+
+
+class RecordingQueue:
+    """
+    Ingestion queue recording the submitted jobs instead of running them.
+    """
+
+    def __init__(self):
+        self.jobs: List[Tuple[str, str]] = []
+
+    async def submit(self, file_path: str, source: str, chat_id: int, message_id: int) -> None:
+        self.jobs.append((file_path, source))
+
+
+class GroupMessage:
+    """
+    Message of an admin tagging the bot in a group, which has no username.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.chat = SimpleNamespace(id=-100, type="group", username=None)
+        self.from_user = SimpleNamespace(id=1, username="admin")
+
+    async def reply_text(self, text: str):
+        return SimpleNamespace(chat_id=self.chat.id, message_id=2)
+
+
+class UpdateCommandTest(unittest.IsolatedAsyncioTestCase):
+    async def test_texts_sent_in_the_same_second_are_queued_from_their_own_files(self):
+        queue = RecordingQueue()
+        context = SimpleNamespace(bot=SimpleNamespace(username="bot"))
+        texts = ["Vacation is 20 days.", "Sick leave is 10 days."]
+        with mock.patch.object(message_handlers, "get_ingestion_queue", return_value=queue), \
+                mock.patch("storage.utils.datetime") as clock:
+            clock.now.return_value = datetime(2026, 10, 18, 12, 0, 0)
+            for text in texts:
+                await update_command(SimpleNamespace(message=GroupMessage(f"/upd@bot {text}")), context)
+
+        self.assertEqual([source for _, source in queue.jobs], [text_source(text) for text in texts])
+        self.assertNotEqual(queue.jobs[0][0], queue.jobs[1][0])
+        for (file_path, _), text in zip(queue.jobs, texts):
+            with open(file_path, encoding="utf-8") as text_file:
+                self.assertEqual(text_file.read(), text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from storage import jobs, lexical
+from storage.jobs import IngestionQueue, JobStore
+from storage.lexical import BM25Index
+from storage.local_index import LocalIndex
+
+
+class SharedIndexTest(unittest.TestCase):
+    """
+    An index written by one process and read by another, like the webhook workers.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="indexes-")
+
+    def test_lexical_index_reads_the_documents_of_the_writer(self):
+        path = os.path.join(self.directory, "lexical_index.jsonl")
+        writer, reader = BM25Index(path), BM25Index(path)
+        writer.add_many([("a", "vacation policy", "20 days of vacation")])
+        self.assertFalse(writer.refresh())
+
+        self.assertTrue(reader.refresh())
+        self.assertEqual([content for _, _, content in reader.search("vacation")], ["20 days of vacation"])
+        writer.remove_many(["a"])
+        self.assertTrue(reader.refresh())
+        self.assertEqual(reader.search("vacation"), [])
+        self.assertFalse(reader.refresh())
+
+    def test_lexical_index_log_is_compacted_to_the_live_documents(self):
+        path = os.path.join(self.directory, "lexical_index.jsonl")
+        writer, reader = BM25Index(path, compact_ratio=2), BM25Index(path)
+        with mock.patch.object(lexical, "MIN_COMPACT_ENTRIES", 10):
+            # Every version of the 10 documents replaces the previous one
+            for version in range(20):
+                writer.remove_many([f"doc{number}-v{version - 1}" for number in range(10)])
+                writer.add_many([(f"doc{number}-v{version}", f"vacation policy version {version} part {number}",
+                                  f"version {version} part {number}") for number in range(10)])
+                reader.refresh()
+
+        with open(path, encoding="utf-8") as log_file:
+            self.assertLessEqual(sum(1 for _ in log_file), 2 * 10 + 10)
+        expected = writer.search("vacation version 19 part 3", k=3)
+        self.assertEqual(expected[0][2], "version 19 part 3")
+        self.assertEqual(reader.search("vacation version 19 part 3", k=3), expected)
+        self.assertEqual(BM25Index(path).search("vacation version 19 part 3", k=3), expected)
+        self.assertEqual(len(reader), 10)
+
+    def test_local_index_reads_the_vectors_of_the_writer(self):
+        path = os.path.join(self.directory, "local_index")
+        writer, reader = LocalIndex(path, dimension=2), LocalIndex(path, dimension=2)
+        # More vectors than the initial capacity, so the writer grows the matrix
+        writer.upsert((f"v{number}", [1.0, float(number)], {"number": number}) for number in range(2000))
+        self.assertFalse(writer.refresh())
+
+        self.assertTrue(reader.refresh())
+        self.assertEqual(reader.query([0.0, 1.0], top_k=1)["matches"][0]["id"], "v1999")
+        writer.delete(ids=["v1999"])
+        self.assertTrue(reader.refresh())
+        self.assertEqual(reader.query([0.0, 1.0], top_k=1)["matches"][0]["id"], "v1998")
+        self.assertEqual(reader.describe_index_stats()["total_vector_count"], 1999)
+
+    def test_replaced_indexes_are_read_again_from_the_start(self):
+        lexical_path = os.path.join(self.directory, "lexical_index.jsonl")
+        lexical_reader = BM25Index(lexical_path)
+        BM25Index(lexical_path).add_many([("a", "vacation policy", "20 days of vacation")])
+        lexical_reader.refresh()
+        replacement = BM25Index(os.path.join(self.directory, "replacement.jsonl"))
+        replacement.add_many([(f"b{number}", f"sick leave {number}", f"sick leave {number}") for number in range(5)])
+        os.replace(replacement.path, lexical_path)
+
+        self.assertTrue(lexical_reader.refresh())
+        self.assertEqual(lexical_reader.search("vacation"), [])
+        self.assertEqual(len(lexical_reader), 5)
+
+        path = os.path.join(self.directory, "local_index")
+        reader = LocalIndex(path, dimension=2)
+        LocalIndex(path, dimension=2).upsert([("old", [1.0, 0.0], {})])
+        reader.refresh()
+        snapshot = LocalIndex(os.path.join(self.directory, "other_index"), dimension=2)
+        snapshot.upsert((f"new{number}", [0.0, 1.0], {"number": number}) for number in range(5))
+        snapshot.snapshot(os.path.join(self.directory, "snapshot"))
+        LocalIndex.restore(os.path.join(self.directory, "snapshot"), path, dimension=2)
+
+        self.assertTrue(reader.refresh())
+        self.assertEqual(sorted(ids for page in reader.list() for ids in page),
+                         [f"new{number}" for number in range(5)])
+        self.assertEqual(reader.query([0.0, 1.0], top_k=1)["matches"][0]["score"], 1.0)
+
+
+class SingleWriterQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="jobs-"), "ingestion_jobs.sqlite3")
+
+        async def report(job):
+            pass
+
+        self.writer = IngestionQueue(JobStore(path), report, workers=1)
+        self.submitter = IngestionQueue(JobStore(path), report, workers=0)
+
+    async def asyncTearDown(self):
+        await self.writer.stop()
+
+    async def test_jobs_of_other_processes_run_once_in_the_writer(self):
+        with mock.patch.object(jobs, "update_knowledge_base") as update_knowledge_base:
+            await self.writer.start(resume=False)
+            await self.submitter.start(resume=False)
+            await self.submitter.submit("upload.csv", "upload.csv", 1, 2)
+            self.assertEqual(self.submitter._queue.qsize(), 0)
+
+            # Found by two checks of the store while it runs
+            await self.writer.resume()
+            await self.writer.resume()
+            await self.writer._queue.join()
+
+        update_knowledge_base.assert_called_once()
+        self.assertEqual(update_knowledge_base.call_args.args[:2], ("upload.csv", "upload.csv"))
+        self.assertEqual(self.writer.store.unfinished(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+from sqlalchemy import exc
+from storage.message_log import MessageLog
+from storage.models import Message, SessionLocal, create_tables
+from storage.usage import get_usage
+
+
+class MessageLogTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        create_tables()
+
+    def setUp(self):
+        self.dead_letter_path = os.path.join(tempfile.mkdtemp(prefix="message-log-"), "dead_letters.jsonl")
+        self.message_log = MessageLog(batch_size=1000, flush_interval=3600, max_buffer=10,
+                                      dead_letter_path=self.dead_letter_path)
+        self.user_id = int.from_bytes(os.urandom(4), "little")
+
+    def tearDown(self):
+        self.message_log.close()
+
+    def saved_contents(self):
+        with SessionLocal() as db:
+            return [message.content for message in
+                    db.query(Message).filter(Message.user_id == self.user_id).order_by(Message.id)]
+
+    def dead_letters(self):
+        if not os.path.exists(self.dead_letter_path):
+            return []
+        with open(self.dead_letter_path, encoding="utf-8") as file:
+            return [json.loads(line) for line in file]
+
+    def test_rejected_message_does_not_block_the_others(self):
+        self.message_log.append(self.user_id, None, False, "first", False)
+        # Larger than a 64-bit integer, so the database rejects the row
+        self.message_log.append(2 ** 70, None, False, "rejected", False)
+        self.message_log.append(self.user_id, None, True, "second", False)
+
+        self.assertEqual(self.message_log.flush(), 2)
+        self.assertEqual(self.saved_contents(), ["first", "second"])
+        self.assertEqual([row["content"] for row in self.dead_letters()], ["rejected"])
+        self.assertEqual(self.message_log.pending(), [])
+
+    def test_messages_are_kept_while_the_database_is_unavailable(self):
+        for number in range(3):
+            self.message_log.append(self.user_id, None, False, f"message {number}", False)
+        unavailable = exc.OperationalError("INSERT", {}, Exception("connection refused"))
+        with mock.patch.object(self.message_log, "_insert", side_effect=unavailable):
+            with self.assertRaises(exc.OperationalError):
+                self.message_log.flush()
+
+        self.assertEqual(len(self.message_log.pending(self.user_id)), 3)
+        self.assertEqual(self.dead_letters(), [])
+        self.assertEqual(self.message_log.flush(), 3)
+        self.assertEqual(self.saved_contents(), ["message 0", "message 1", "message 2"])
+
+    def test_buffer_is_bounded(self):
+        for number in range(12):
+            self.message_log.append(self.user_id, None, False, f"message {number}", False)
+
+        pending = self.message_log.pending(self.user_id)
+        self.assertEqual([message.content for message in pending], [f"message {number}" for number in range(2, 12)])
+        self.assertEqual([row["content"] for row in self.dead_letters()], ["message 0", "message 1"])
+
+    def test_saved_messages_are_added_to_the_daily_usage(self):
+        self.message_log.append(self.user_id, None, False, "question", False)
+        self.message_log.append(self.user_id, None, False, "File uploaded: handbook.pdf", False,
+                                file_name="handbook.pdf", file_type="pdf")
+        self.message_log.flush()
+        self.message_log.append(self.user_id, None, True, "answer", False)
+        self.message_log.flush()
+
+        today = datetime.utcnow().date()
+        with SessionLocal() as db:
+            usage = [row for row in get_usage(db, today, today) if row["user_id"] == self.user_id]
+        self.assertEqual(usage, [{"user_id": self.user_id, "request_count": 3, "file_count": 1}])
+
+
+if __name__ == "__main__":
+    unittest.main()
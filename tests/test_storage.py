@@ -0,0 +1,136 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import List
+from langchain_core.embeddings import Embeddings
+from model.cache import AnswerCache
+from model.embeddings import EmbeddingCache, EmbeddingService
+from storage.lexical import BM25Index
+from storage.manifest import IngestionManifest
+from storage.registry import get_registry, init_registry
+from storage.trainers import train_document, train_text
+from storage.utils import count_tabular_rows
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Embeddings model counting the requests it gets and the texts it embeds.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.texts: List[str] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += texts
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class RecordingIndex:
+    """
+    Vector index recording the vectors upserted in it.
+    """
+
+    def __init__(self):
+        self.upserts = 0
+        self.vectors = {}
+
+    def upsert(self, vectors, **kwargs) -> dict:
+        self.upserts += 1
+        self.vectors.update({vector_id: metadata for vector_id, _, metadata in vectors})
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids, **kwargs) -> dict:
+        for vector_id in ids:
+            self.vectors.pop(vector_id, None)
+        return {}
+
+
+class TrainTextTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="train-text-")
+        self.embeddings = CountingEmbeddings()
+        self.index = RecordingIndex()
+        registry = init_registry()
+        registry._embeddings = EmbeddingService(self.embeddings, EmbeddingCache(disk_path=""))
+        registry._lexical_index = BM25Index(os.path.join(directory, "lexical_index.jsonl"))
+        registry._manifest = IngestionManifest(os.path.join(directory, "manifest.sqlite3"))
+        self.text = " ".join(f"Sentence number {number} of the update about the vacation policy."
+                             for number in range(40))
+
+    def test_paragraph_is_embedded_in_one_request(self):
+        train_text(self.text, self.index)
+
+        self.assertEqual(self.embeddings.calls, 1)
+        self.assertEqual(self.index.upserts, 1)
+        # The text is chunked as a whole, not embedded one character at a time
+        self.assertTrue(all(len(text) > 1 for text in self.embeddings.texts))
+        self.assertIn(self.text[:50], self.embeddings.texts[0])
+
+    def test_same_text_is_not_embedded_again(self):
+        train_text(self.text, self.index)
+        ids = set(self.index.vectors)
+        train_text(self.text, self.index)
+
+        self.assertEqual(self.embeddings.calls, 1)
+        self.assertEqual(set(self.index.vectors), ids)
+
+    def test_chunks_are_tagged_with_a_stable_source(self):
+        train_text(self.text, self.index)
+        sources = {metadata["source"] for metadata in self.index.vectors.values()}
+
+        self.assertEqual(len(sources), 1)
+        self.assertTrue(sources.pop().startswith("upd-"))
+
+    def test_new_version_of_a_source_replaces_the_previous_one(self):
+        train_document([("The vacation policy grants 20 days.", {})], self.index, source="handbook.docx")
+        train_document([("The vacation policy grants 25 days.", {})], self.index, source="handbook.docx")
+
+        self.assertEqual([metadata["version"] for metadata in self.index.vectors.values()], [2])
+        self.assertEqual([content for _, _, content in get_registry().lexical_index.search("vacation days")],
+                         ["The vacation policy grants 25 days."])
+
+
+class AnswerCacheTest(unittest.TestCase):
+    def test_answers_are_only_reused_in_their_conversation(self):
+        cache = AnswerCache(threshold=0.95)
+        cache.put((1, False), "How many vacation days?", [1.0, 0.0], "20 days")
+
+        self.assertEqual(cache.get((1, False), "how many vacation days", [0.0, 1.0]), "20 days")
+        self.assertEqual(cache.get((1, False), "Vacation days I have?", [0.99, 0.05]), "20 days")
+        self.assertIsNone(cache.get((2, False), "How many vacation days?", [1.0, 0.0]))
+        self.assertIsNone(cache.get((1, False), "Who is my manager?", [0.0, 1.0]))
+
+
+class EmbeddingServiceTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_queries_are_embedded_in_one_request_and_cached(self):
+        embeddings = CountingEmbeddings()
+        service = EmbeddingService(embeddings, EmbeddingCache(disk_path=""), batch_window=0.01)
+        texts = ["vacation policy", "sick leave", "vacation policy"]
+
+        vectors = await asyncio.gather(*(service.aembed_query(text) for text in texts))
+        self.assertEqual(embeddings.calls, 1)
+        self.assertEqual(sorted(embeddings.texts), ["sick leave", "vacation policy"])
+        self.assertEqual(vectors[0], vectors[2])
+
+        self.assertEqual(await service.aembed_query("sick leave"), vectors[1])
+        self.assertEqual(embeddings.calls, 1)
+
+
+class CountTabularRowsTest(unittest.TestCase):
+    def test_csv_rows_are_counted_without_the_header(self):
+        path = os.path.join(tempfile.mkdtemp(prefix="tabular-"), "faq.csv")
+        for content, rows in (('"Question","Answer"\n', 0), ('"Question","Answer"\n"Vacation?","20 days"\n', 1),
+                              ('"Question","Answer"\r\n"Vacation?","20 days"\r\n"Sick leave?",""', 2)):
+            with open(path, "w", encoding="utf-8", newline="") as csv_file:
+                csv_file.write(content)
+            self.assertEqual(count_tabular_rows(path), rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
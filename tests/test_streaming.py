@@ -0,0 +1,72 @@
+import time
+import unittest
+from typing import List, Optional
+from telegram.constants import MessageLimit
+from telegram.error import NetworkError
+from handlers.streaming import StreamingReply
+
+
+class FakeReply:
+    """
+    Reply of the bot, recording its text, whose edits fail while `error` is set.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.error: Optional[Exception] = None
+
+    async def edit_text(self, text: str) -> None:
+        if self.error is not None:
+            raise self.error
+        self.text = text
+
+
+class FakeMessage:
+    """
+    Message of a user, recording the replies of the bot.
+    """
+
+    def __init__(self):
+        self.replies: List[FakeReply] = []
+
+    async def reply_text(self, text: str) -> FakeReply:
+        self.replies.append(FakeReply(text))
+        return self.replies[-1]
+
+
+class StreamingReplyTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.message = FakeMessage()
+        self.reply = StreamingReply(self.message, interval=0, started=time.monotonic())
+        await self.reply.start()
+
+    async def test_failed_edit_does_not_stop_the_answer(self):
+        self.message.replies[0].error = NetworkError("Timed out")
+        await self.reply.update("The handbook")
+        self.message.replies[0].error = None
+        await self.reply.finish("The handbook says 20 days.")
+
+        self.assertEqual([reply.text for reply in self.message.replies], ["The handbook says 20 days."])
+
+    async def test_error_replaces_a_partial_answer(self):
+        await self.reply.update("The handbook")
+        await self.reply.fail("Error")
+
+        self.assertEqual([reply.text for reply in self.message.replies], ["Error"])
+
+    async def test_error_after_a_long_answer_is_a_new_reply(self):
+        answer = "a" * (MessageLimit.MAX_TEXT_LENGTH + 100)
+        await self.reply.update(answer)
+        await self.reply.fail("Error")
+
+        self.assertEqual([reply.text for reply in self.message.replies],
+                         [answer[:MessageLimit.MAX_TEXT_LENGTH], answer[MessageLimit.MAX_TEXT_LENGTH:], "Error"])
+
+    async def test_error_message_that_cannot_be_shown_is_logged(self):
+        self.message.replies[0].error = NetworkError("Timed out")
+        with self.assertLogs("handlers.streaming", level="WARNING"):
+            await self.reply.fail("Error")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from typing import List, Tuple
+from unittest import mock
+from telegram import Chat, Message, Update
+import bot.setup as setup
+from bot.ordering import ChatOrderedUpdateProcessor
+from bot.webhook import worker_for
+from config import INGEST_JOB_WORKERS
+
+
+def chat_update(update_id: int, chat_id: int) -> Update:
+    return Update(update_id, message=Message(update_id, datetime.now(), Chat(chat_id, Chat.PRIVATE)))
+
+
+class ChatOrderedUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_updates_of_a_chat_run_one_at_a_time_and_other_chats_in_parallel(self):
+        processor = ChatOrderedUpdateProcessor(8)
+        events: List[Tuple[str, int]] = []
+
+        async def handle(update_id: int, seconds: float) -> None:
+            events.append(("start", update_id))
+            await asyncio.sleep(seconds)
+            events.append(("end", update_id))
+
+        # The first update of chat 1 is the slowest, so its second update would finish first if run at once
+        await asyncio.gather(processor.process_update(chat_update(1, 1), handle(1, 0.05)),
+                             processor.process_update(chat_update(2, 1), handle(2, 0.01)),
+                             processor.process_update(chat_update(3, 2), handle(3, 0.01)))
+
+        chat_1 = [event for event in events if event[1] in (1, 2)]
+        self.assertEqual(chat_1, [("start", 1), ("end", 1), ("start", 2), ("end", 2)])
+        # Chat 2 didn't wait for chat 1
+        self.assertLess(events.index(("end", 3)), events.index(("end", 1)))
+        self.assertEqual(processor._locks, {})
+
+
+class WorkerForTest(unittest.TestCase):
+    def test_every_update_of_a_chat_goes_to_the_same_worker(self):
+        for chat_id in (1, 42, -1001234567890):
+            updates = [{"update_id": 1, "message": {"chat": {"id": chat_id}}},
+                       {"update_id": 2, "edited_message": {"chat": {"id": chat_id}}},
+                       {"update_id": 3, "callback_query": {"message": {"chat": {"id": chat_id}}}}]
+            self.assertEqual(len({worker_for(update, 4) for update in updates}), 1)
+
+        # Updates without a chat are spread across the workers
+        self.assertEqual({worker_for({"update_id": update_id, "inline_query": {}}, 4) for update_id in range(4)},
+                         {0, 1, 2, 3})
+
+
+class PostInitTest(unittest.IsolatedAsyncioTestCase):
+    async def test_only_the_first_worker_runs_ingestion_jobs(self):
+        workers = {}
+        for worker_index in (None, 0, 1, 2):
+            queue = mock.Mock(start=mock.AsyncMock())
+            with mock.patch.object(setup, "init_ingestion_queue", return_value=queue) as init_ingestion_queue, \
+                    mock.patch.object(setup, "set_commands", mock.AsyncMock()), \
+                    mock.patch.object(setup, "warm_up_registry"), \
+                    mock.patch.object(setup, "start_background_work", mock.AsyncMock()):
+                await setup.post_init(SimpleNamespace(bot=None, bot_data={"worker_index": worker_index}))
+            workers[worker_index] = init_ingestion_queue.call_args.args[1]
+            queue.start.assert_awaited_once_with(resume=False)
+
+        self.assertEqual(workers, {None: INGEST_JOB_WORKERS, 0: INGEST_JOB_WORKERS, 1: 0, 2: 0})
+
+
+if __name__ == "__main__":
+    unittest.main()